@@ -19,8 +19,10 @@ from src.models.user import User, Achievement
 from src.models.law import Law
 from src.models.progress import UserProgress
 from src.models.comment import UserComment
-from src.models.study import StudySession
+from src.models.study import StudySession, UserStudyRollup
 from src.models.product import Product
+from src.models.cache import CacheVersion
+from src.models.schema import ensure_added_columns
 # --- FIM DA IMPORTAÇÃO DE MODELOS ---
 
 from src.routes.auth import auth_bp
@@ -28,6 +30,19 @@ from src.routes.admin import admin_bp
 from src.routes.student import student_bp
 from src.routes.webhook import webhook_bp
 
+from src.services.access_buffer import access_buffer
+from src.services.autosave import autosave
+from src.services.study_heartbeats import study_heartbeats
+from src.services.law_content import ensure_content_hashes
+from src.services.markups import compact_all_markups
+from src.services.permissions import ensure_concurso_closure, refresh_concurso_closure
+from src.services.search import (
+    backfill_normalized_columns, ensure_normalized_columns, ensure_search_index, rebuild_search_index
+)
+from src.services.streaks import ensure_streaks, rebuild_streaks
+from src.services.study_stats import ensure_study_rollup, rebuild_study_rollup
+from src.services.title_index import title_index
+
 import datetime
 
 load_dotenv()
@@ -119,6 +134,9 @@ migrate.init_app(app, db)
 csrf.init_app(app)
 login_manager.init_app(app)
 mail.init_app(app) # <<< ADICIONADO: Inicializa o Flask-Mail com as configurações acima
+access_buffer.init_app(app) # Acessos do view_law gravados em lote (src/services/access_buffer.py)
+autosave.init_app(app) # Ponto de leitura, anotações e marcações (src/services/autosave.py)
+study_heartbeats.init_app(app) # Sessões de estudo medidas por heartbeat (src/services/study_heartbeats.py)
 # --- Fim da Inicialização ---
 
 def ensure_achievements_exist():
@@ -167,6 +185,10 @@ with app.app_context():
         db.create_all()
         logging.info("Database tables ensured (created if they didn't exist).")
 
+        added_columns = ensure_added_columns()
+        if added_columns:
+            logging.info(f"{added_columns} new columns added to existing tables.")
+
         admin_email = "thalesz@example.com"
         logging.debug(f"Checking for admin user with email: {admin_email}")
         admin_user = User.query.filter_by(email=admin_email).first()
@@ -187,10 +209,85 @@ with app.app_context():
 
         ensure_achievements_exist()
 
+        if ensure_concurso_closure():
+            db.session.commit()
+            logging.info("Concurso closure table populated.")
+
+        normalized_rows = ensure_normalized_columns()
+        if normalized_rows:
+            db.session.commit()
+            logging.info(f"Normalized search columns filled for {normalized_rows} rows.")
+
+        indexed_laws = ensure_search_index()
+        if indexed_laws:
+            db.session.commit()
+            logging.info(f"Search index populated with {indexed_laws} laws.")
+
+        rolled_up_days = ensure_study_rollup()
+        if rolled_up_days:
+            db.session.commit()
+            logging.info(f"Study rollup populated with {rolled_up_days} rows.")
+
+        streak_users = ensure_streaks()
+        if streak_users:
+            db.session.commit()
+            logging.info(f"Study streaks computed for {streak_users} users.")
+
+        hashed_laws = ensure_content_hashes()
+        if hashed_laws:
+            db.session.commit()
+            logging.info(f"Content hashes computed for {hashed_laws} laws.")
+
+        title_index.refresh()
+        logging.info("Title autocomplete index built.")
+
     except Exception as e:
         logging.error(f"An error occurred during database initialization: {e}")
         db.session.rollback()
 
+@app.cli.command("rebuild-concurso-closure")
+def rebuild_concurso_closure_command():
+    """Recalcula a tabela concurso_law_closure a partir das associações atuais."""
+    refresh_concurso_closure()
+    db.session.commit()
+    logging.info("Concurso closure table rebuilt.")
+
+@app.cli.command("rebuild-search-index")
+def rebuild_search_index_command():
+    """Reconstrói os documentos de busca full-text de todas as leis."""
+    indexed_laws = rebuild_search_index()
+    db.session.commit()
+    logging.info(f"Search index rebuilt with {indexed_laws} laws.")
+
+@app.cli.command("backfill-normalized-columns")
+def backfill_normalized_columns_command():
+    """Preenche as colunas de busca sem acentos e refaz os documentos de busca."""
+    counts = backfill_normalized_columns()
+    indexed_laws = rebuild_search_index()
+    db.session.commit()
+    logging.info(f"Normalized columns backfilled: {counts}; search index rebuilt with {indexed_laws} laws.")
+
+@app.cli.command("rebuild-study-rollup")
+def rebuild_study_rollup_command():
+    """Recalcula os totais diários de estudo (user_study_rollup) a partir das sessões."""
+    rows = rebuild_study_rollup()
+    db.session.commit()
+    logging.info(f"Study rollup rebuilt with {rows} rows.")
+
+@app.cli.command("rebuild-study-streaks")
+def rebuild_study_streaks_command():
+    """Recalcula a sequência atual e a maior sequência de todos os usuários."""
+    users = rebuild_streaks()
+    db.session.commit()
+    logging.info(f"Study streaks rebuilt for {users} users.")
+
+@app.cli.command("compact-markups")
+def compact_markups_command():
+    """Incorpora as operações de marcação pendentes às listas de marcações (user_law_markup)."""
+    pairs = compact_all_markups()
+    db.session.commit()
+    logging.info(f"Markups compacted for {pairs} user/law pairs.")
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
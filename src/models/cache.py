@@ -0,0 +1,17 @@
+# src/models/cache.py
+from src.extensions import db
+
+
+class CacheVersion(db.Model):
+    """
+    Contador de versão compartilhado entre os processos da aplicação.
+    Cada cache em memória guarda a versão com que foi construído; quando o admin
+    altera o conteúdo de origem, a versão é incrementada e os caches antigos
+    deixam de ser usados em todos os workers.
+    """
+    __tablename__ = 'cache_version'
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<CacheVersion {self.name}={self.version}>"
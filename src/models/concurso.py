@@ -10,6 +10,18 @@ concurso_law_association = db.Table('concurso_law_association',
     db.Column('law_id', db.Integer, db.ForeignKey('law.id', ondelete="CASCADE"), primary_key=True)
 )
 
+# Tabela desnormalizada (fecho concurso -> conteúdo visível)
+# Para cada concurso guarda todos os ids de lei que ele torna visíveis: os tópicos
+# associados diretamente e os diplomas (pais) que eles implicam, junto com a matéria
+# de cada lei. É mantida pelas rotas do admin (src/services/permissions.py) e permite
+# verificar permissões com uma única consulta indexada.
+concurso_law_closure = db.Table('concurso_law_closure',
+    db.Column('concurso_id', db.Integer, db.ForeignKey('concurso.id', ondelete="CASCADE"), primary_key=True),
+    db.Column('law_id', db.Integer, db.ForeignKey('law.id', ondelete="CASCADE"), primary_key=True),
+    db.Column('subject_id', db.Integer, db.ForeignKey('subject.id', ondelete="SET NULL"), nullable=True),
+    db.Index('ix_concurso_law_closure_law_id', 'law_id')
+)
+
 class Concurso(db.Model):
     """
     Representa um concurso público específico, como 'TJSP - Escrevente 2025'.
@@ -13,24 +13,38 @@ except ImportError:
 # <<< FIM DA ALTERAÇÃO >>>
 # =====================================================================
 from src.extensions import db
-from sqlalchemy.orm import backref
+from sqlalchemy import DDL, event
+from sqlalchemy.orm import backref, validates
+from src.services.text import content_digest, normalize_search_text
 
 class Subject(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), unique=True, nullable=False)
+    # Versão sem acentos/ordinais de 'name', usada pelas buscas (src/services/text.py).
+    name_normalized = db.Column(db.String(100), nullable=True, index=True)
     laws = db.relationship("Law", backref="subject", lazy=True, foreign_keys='Law.subject_id')
 
+    @validates('name')
+    def _sync_name_normalized(self, key, value):
+        self.name_normalized = normalize_search_text(value)
+        return value
+
     def __repr__(self):
         return f"<Subject {self.name}>"
 
 class Law(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
+    # Versão sem acentos/ordinais de 'title', usada pelas buscas (src/services/text.py).
+    title_normalized = db.Column(db.String(200), nullable=True, index=True)
     description = db.Column(db.String(500), nullable=True)
     content = db.Column(db.Text, nullable=False)
+    # sha256 de 'content'; chave do cache de conteúdo compilado (src/services/law_content.py).
+    content_hash = db.Column(db.String(64), nullable=True)
     subject_id = db.Column(db.Integer, db.ForeignKey("subject.id"), nullable=True)
     audio_url = db.Column(db.String(500), nullable=True)
-    parent_id = db.Column(db.Integer, db.ForeignKey('law.id'), nullable=True)
+    # Indexado para as agregações por diploma (GROUP BY parent_id)
+    parent_id = db.Column(db.Integer, db.ForeignKey('law.id'), nullable=True, index=True)
     approved_contribution_id = db.Column(db.Integer, db.ForeignKey('community_contributions.id'), nullable=True)
     juridiques_explanation = db.Column(db.Text, nullable=True)
 
@@ -70,6 +84,16 @@ class Law(db.Model):
     # <<< FIM DA ALTERAÇÃO >>>
     # =====================================================================
 
+    @validates('title')
+    def _sync_title_normalized(self, key, value):
+        self.title_normalized = normalize_search_text(value)
+        return value
+
+    @validates('content')
+    def _sync_content_hash(self, key, value):
+        self.content_hash = content_digest(value)
+        return value
+
     def __repr__(self):
         audio_indicator = " (Audio)" if self.audio_url else ""
         return f"<Law {self.title}{audio_indicator}>"
@@ -84,3 +108,52 @@ class UsefulLink(db.Model):
 
     def __repr__(self):
         return f'<UsefulLink {self.title}>'
+
+
+class LawSearchDocument(db.Model):
+    """
+    Texto pesquisável de uma lei (título + conteúdo sem HTML), mantido pelo admin,
+    junto com as versões normalizadas (sem acentos/ordinais) de ambos.
+    Os índices full-text específicos de cada banco são criados logo abaixo.
+    """
+    __tablename__ = 'law_search_document'
+    law_id = db.Column(db.Integer, db.ForeignKey('law.id', ondelete='CASCADE'), primary_key=True)
+    title = db.Column(db.String(200), nullable=False)
+    body = db.Column(db.Text, nullable=False, default='')
+    title_normalized = db.Column(db.String(200), nullable=False, default='', server_default='')
+    body_normalized = db.Column(db.Text, nullable=False, default='', server_default='')
+
+    @validates('title', 'body')
+    def _sync_normalized(self, key, value):
+        setattr(self, f'{key}_normalized', normalize_search_text(value))
+        return value
+
+    def __repr__(self):
+        return f'<LawSearchDocument Law ID {self.law_id}>'
+
+
+# PostgreSQL: índice GIN sobre o tsvector em português do texto normalizado,
+# para que "codigo" encontre "Código".
+event.listen(
+    LawSearchDocument.__table__, 'after_create',
+    DDL(
+        "CREATE INDEX IF NOT EXISTS ix_law_search_document_fts ON law_search_document "
+        "USING gin (to_tsvector('portuguese', title_normalized || ' ' || body_normalized))"
+    ).execute_if(dialect='postgresql')
+)
+
+# SQLite (desenvolvimento/testes): tabela FTS5 de conteúdo externo + triggers de sincronização.
+# O tokenizer já ignora acentos ('remove_diacritics'), então indexa o texto original.
+for _statement in (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS law_search_fts USING fts5("
+    "title, body, content='law_search_document', content_rowid='law_id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS law_search_document_ai AFTER INSERT ON law_search_document BEGIN "
+    "INSERT INTO law_search_fts(rowid, title, body) VALUES (new.law_id, new.title, new.body); END",
+    "CREATE TRIGGER IF NOT EXISTS law_search_document_ad AFTER DELETE ON law_search_document BEGIN "
+    "INSERT INTO law_search_fts(law_search_fts, rowid, title, body) VALUES ('delete', old.law_id, old.title, old.body); END",
+    "CREATE TRIGGER IF NOT EXISTS law_search_document_au AFTER UPDATE ON law_search_document BEGIN "
+    "INSERT INTO law_search_fts(law_search_fts, rowid, title, body) VALUES ('delete', old.law_id, old.title, old.body); "
+    "INSERT INTO law_search_fts(rowid, title, body) VALUES (new.law_id, new.title, new.body); END",
+):
+    event.listen(LawSearchDocument.__table__, 'after_create', DDL(_statement).execute_if(dialect='sqlite'))
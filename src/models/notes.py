@@ -45,3 +45,25 @@ class UserLawMarkup(db.Model):
 # =====================================================================
 # <<< FIM: NOVA CLASSE >>>
 # =====================================================================
+
+
+class UserLawMarkupOp(db.Model):
+    """
+    Alteração pontual nas marcações de um usuário em uma lei (add/update/remove
+    de uma marcação pelo seu 'id'). A lista completa é UserLawMarkup.content_json
+    com estas operações aplicadas em ordem de id; a compactação
+    (src/services/markups.py) incorpora as operações à lista e as apaga.
+    """
+    __tablename__ = 'user_law_markup_op'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="CASCADE"), nullable=False)
+    law_id = db.Column(db.Integer, db.ForeignKey("law.id", ondelete="CASCADE"), nullable=False)
+    op = db.Column(db.String(10), nullable=False)
+    markup_id = db.Column(db.String(64), nullable=False)
+    data = db.Column(db.JSON, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+    __table_args__ = (db.Index('ix_user_law_markup_op_user_law_id', 'user_id', 'law_id', 'id'),)
+
+    def __repr__(self):
+        return f"<UserLawMarkupOp {self.op} {self.markup_id} User: {self.user_id} Law: {self.law_id}>"
@@ -0,0 +1,73 @@
+# src/models/schema.py
+"""
+Colunas e índices acrescentados a tabelas que já existiam.
+
+db.create_all() só cria as tabelas que faltam; ele não altera as existentes.
+Em um banco já em uso, as colunas novas de 'user', 'law', 'subject' e
+'study_sessions' não existiriam, e a primeira consulta a User falharia com
+"no such column". ensure_added_columns roda na inicialização, logo após o
+create_all, e emite ALTER TABLE ... ADD COLUMN / CREATE INDEX só para o que
+ainda não existe (pode rodar várias vezes).
+
+Toda coluna nova em tabela existente precisa entrar em ADDED_COLUMNS, com
+server_default se for NOT NULL.
+"""
+from sqlalchemy import UniqueConstraint, inspect as sa_inspect
+from sqlalchemy.schema import CreateColumn, CreateIndex
+
+from src.extensions import db
+from src.models.law import Law, Subject
+from src.models.study import StudySession
+from src.models.user import User
+
+ADDED_COLUMNS = (
+    (User, ('full_name_normalized', 'permissions_version', 'seen_announcements_version',
+            'progress_version', 'state_version')),
+    (Law, ('title_normalized', 'content_hash')),
+    (Subject, ('name_normalized',)),
+    (StudySession, ('client_session_id',)),
+)
+
+
+def ensure_added_columns():
+    """
+    Acrescenta as colunas e índices que faltam nas tabelas de ADDED_COLUMNS.
+    Retorna o número de colunas criadas. Faz commit, pois DDL encerra a
+    transação em alguns bancos (MySQL).
+    """
+    connection = db.session.connection()
+    dialect = connection.dialect
+    preparer = dialect.identifier_preparer
+    inspector = sa_inspect(connection)
+    added = 0
+    for model, column_names in ADDED_COLUMNS:
+        table = model.__table__
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for name in column_names:
+            if name in existing_columns:
+                continue
+            column_ddl = CreateColumn(table.c[name]).compile(dialect=dialect)
+            connection.exec_driver_sql(
+                f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {column_ddl}"
+            )
+            added += 1
+
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        existing_indexes.update(
+            constraint['name'] for constraint in inspector.get_unique_constraints(table.name)
+        )
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                connection.execute(CreateIndex(index))
+        for constraint in table.constraints:
+            # Em tabela existente, a restrição única vira um índice único com o
+            # mesmo nome (SQLite não aceita ALTER TABLE ... ADD CONSTRAINT).
+            if isinstance(constraint, UniqueConstraint) and constraint.name \
+                    and constraint.name not in existing_indexes:
+                columns = ', '.join(preparer.quote(column.name) for column in constraint.columns)
+                connection.exec_driver_sql(
+                    f"CREATE UNIQUE INDEX {preparer.quote(constraint.name)} "
+                    f"ON {preparer.format_table(table)} ({columns})"
+                )
+    db.session.commit()
+    return added
@@ -26,6 +26,9 @@ class StudySession(db.Model):
     duration_seconds = db.Column(db.Integer, nullable=False, default=0)
     entry_type = db.Column(db.String(10), nullable=False, default='auto')
     recorded_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Chave gerada pelo navegador: reenviar a mesma sessão não duplica o tempo
+    # (src/services/study_sessions.py). Sessões antigas ficam com NULL.
+    client_session_id = db.Column(db.String(64), nullable=True)
 
     user = db.relationship('User', backref='study_sessions')
     law = db.relationship('Law', backref='study_sessions')
@@ -40,6 +43,7 @@ class StudySession(db.Model):
     # de estatísticas (ex: "tempo estudado na última semana").
     __table_args__ = (
         Index('ix_study_sessions_user_id_recorded_at', 'user_id', 'recorded_at'),
+        db.UniqueConstraint('user_id', 'client_session_id', name='_user_client_session_uc'),
     )
     # =====================================================================
     # <<< FIM DA ALTERAÇÃO 2/2 >>>
@@ -47,3 +51,22 @@ class StudySession(db.Model):
 
     def __repr__(self):
         return f"<StudySession {self.id} | User: {self.user_id} | Law: {self.law_id} | Duration: {self.duration_seconds}s>"
+
+
+class UserStudyRollup(db.Model):
+    """
+    Totais diários de estudo por usuário e matéria, mantidos a cada sessão
+    registrada. 'study_date' é a data local de São Paulo em que a sessão foi
+    registrada. As estatísticas do dashboard somam estas linhas (uma por dia e
+    matéria) em vez de reagregar todo o histórico de 'study_sessions'.
+    """
+    __tablename__ = 'user_study_rollup'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    study_date = db.Column(db.Date, primary_key=True)
+    subject_id = db.Column(db.Integer, db.ForeignKey('subject.id', ondelete='CASCADE'), primary_key=True)
+    total_seconds = db.Column(db.Integer, nullable=False, default=0)
+    session_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<UserStudyRollup User: {self.user_id} | {self.study_date} | Subject: {self.subject_id} | {self.total_seconds}s>"
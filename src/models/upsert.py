@@ -0,0 +1,68 @@
+# src/models/upsert.py
+"""
+INSERT idempotente por dialeto, para as escritas do aluno que antes faziam
+SELECT + INSERT/UPDATE (e às vezes capturavam IntegrityError).
+
+    db.session.execute(upsert(UserNotes, ['user_id', 'law_id'], update=['content', 'updated_at']),
+                       {'user_id': 1, 'law_id': 2, 'content': '...', 'updated_at': agora})
+
+- PostgreSQL e SQLite: INSERT ... ON CONFLICT (...) DO UPDATE / DO NOTHING;
+- MySQL (PyMySQL):     INSERT ... ON DUPLICATE KEY UPDATE / INSERT IGNORE.
+
+'conflict_columns' é a chave única (ou primária) que define o conflito.
+'update' lista as colunas sobrescritas com o valor novo; 'increment' as que
+somam o valor novo ao existente; 'set_' é uma função (colunas atuais, valores
+propostos) -> {coluna: expressão}, para casos como um CASE sobre o status.
+Sem nenhum dos três, o conflito é ignorado. Os valores podem ir em 'values'
+ou como parâmetros do execute (uma lista de dicionários vira um executemany).
+
+Com DO NOTHING / INSERT IGNORE, o rowcount é 1 quando a linha foi inserida e 0
+quando ela já existia.
+"""
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
+from src.extensions import db
+
+_INSERTS = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert,
+    'mysql': mysql.insert,
+    'mariadb': mysql.insert,
+}
+
+
+def _dialect_name():
+    return db.session.get_bind().dialect.name
+
+
+def upsert(model, conflict_columns, update=(), increment=(), set_=None, values=None):
+    dialect = _dialect_name()
+    insert = _INSERTS.get(dialect)
+    if insert is None:
+        raise NotImplementedError(f"upsert não suportado no dialeto '{dialect}'")
+
+    table = sa_inspect(model).local_table if hasattr(model, '__mapper__') else model
+    stmt = insert(table)
+    if values is not None:
+        stmt = stmt.values(values)
+
+    is_mysql = insert is mysql.insert
+    new = stmt.inserted if is_mysql else stmt.excluded
+    assignments = {name: new[name] for name in update}
+    assignments.update({name: table.c[name] + new[name] for name in increment})
+    if set_ is not None:
+        assignments.update(set_(table.c, new))
+
+    if not assignments:
+        if is_mysql:
+            return stmt.prefix_with('IGNORE')
+        return stmt.on_conflict_do_nothing(index_elements=list(conflict_columns))
+    if is_mysql:
+        return stmt.on_duplicate_key_update(assignments)
+    return stmt.on_conflict_do_update(index_elements=list(conflict_columns), set_=assignments)
+
+
+def insert_ignore(model, conflict_columns, values=None):
+    """INSERT que não faz nada se a linha já existir (rowcount 1 = inserida)."""
+    return upsert(model, conflict_columns, values=values)
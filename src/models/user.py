@@ -3,12 +3,15 @@
 # -*- coding: utf-8 -*-
 import datetime
 from datetime import datetime, date
-from sqlalchemy import Index
+from sqlalchemy import Index, func, select, update
+from sqlalchemy.orm.attributes import set_committed_value
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
+from sqlalchemy.orm import validates
 
 # Importa a instância 'db' do arquivo central de extensões.
 from src.extensions import db
+from src.services.text import normalize_search_text
 
 try:
     from .law import Law 
@@ -40,6 +43,8 @@ class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
     full_name = db.Column(db.String(120), nullable=True)
+    # Versão sem acentos de 'full_name', usada na busca de usuários do admin.
+    full_name_normalized = db.Column(db.String(120), nullable=True, index=True)
     phone = db.Column(db.String(20), nullable=True)
     password_hash = db.Column(db.String(256))
     role = db.Column(db.String(10), nullable=False, default="student")
@@ -50,6 +55,18 @@ class User(UserMixin, db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     last_seen = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
     can_see_all_concursos = db.Column(db.Boolean, nullable=False, server_default='true')
+    # Incrementado sempre que os concursos do usuário mudam; faz parte da chave
+    # do cache de permissões (src/services/permissions.py).
+    permissions_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Incrementado quando o usuário marca um aviso como visto; faz parte da chave
+    # do cache de avisos vistos (src/services/announcements.py).
+    seen_announcements_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Incrementado quando o status de um tópico muda; faz parte da chave do
+    # cache de bitsets de progresso (src/services/progress.py).
+    progress_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Incrementado pelas escritas do aluno (progresso, favoritos, lembretes, sessões);
+    # faz parte das ETags das APIs JSON do aluno (src/services/http_cache.py).
+    state_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     associated_concursos = db.relationship(
         'Concurso',
@@ -66,6 +83,11 @@ class User(UserMixin, db.Model):
     study_activities = db.relationship("StudyActivity", backref="user", lazy="dynamic", cascade="all, delete-orphan")
     todo_items = db.relationship("TodoItem", backref="user", lazy="dynamic", cascade="all, delete-orphan")
 
+    @validates('full_name')
+    def _sync_full_name_normalized(self, key, value):
+        self.full_name_normalized = normalize_search_text(value)
+        return value
+
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
 
@@ -74,6 +96,24 @@ class User(UserMixin, db.Model):
             return False
         return check_password_hash(self.password_hash, password)
 
+    def increment_version(self, column):
+        """
+        Incrementa uma das colunas *_version no banco (sem commit) e devolve o
+        valor novo. Um 'v + 1' em Python perderia incrementos concorrentes e
+        deixaria duas versões de dados com a mesma chave de cache/ETag.
+        """
+        attribute = getattr(User, column)
+        stmt = update(User).where(User.id == self.id).values({attribute: func.coalesce(attribute, 0) + 1})
+        options = {'synchronize_session': False}
+        if db.session.get_bind().dialect.update_returning:
+            version = db.session.execute(stmt.returning(attribute), execution_options=options).scalar_one()
+        else:
+            # Sem RETURNING (MySQL): a linha fica travada pelo UPDATE até o commit
+            db.session.execute(stmt, execution_options=options)
+            version = db.session.execute(select(attribute).where(User.id == self.id)).scalar_one()
+        set_committed_value(self, column, version)
+        return version
+
     def __repr__(self):
         return f"<User {self.email}>"
 
@@ -133,6 +173,22 @@ class StudyActivity(db.Model):
         return f'<StudyActivity User {self.user_id} on {self.study_date}>'
 
 
+class UserStudyStreak(db.Model):
+    """
+    Sequência de dias de estudo do usuário, atualizada a cada novo dia em
+    'study_activity' (datas de São Paulo). Evita recalcular a sequência a
+    partir de todo o histórico a cada carregamento do dashboard.
+    """
+    __tablename__ = 'user_study_streak'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    current_streak = db.Column(db.Integer, nullable=False, default=0)
+    longest_streak = db.Column(db.Integer, nullable=False, default=0)
+    last_study_date = db.Column(db.Date, nullable=True)
+
+    def __repr__(self):
+        return f'<UserStudyStreak User {self.user_id}: {self.current_streak} (max {self.longest_streak})>'
+
+
 class LawBanner(db.Model):
     __tablename__ = 'law_banner'
     id = db.Column(db.Integer, primary_key=True)
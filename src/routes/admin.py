@@ -1,14 +1,13 @@
 # src/routes/admin.py
 
 # -*- coding: utf-8 -*-
-from flask import Blueprint, render_template, redirect, url_for, request, flash, current_app
+from flask import Blueprint, render_template, redirect, url_for, request, flash, current_app, jsonify
 from flask_login import login_required, current_user
 from functools import wraps
 from sqlalchemy.orm import joinedload
 from sqlalchemy import or_
 import datetime
 import bleach
-from bleach.css_sanitizer import CSSSanitizer
 
 # Importações completas e corretas
 from src.extensions import db
@@ -16,38 +15,29 @@ from src.extensions import db
 # <<< INÍCIO DA ALTERAÇÃO 1/1: IMPORTANDO O CommunityComment >>>
 # =====================================================================
 # Importamos o CommunityComment para que o SQLAlchemy saiba sobre ele ao fazer as consultas.
-from src.models.user import User, Announcement, UserSeenAnnouncement, LawBanner, UserSeenLawBanner, StudyActivity, TodoItem, CommunityContribution, CommunityComment
+from src.models.user import User, Announcement, UserSeenAnnouncement, LawBanner, UserSeenLawBanner, StudyActivity, UserStudyStreak, TodoItem, CommunityContribution, CommunityComment
 # =====================================================================
 # <<< FIM DA ALTERAÇÃO 1/1 >>>
 # =====================================================================
-from src.models.law import Law, Subject, UsefulLink
+from src.models.law import Law, Subject, UsefulLink, LawSearchDocument
 from src.models.progress import UserProgress
 from src.models.comment import UserComment
-from src.models.notes import UserNotes, UserLawMarkup
+from src.models.notes import UserNotes, UserLawMarkup, UserLawMarkupOp
 from src.models.concurso import Concurso
-from src.models.study import StudySession
+from src.models.study import StudySession, UserStudyRollup
+from src.services.announcements import invalidate_announcements
+from src.services.catalog import get_catalog, invalidate_catalog
+from src.services.permissions import (
+    concurso_ids_for_laws, invalidate_user_permissions, permissions_cache_stats, refresh_concurso_closure
+)
+from src.services.law_content import ALLOWED_ATTRIBUTES, ALLOWED_TAGS, compile_law_content, css_sanitizer
+from src.services.search import autocomplete_cache, index_law
+from src.services.text import normalize_search_text
 
 
 admin_bp = Blueprint("admin", __name__, url_prefix="/admin")
 
-ALLOWED_TAGS = [
-    'p', 'br', 'strong', 'b', 'em', 'i', 'u', 's', 'strike', 
-    'ul', 'ol', 'li', 'a', 'blockquote',
-    'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
-    'span', 'div', 'table', 'thead', 'tbody', 'tr', 'th', 'td'
-]
-ALLOWED_ATTRIBUTES = {
-    '*': ['style', 'class'],
-    'a': ['href', 'title', 'target'],
-    'img': ['src', 'alt', 'height', 'width']
-}
-ALLOWED_STYLES = [
-    'color', 'background-color', 'font-weight', 'font-style', 'text-decoration',
-    'text-align', 'margin', 'margin-top', 'margin-right', 'margin-bottom', 'margin-left',
-    'padding', 'padding-top', 'padding-right', 'padding-bottom', 'padding-left',
-    'border', 'border-left'
-]
-css_sanitizer = CSSSanitizer(allowed_css_properties=ALLOWED_STYLES)
+# Política de sanitização do HTML do editor: src/services/law_content.py
 
 
 def admin_required(f):
@@ -87,31 +77,39 @@ def dashboard():
                            pending_contributions_count=pending_contributions_count 
                            )
 
+# Contadores dos caches em memória deste processo, para dimensioná-los
+@admin_bp.route("/api/cache-stats")
+@login_required
+@admin_required
+def cache_stats():
+    return jsonify(
+        autocomplete=autocomplete_cache.stats(),
+        permissions=permissions_cache_stats()
+    )
+
 # Rota de gerenciamento de conteúdo
 @admin_bp.route('/content-management')
 @login_required
 @admin_required
 def content_management():
     subject_filter = request.args.get("subject_filter", "all")
-    all_subjects = Subject.query.order_by(Subject.name).all()
-    
-    query = Law.query.outerjoin(Subject).filter(Law.parent_id.is_(None)).options(
-        joinedload(Law.children)
-    ).order_by(Subject.name, Law.title)
+    # A árvore vem do snapshot do catálogo, sem carregar o conteúdo das leis.
+    catalog = get_catalog()
+    all_subjects = catalog.subjects_by_name
 
+    diplomas = catalog.diplomas_by_title
     if subject_filter and subject_filter != "all":
         try:
             subject_id = int(subject_filter)
-            query = query.filter(Law.subject_id == subject_id)
+            diplomas = catalog.diplomas_for_subject(subject_id)
         except ValueError:
             if subject_filter == "none":
-                query = query.filter(Law.subject_id.is_(None))
+                diplomas = catalog.diplomas_for_subject(None)
 
-    diplomas = query.all()
-    
     subjects_with_diplomas = {}
     for diploma in diplomas:
-        subject_name = diploma.subject.name if diploma.subject else "Sem Matéria"
+        subject = catalog.subjects.get(diploma.subject_id)
+        subject_name = subject.name if subject else "Sem Matéria"
         if subject_name not in subjects_with_diplomas:
             subjects_with_diplomas[subject_name] = []
         subjects_with_diplomas[subject_name].append(diploma)
@@ -134,6 +132,7 @@ def manage_concursos():
             if not existing_concurso:
                 new_concurso = Concurso(name=concurso_name)
                 db.session.add(new_concurso)
+                invalidate_catalog()
                 db.session.commit()
                 flash(f"Concurso '{concurso_name}' adicionado com sucesso!", "success")
             else:
@@ -160,6 +159,7 @@ def edit_concurso(concurso_id):
         else:
             concurso.name = name
             concurso.edital_verticalizado_url = edital_url if edital_url else None
+            invalidate_catalog()
             db.session.commit()
             flash(f"Concurso '{concurso.name}' atualizado com sucesso!", "success")
             return redirect(url_for("admin.manage_concursos"))
@@ -174,6 +174,8 @@ def delete_concurso(concurso_id):
     concurso = Concurso.query.get_or_404(concurso_id)
     try:
         db.session.delete(concurso)
+        refresh_concurso_closure([concurso_id])
+        invalidate_catalog()
         db.session.commit()
         flash(f"Concurso '{concurso.name}' excluído com sucesso!", "success")
     except Exception as e:
@@ -195,6 +197,7 @@ def manage_subjects():
             if not existing_subject:
                 new_subject = Subject(name=subject_name)
                 db.session.add(new_subject)
+                invalidate_catalog()
                 db.session.commit()
                 flash(f"Matéria '{subject_name}' adicionada com sucesso!", "success")
             else:
@@ -215,6 +218,7 @@ def delete_subject(subject_id):
         flash(f"Não é possível excluir a matéria '{subject.name}', pois ela contém itens de estudo associados.", "danger")
     else:
         db.session.delete(subject)
+        invalidate_catalog()
         db.session.commit()
         flash(f"Matéria '{subject.name}' excluída com sucesso!", "success")
     return redirect(url_for("admin.manage_subjects"))
@@ -264,6 +268,10 @@ def add_law():
             
         db.session.add(new_law)
         db.session.flush()
+        refresh_concurso_closure(c.id for c in new_law.concursos)
+        index_law(new_law)
+        compile_law_content(new_law)
+        invalidate_catalog()
 
         if banner_content:
             new_banner = LawBanner(
@@ -303,6 +311,10 @@ def edit_law(law_id):
     concursos = Concurso.query.order_by(Concurso.name).all()
 
     if request.method == "POST":
+        # Guarda o que influencia as permissões dos alunos para saber se o fecho dos concursos precisa ser recalculado.
+        previous_concurso_ids = {c.id for c in law.concursos}
+        previous_permission_inputs = (previous_concurso_ids, law.parent_id, law.subject_id)
+
         law.title = bleach.clean(request.form.get("title"), tags=[], strip=True)
         law.description = bleach.clean(request.form.get("description"), tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES, css_sanitizer=css_sanitizer)
         law.content = bleach.clean(request.form.get("content"), tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES, css_sanitizer=css_sanitizer)
@@ -338,6 +350,12 @@ def edit_law(law_id):
         selected_concursos = Concurso.query.filter(Concurso.id.in_(concurso_ids)).all()
         law.concursos = selected_concursos
 
+        current_concurso_ids = {c.id for c in law.concursos}
+        if (current_concurso_ids, law.parent_id, law.subject_id) != previous_permission_inputs:
+            # Os concursos dos tópicos filhos também mudam se este diploma trocar de matéria.
+            child_ids = [child_id for child_id, in db.session.query(Law.id).filter(Law.parent_id == law.id)]
+            refresh_concurso_closure(previous_concurso_ids | current_concurso_ids | concurso_ids_for_laws(child_ids))
+
         UsefulLink.query.filter_by(law_id=law.id).delete()
         index = 0
         while f'link-{index}-title' in request.form:
@@ -348,6 +366,9 @@ def edit_law(law_id):
                 db.session.add(new_link)
             index += 1
 
+        index_law(law)
+        compile_law_content(law)
+        invalidate_catalog()
         db.session.commit()
         flash("Item de estudo atualizado com sucesso!", "success")
         return redirect(url_for("admin.content_management"))
@@ -371,12 +392,17 @@ def delete_law(law_id):
         UserComment.query.filter(UserComment.law_id.in_(ids_to_delete)).delete(synchronize_session=False)
         UserNotes.query.filter(UserNotes.law_id.in_(ids_to_delete)).delete(synchronize_session=False)
         UserLawMarkup.query.filter(UserLawMarkup.law_id.in_(ids_to_delete)).delete(synchronize_session=False)
+        UserLawMarkupOp.query.filter(UserLawMarkupOp.law_id.in_(ids_to_delete)).delete(synchronize_session=False)
         UserSeenLawBanner.query.filter(UserSeenLawBanner.law_id.in_(ids_to_delete)).delete(synchronize_session=False)
         LawBanner.query.filter(LawBanner.law_id.in_(ids_to_delete)).delete(synchronize_session=False)
         UsefulLink.query.filter(UsefulLink.law_id.in_(ids_to_delete)).delete(synchronize_session=False)
+        LawSearchDocument.query.filter(LawSearchDocument.law_id.in_(ids_to_delete)).delete(synchronize_session=False)
         UserProgress.query.filter(UserProgress.law_id.in_(ids_to_delete)).delete(synchronize_session=False)
+        affected_concurso_ids = concurso_ids_for_laws(ids_to_delete)
 
         db.session.delete(law)
+        refresh_concurso_closure(affected_concurso_ids)
+        invalidate_catalog()
         db.session.commit()
         flash("Item e todos os seus dados relacionados foram excluídos!", "success")
     except Exception as e:
@@ -395,9 +421,11 @@ def manage_users():
 
     if search_query:
         search_term = f"%{search_query}%"
+        # O nome é comparado sem acentos: "joao" encontra "João".
+        normalized_term = f"%{normalize_search_text(search_query)}%"
         query = query.filter(
             or_(
-                User.full_name.ilike(search_term),
+                User.full_name_normalized.like(normalized_term),
                 User.email.ilike(search_term)
             )
         )
@@ -434,10 +462,13 @@ def deny_user(user_id):
         UserSeenAnnouncement.query.filter_by(user_id=user_id).delete()
         UserSeenLawBanner.query.filter_by(user_id=user_id).delete()
         StudyActivity.query.filter_by(user_id=user_id).delete()
+        UserStudyStreak.query.filter_by(user_id=user_id).delete()
         TodoItem.query.filter_by(user_id=user_id).delete()
         UserNotes.query.filter_by(user_id=user_id).delete()
         UserLawMarkup.query.filter_by(user_id=user_id).delete()
+        UserLawMarkupOp.query.filter_by(user_id=user_id).delete()
         StudySession.query.filter_by(user_id=user_id).delete()
+        UserStudyRollup.query.filter_by(user_id=user_id).delete()
         
         user.achievements = []
         user.favorite_laws = []
@@ -470,6 +501,7 @@ def manage_user_concursos(user_id):
             selected_concursos = Concurso.query.filter(Concurso.id.in_(concurso_ids)).all()
             user.associated_concursos = selected_concursos
 
+        invalidate_user_permissions(user)
         db.session.commit()
         flash(f"As permissões de concurso para {user.email} foram atualizadas com sucesso!", "success")
         return redirect(url_for("admin.manage_users"))
@@ -528,6 +560,7 @@ def manage_announcements():
                     db.session.add(new_announcement)
                     flash("Aviso adicionado com sucesso!", "success")
                 
+                invalidate_announcements()
                 db.session.commit()
             except Exception as e:
                 db.session.rollback()
@@ -544,6 +577,7 @@ def manage_announcements():
 def toggle_announcement(announcement_id):
     announcement = Announcement.query.get_or_404(announcement_id)
     announcement.is_active = not announcement.is_active
+    invalidate_announcements()
     db.session.commit()
     status = "ativado" if announcement.is_active else "desativado"
     flash(f"Aviso '{announcement.title}' foi {status}.", "success")
@@ -556,6 +590,7 @@ def delete_announcement(announcement_id):
     announcement = Announcement.query.get_or_404(announcement_id)
     try:
         db.session.delete(announcement)
+        invalidate_announcements()
         db.session.commit()
         flash("Aviso excluído com sucesso!", "success")
     except Exception as e:
@@ -570,13 +605,14 @@ def delete_announcement(announcement_id):
 def user_details(user_id):
     user = User.query.get_or_404(user_id)
 
-    total_seconds = db.session.query(db.func.sum(StudySession.duration_seconds)).filter_by(user_id=user_id).scalar() or 0
+    total_seconds = db.session.query(db.func.sum(UserStudyRollup.total_seconds)).filter_by(user_id=user_id).scalar() or 0
     hours, remainder = divmod(total_seconds, 3600)
     minutes, _ = divmod(remainder, 60)
     study_time_formatted = f"{int(hours)}h {int(minutes)}min"
 
+    # Só o título da lei é exibido: não carrega 'Law.content'
     progress_items = UserProgress.query.filter_by(user_id=user_id).options(
-        joinedload(UserProgress.law)
+        joinedload(UserProgress.law).load_only(Law.id, Law.title)
     ).order_by(UserProgress.last_accessed_at.desc()).all()
 
     favorite_items = user.favorite_laws.all()
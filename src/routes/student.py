@@ -1,25 +1,49 @@
 # src/blueprints/student.py
 
 # -*- coding: utf-8 -*-
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
+from flask import Blueprint, Response, current_app, render_template, redirect, url_for, flash, request, jsonify, abort, stream_with_context
 from flask_login import login_required, current_user
-# OTIMIZAÇÃO: Importando 'text' e 'and_' para consultas SQL mais complexas
-from sqlalchemy import or_, func, Date, and_, text, case
+from sqlalchemy import DateTime, case, delete, insert, select, update, literal, bindparam
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import joinedload, selectinload
-from datetime import date, timedelta
+from sqlalchemy.orm import defer, joinedload
+from datetime import timedelta
+from itertools import islice
+from typing import NamedTuple
+import base64
 import datetime
+import json
+import re
 import bleach
 from bleach.css_sanitizer import CSSSanitizer
 from src.extensions import db
-from src.models.user import Achievement, Announcement, User, UserSeenAnnouncement, LawBanner, UserSeenLawBanner, StudyActivity, TodoItem, CommunityContribution, CommunityComment
+from src.models.user import Achievement, User, UserSeenAnnouncement, LawBanner, UserSeenLawBanner, TodoItem, CommunityContribution, CommunityComment, favorites_association
 # CORREÇÃO: Removida a importação de 'user_favorite_laws' que causou o erro.
-from src.models.law import Law, Subject
+from src.models.law import Law
 from src.models.progress import UserProgress
-from src.models.notes import UserNotes, UserLawMarkup
+from src.models.notes import UserNotes, UserLawMarkup, UserLawMarkupOp
 from src.models.comment import UserComment
 from src.models.concurso import Concurso
-from src.models.study import StudySession
+from src.models.upsert import insert_ignore, upsert
+from src.services.permissions import (
+    get_permissions, get_permissions_fingerprint, restrict_query, visible_law_clause
+)
+from src.services.access_buffer import access_buffer
+from src.services.announcements import get_active_announcements, get_unseen_announcements, mark_user_announcements_changed
+from src.services.autosave import LAST_READ, NOTES, autosave
+from src.services.catalog import get_catalog, get_catalog_version
+from src.services.http_cache import conditional_etag, mark_user_state_changed
+from src.services.law_content import content_response, get_law_content
+from src.services.markups import append_markup_ops, get_user_markups, parse_markup_ops, replace_markups
+from src.services.progress import ProgressBits, get_progress_bits, record_progress_status, visible_topic_mask
+from src.services.search import autocomplete_cache, search_topics
+from src.services.streaks import get_streak, record_study_activity
+from src.services.study_heartbeats import BEAT, HEARTBEAT_ACTIONS, study_heartbeats
+from src.services.study_sessions import (
+    MAX_SESSIONS_PER_REQUEST, UnknownLaw, existing_client_session_ids, insert_study_sessions, parse_study_session
+)
+from src.services.study_stats import get_daily_study_seconds, get_study_time_by_subject, get_study_time_totals
+from src.services.text import normalize_search_text
+from src.services.title_index import DIPLOMA, SUBJECT, TOPIC, title_index
 import logging
 import pytz
 
@@ -49,26 +73,9 @@ def get_user_permissions():
     """
     Verifica as permissões do usuário logado e retorna os IDs do conteúdo que ele pode ver.
     Retorna None para cada tipo de ID se o usuário puder ver tudo.
+    Os conjuntos vêm do cache de permissões e são imutáveis (frozenset).
     """
-    if current_user.is_authenticated and not current_user.can_see_all_concursos:
-        user_concursos = current_user.associated_concursos.all()
-        allowed_concurso_ids = {c.id for c in user_concursos}
-
-        if not allowed_concurso_ids:
-            return {-1}, {-1}, {-1}
-
-        laws_in_allowed_concursos = db.session.query(Law.id, Law.parent_id, Law.subject_id)\
-            .join(Law.concursos)\
-            .filter(Concurso.id.in_(allowed_concurso_ids)).all()
-        
-        allowed_law_ids = {row.id for row in laws_in_allowed_concursos}
-        allowed_law_ids.update({row.parent_id for row in laws_in_allowed_concursos if row.parent_id})
-        
-        allowed_subject_ids = {row.subject_id for row in laws_in_allowed_concursos if row.subject_id}
-
-        return allowed_concurso_ids, allowed_law_ids, allowed_subject_ids
-
-    return None, None, None
+    return get_permissions(current_user)
 
 
 def _humanize_time_delta(dt):
@@ -166,35 +173,30 @@ def get_user_level_info(points):
 
 @student_bp.route("/api/laws_for_subject/<int:subject_id>")
 @login_required
+@conditional_etag('catalog', 'permissions')
 def get_laws_for_subject(subject_id):
     _, allowed_law_ids, _ = get_user_permissions()
-    
-    laws_query = Law.query.filter(
-        Law.subject_id == subject_id,
-        Law.parent_id.is_(None)
-    )
-
-    if allowed_law_ids is not None:
-        laws_query = laws_query.filter(Law.id.in_(allowed_law_ids))
-    
-    laws = laws_query.order_by(Law.title).all()
-    return jsonify([{"id": law.id, "title": law.title} for law in laws])
+    laws = get_catalog().diplomas_for_subject(subject_id)
+    return jsonify([
+        {"id": law.id, "title": law.title} for law in laws
+        if allowed_law_ids is None or law.id in allowed_law_ids
+    ])
 
 @student_bp.route("/api/topics_for_law/<int:law_id>")
 @login_required
+@conditional_etag('catalog', 'permissions')
 def get_topics_for_law(law_id):
     _, allowed_law_ids, _ = get_user_permissions()
     
     if allowed_law_ids is not None and law_id not in allowed_law_ids:
         return jsonify(error="Acesso não permitido a este diploma."), 403
 
-    topics_query = Law.query.filter_by(parent_id=law_id)
-
-    if allowed_law_ids is not None:
-        topics_query = topics_query.filter(Law.id.in_(allowed_law_ids))
-    
-    topics = topics_query.order_by(Law.id).all()
-    return jsonify([{"id": topic.id, "title": topic.title} for topic in topics])
+    law = get_catalog().laws.get(law_id)
+    topics = law.children if law else ()
+    return jsonify([
+        {"id": topic.id, "title": topic.title} for topic in topics
+        if allowed_law_ids is None or topic.id in allowed_law_ids
+    ])
 
 @student_bp.route("/api/autocomplete_search")
 @login_required
@@ -205,75 +207,91 @@ def autocomplete_search():
     if len(query) < 3:
         return jsonify(results=[])
 
-    allowed_concurso_ids, allowed_law_ids, allowed_subject_ids = get_user_permissions()
+    # Alunos digitam letra a letra e muitos têm os mesmos concursos: a resposta
+    # inteira fica em cache, invalidada quando o catálogo muda.
+    cache_key = (
+        normalize_search_text(query), search_type,
+        get_permissions_fingerprint(current_user), get_catalog_version()
+    )
+    cached_results = autocomplete_cache.get(cache_key)
+    if cached_results is not None:
+        return jsonify(results=cached_results)
+
+    _, allowed_law_ids, allowed_subject_ids = get_user_permissions()
+    # Títulos (tópicos, diplomas e matérias) são respondidos pelo índice em memória;
+    # o banco só é consultado para ocorrências no corpo do texto dos tópicos.
+    title_index.ensure_current()
 
-    search_term = f"%{query}%"
     results = []
     limit = 7
 
     if search_type == 'topic' or search_type == 'all':
-        topics_query = Law.query.filter(
-            Law.parent_id.isnot(None),
-            or_(Law.title.ilike(search_term), Law.content.ilike(search_term))
-        ).options(joinedload(Law.parent))
-        
-        if allowed_law_ids is not None:
-            topics_query = topics_query.filter(Law.id.in_(allowed_law_ids))
-
-        for topic in topics_query.limit(limit).all():
-            parent_title = topic.parent.title if topic.parent else "Tópico"
+        topic_entries = title_index.search(query, {TOPIC}, allowed_law_ids=allowed_law_ids, limit=limit)
+        for entry in topic_entries:
             results.append({
-                "id": topic.id,
-                "title": f"{parent_title} - {topic.title}",
+                "id": entry.id,
+                "title": f"{entry.parent_title or 'Tópico'} - {entry.title}",
                 "category": "Tópico de Lei",
-                "url": url_for('student.view_law', law_id=topic.id)
+                "url": url_for('student.view_law', law_id=entry.id)
             })
 
+        if len(topic_entries) < limit:
+            # Completa com a busca full-text (título + conteúdo sem HTML), ordenada por relevância.
+            body_filters = []
+            law_permission_clause = visible_law_clause(current_user)
+            if law_permission_clause is not None:
+                body_filters.append(law_permission_clause)
+            if topic_entries:
+                body_filters.append(Law.id.notin_([entry.id for entry in topic_entries]))
+            for topic in search_topics(query, filters=body_filters, limit=limit - len(topic_entries)):
+                parent_title = topic["parent_title"] or "Tópico"
+                results.append({
+                    "id": topic["id"],
+                    "title": f"{parent_title} - {topic['title']}",
+                    "category": "Tópico de Lei",
+                    "url": url_for('student.view_law', law_id=topic["id"]),
+                    "snippet": topic["snippet"]
+                })
+
     if search_type != 'topic':
         if search_type == 'all':
             limit = 5 
 
-        laws_query = Law.query.filter(
-            Law.parent_id.is_(None),
-            Law.title.ilike(search_term)
-        )
-        subjects_query = Subject.query.filter(Subject.name.ilike(search_term))
-
-        if allowed_law_ids is not None:
-            laws_query = laws_query.filter(Law.id.in_(allowed_law_ids))
-        if allowed_subject_ids is not None:
-            subjects_query = subjects_query.filter(Subject.id.in_(allowed_subject_ids))
-
-        for law in laws_query.limit(limit).all():
+        for entry in title_index.search(query, {DIPLOMA}, allowed_law_ids=allowed_law_ids, limit=limit):
             results.append({
-                "id": law.id,
-                "title": law.title,
+                "id": entry.id,
+                "title": entry.title,
                 "category": "Diploma Legal",
-                "url": url_for('student.dashboard', diploma_id=law.id, subject_id=law.subject_id)
+                "url": url_for('student.dashboard', diploma_id=entry.id, subject_id=entry.subject_id)
             })
 
-        for subject in subjects_query.limit(limit).all():
+        for entry in title_index.search(query, {SUBJECT}, allowed_subject_ids=allowed_subject_ids, limit=limit):
             results.append({
-                "id": subject.id,
-                "title": subject.name,
+                "id": entry.id,
+                "title": entry.title,
                 "category": "Matéria",
-                "url": url_for('student.dashboard', subject_id=subject.id)
+                "url": url_for('student.dashboard', subject_id=entry.id)
             })
 
     unique_results = []
-    seen_ids = set()
+    seen_keys = set()
     for r in results:
-        if r['id'] not in seen_ids:
+        # Matérias e leis têm sequências de id independentes, então a categoria faz parte da chave.
+        key = (r['category'], r['id'])
+        if key not in seen_keys:
             unique_results.append(r)
-            seen_ids.add(r['id'])
+            seen_keys.add(key)
 
+    autocomplete_cache.set(cache_key, unique_results[:10])
     return jsonify(results=unique_results[:10])
 
 
 @student_bp.route("/api/concurso/<int:concurso_id>/details")
 @login_required
 def get_concurso_details(concurso_id):
-    concurso = Concurso.query.get_or_404(concurso_id)
+    concurso = get_catalog().concursos.get(concurso_id)
+    if concurso is None:
+        abort(404)
     return jsonify(
         success=True,
         edital_url=concurso.edital_verticalizado_url
@@ -293,17 +311,9 @@ def check_and_award_achievements(user):
     return unlocked_achievements_objects
 
 def _record_study_activity(user: User):
-    today = date.today()
-    activity_exists = user.study_activities.filter(StudyActivity.study_date == today).first()
-
-    if not activity_exists:
-        try:
-            new_activity = StudyActivity(user_id=user.id, study_date=today)
-            db.session.add(new_activity)
-            db.session.commit()
-        except Exception as e:
-            db.session.rollback()
-            logging.error(f"Erro ao registrar atividade de estudo para o usuário {user.id}: {e}")
+    # A data do estudo é a de São Paulo, a mesma usada pela sequência e pelos gráficos.
+    # INSERT idempotente (sem commit): quem chama faz o commit junto com o resto.
+    record_study_activity(user.id, _get_brazil_time_now().date())
 
 def _get_brazil_time_now():
     """Função auxiliar para obter a hora atual no fuso horário de São Paulo, que é o padrão para o usuário."""
@@ -314,47 +324,12 @@ def _get_brazil_time_now():
         logging.warning("Fuso horário 'America/Sao_Paulo' não encontrado. Usando UTC como padrão.")
         return datetime.datetime.now(pytz.utc)
 
-def _calculate_user_streak(user: User) -> int:
+def _calculate_user_streak(user: User):
     """
-    OTIMIZAÇÃO: Calcula a sequência de estudos usando uma única e eficiente consulta SQL.
-    Isto é muito mais escalável do que carregar todos os registros em Python.
+    Retorna (sequência atual, maior sequência) lidas de 'user_study_streak',
+    que é atualizada por _record_study_activity.
     """
-    today = _get_brazil_time_now().date()
-    yesterday = today - timedelta(days=1)
-    
-    streak_query = text("""
-        WITH distinct_dates AS (
-            SELECT DISTINCT study_date
-            FROM study_activity
-            WHERE user_id = :user_id AND study_date <= :today
-        ),
-        date_groups AS (
-            SELECT
-                study_date,
-                (study_date - (ROW_NUMBER() OVER (ORDER BY study_date))::integer * INTERVAL '1 day') AS group_start_date
-            FROM distinct_dates
-        ),
-        streaks AS (
-            SELECT
-                group_start_date,
-                COUNT(*) AS streak_length,
-                MAX(study_date) as last_day_of_streak
-            FROM date_groups
-            GROUP BY group_start_date
-        )
-        SELECT streak_length
-        FROM streaks
-        WHERE last_day_of_streak = :today OR last_day_of_streak = :yesterday
-        ORDER BY last_day_of_streak DESC
-        LIMIT 1;
-    """)
-    
-    result = db.session.execute(
-        streak_query,
-        {'user_id': user.id, 'today': today, 'yesterday': yesterday}
-    ).scalar_one_or_none()
-
-    return result or 0
+    return get_streak(user.id, _get_brazil_time_now().date())
 
 @student_bp.route("/dashboard")
 @login_required
@@ -365,65 +340,56 @@ def dashboard():
     Os dados estatísticos pesados (nível, streak, tempo de estudo, etc.) são carregados
     de forma assíncrona por chamadas de API feitas pelo JavaScript.
     """
-    allowed_concurso_ids, allowed_law_ids, allowed_subject_ids = get_user_permissions()
-
-    # Queries para os filtros e para a estrutura inicial da página
-    subjects_query = Subject.query
-    concursos_query = Concurso.query
-    
-    if allowed_subject_ids is not None:
-        subjects_query = subjects_query.filter(Subject.id.in_(allowed_subject_ids))
-    if allowed_concurso_ids is not None:
-        concursos_query = concursos_query.filter(Concurso.id.in_(allowed_concurso_ids))
-
-    subjects_for_filter = subjects_query.order_by(Subject.name).all()
-    concursos_for_filter = concursos_query.order_by(Concurso.name).all()
-
-    # Queries para os anúncios fixos e não fixos (mantido, pois é importante carregar rápido)
-    fixed_announcements = Announcement.query.filter_by(is_active=True, is_fixed=True).order_by(Announcement.created_at.desc()).all()
-    seen_announcement_ids = db.session.query(UserSeenAnnouncement.announcement_id).filter_by(user_id=current_user.id).scalar_subquery()
-    non_fixed_announcements = Announcement.query.filter(
-        Announcement.is_active==True, Announcement.is_fixed==False, Announcement.id.notin_(seen_announcement_ids)
-    ).order_by(Announcement.created_at.desc()).all()
+    # Filtros e estrutura inicial da página vêm do snapshot do catálogo
+    catalog = get_catalog()
+    permissions = get_user_permissions()
+    allowed_concurso_ids, allowed_law_ids, allowed_subject_ids = permissions
+
+    subjects_for_filter = [
+        subject for subject in catalog.subjects_by_name
+        if allowed_subject_ids is None or subject.id in allowed_subject_ids
+    ]
+    concursos_for_filter = [
+        concurso for concurso in catalog.concursos_by_name
+        if allowed_concurso_ids is None or concurso.id in allowed_concurso_ids
+    ]
+
+    # Anúncios fixos e não fixos vêm do cache em memória (src/services/announcements.py)
+    fixed_announcements, _ = get_active_announcements()
+    non_fixed_announcements = get_unseen_announcements(current_user)
     
-    # Query para a seção de favoritos (mantido, pois é o conteúdo principal inicial)
-    favorite_topics_query = current_user.favorite_laws.options(
-        joinedload(Law.parent).joinedload(Law.subject)
-    ).filter(Law.parent_id.isnot(None))
+    # Seção de favoritos: progresso vem dos bitsets do usuário (src/services/progress.py)
+    progress_bits = get_progress_bits(current_user, catalog)
+    favorite_mask = catalog.mask_for_ids(_load_favorite_topic_ids(current_user, catalog))
+    favorite_mask &= visible_topic_mask(catalog, permissions)
 
-    if allowed_law_ids is not None:
-        favorite_topics_query = favorite_topics_query.filter(Law.id.in_(allowed_law_ids))
-    
-    completed_topic_ids = {row.law_id for row in UserProgress.query.filter_by(user_id=current_user.id, status='concluido').with_entities(UserProgress.law_id).all()}
-    in_progress_topic_ids = {row.law_id for row in UserProgress.query.filter_by(user_id=current_user.id, status='em_andamento').with_entities(UserProgress.law_id).all()}
-    
-    favorite_topics = favorite_topics_query.all()
     favorites_by_subject = {}
     grouped_by_law = {}
 
-    for topic in favorite_topics:
-        if topic.parent:
-            if topic.parent not in grouped_by_law:
-                grouped_by_law[topic.parent] = []
-            grouped_by_law[topic.parent].append(topic)
+    for topic in catalog.topics_in_mask(favorite_mask):
+        parent = catalog.laws.get(topic.parent_id)
+        if parent:
+            grouped_by_law.setdefault(parent, []).append(topic)
     
     for law, topics in grouped_by_law.items():
-        subject = law.subject
+        subject = catalog.subjects.get(law.subject_id)
         if not subject: continue
         if subject not in favorites_by_subject:
             favorites_by_subject[subject] = []
-            
-        completed_in_group = sum(1 for topic in topics if topic.id in completed_topic_ids)
-        total_in_group = len(topics)
+
+        group_mask = favorite_mask & catalog.diploma_masks.get(law.id, 0)
+        total_in_group = group_mask.bit_count()
+        completed_in_group = (progress_bits.completed & group_mask).bit_count()
         progress_percentage = (completed_in_group / total_in_group * 100) if total_in_group > 0 else 0
         
         topic_details_list = []
-        for topic in sorted(topics, key=lambda t: t.id):
+        for topic in topics:
+            bit = catalog.topic_bits[topic.id]
             topic_details_list.append({
                 "id": topic.id,
                 "title": topic.title,
-                "is_completed": topic.id in completed_topic_ids,
-                "is_in_progress": topic.id in in_progress_topic_ids,
+                "is_completed": bool(progress_bits.completed & bit),
+                "is_in_progress": bool(progress_bits.in_progress & bit),
             })
 
         favorites_by_subject[subject].append({
@@ -446,144 +412,236 @@ def dashboard():
                            )
 
 
-@student_bp.route("/filter_laws")
-@login_required
-def filter_laws():
-    # Parâmetros da requisição
-    selected_concurso_id_str = request.args.get("concurso_id", "")
-    selected_subject_id_str = request.args.get("subject_id", "")
-    selected_diploma_id_str = request.args.get("diploma_id", "")
-    selected_status = request.args.get("status_filter", "")
-    selected_topic_id_str = request.args.get("topic_id", "")
-    show_favorites = request.args.get("show_favorites", "false").lower() == 'true'
+def _load_favorite_topic_ids(user, catalog):
+    """Ids dos tópicos favoritos do usuário, lidos só da tabela de associação."""
+    rows = db.session.query(favorites_association.c.law_id).filter(favorites_association.c.user_id == user.id).all()
+    return {
+        row.law_id for row in rows
+        if row.law_id in catalog.laws and catalog.laws[row.law_id].parent_id is not None
+    }
 
-    allowed_concurso_ids, allowed_law_ids, _ = get_user_permissions()
 
-    # Query base para os TÓPICOS que serão *exibidos* na lista
-    display_topics_query = Law.query.filter(Law.parent_id.isnot(None))\
-                                    .options(selectinload(Law.parent).joinedload(Law.subject))
+class _LawFilter(NamedTuple):
+    """Resultado dos filtros de filter_laws, como máscaras sobre o índice de tópicos."""
+    catalog: object
+    progress_bits: ProgressBits
+    display_mask: int   # tópicos exibidos
+    context_mask: int   # tópicos que contam no progresso (visíveis e do concurso selecionado)
+    favorite_mask: int
 
-    if allowed_law_ids is not None:
-        display_topics_query = display_topics_query.filter(Law.id.in_(allowed_law_ids))
-    
+
+def _build_law_filter(user, args, permissions, progress_bits=None):
+    """
+    Aplica os filtros da query string de filter_laws. 'permissions' é o
+    resultado de get_user_permissions() e 'progress_bits' pode vir pronto de
+    quem chama (senão vem do cache de src/services/progress.py). Retorna None
+    quando o concurso selecionado não existe.
+
+    Todos os filtros são máscaras de bits sobre o índice denso de tópicos; o
+    progresso de cada diploma é um popcount contra a máscara do diploma.
+    """
+    # Parâmetros da requisição
+    selected_concurso_id_str = args.get("concurso_id", "")
+    selected_subject_id_str = args.get("subject_id", "")
+    selected_diploma_id_str = args.get("diploma_id", "")
+    selected_status = args.get("status_filter", "")
+    selected_topic_id_str = args.get("topic_id", "")
+    show_favorites = args.get("show_favorites", "false").lower() == 'true'
+
+    catalog = get_catalog()
+    if progress_bits is None:
+        progress_bits = get_progress_bits(user, catalog)
+
+    # Tópicos que contam para o progresso: visíveis ao usuário e, se houver, do concurso selecionado
+    context_mask = visible_topic_mask(catalog, permissions)
     selected_concurso_id = int(selected_concurso_id_str) if selected_concurso_id_str.isdigit() else None
     if selected_concurso_id:
-        display_topics_query = display_topics_query.join(Law.concursos).filter(Concurso.id == selected_concurso_id)
+        if selected_concurso_id not in catalog.concursos:
+            return None
+        context_mask &= catalog.concurso_masks[selected_concurso_id]
 
+    # Tópicos candidatos: do diploma, da matéria ou do catálogo inteiro
     selected_diploma_id = int(selected_diploma_id_str) if selected_diploma_id_str.isdigit() else None
+    selected_subject_id = int(selected_subject_id_str) if selected_subject_id_str.isdigit() else None
     if selected_diploma_id:
-        display_topics_query = display_topics_query.filter(Law.parent_id == selected_diploma_id)
+        display_mask = catalog.diploma_masks.get(selected_diploma_id, 0)
+    elif selected_subject_id:
+        display_mask = catalog.subject_masks.get(selected_subject_id, 0)
     else:
-        selected_subject_id = int(selected_subject_id_str) if selected_subject_id_str.isdigit() else None
-        if selected_subject_id:
-            display_topics_query = display_topics_query.join(Subject, Law.subject_id == Subject.id).filter(Subject.id == selected_subject_id)
+        display_mask = catalog.all_topics_mask
+    display_mask &= context_mask
 
     selected_topic_id = int(selected_topic_id_str) if selected_topic_id_str.isdigit() else None
     if selected_topic_id:
-        display_topics_query = display_topics_query.filter(Law.id == selected_topic_id)
-        
-    display_topics_query = display_topics_query.outerjoin(UserProgress, and_(
-        UserProgress.law_id == Law.id,
-        UserProgress.user_id == current_user.id
-    ))
+        display_mask &= catalog.topic_bits.get(selected_topic_id, 0)
 
     if selected_status == 'completed':
-        display_topics_query = display_topics_query.filter(UserProgress.status == 'concluido')
+        display_mask &= progress_bits.completed
     elif selected_status == 'in_progress':
-        display_topics_query = display_topics_query.filter(UserProgress.status == 'em_andamento')
+        display_mask &= progress_bits.in_progress
     elif selected_status == 'not_read':
-        display_topics_query = display_topics_query.filter(UserProgress.id.is_(None))
+        display_mask &= ~progress_bits.touched
 
+    favorite_mask = catalog.mask_for_ids(_load_favorite_topic_ids(user, catalog))
     if show_favorites:
-        display_topics_query = display_topics_query.join(Law.favorite_of_users).filter(User.id == current_user.id)
+        display_mask &= favorite_mask
 
-    # Executa a query para obter os tópicos a serem exibidos
-    all_display_topics = display_topics_query.all()
-    
-    # Se não houver resultados, retorna uma resposta vazia
-    if not all_display_topics:
-        return jsonify(subjects_with_diplomas={})
-
-    # OTIMIZAÇÃO: Carrega o mapa de progresso do usuário de forma eficiente
-    progress_records = db.session.query(UserProgress.law_id, UserProgress.status).filter_by(user_id=current_user.id).all()
-    user_progress_map = {law_id: status for law_id, status in progress_records}
-    favorite_topic_ids = {law.id for law in current_user.favorite_laws if law.parent_id is not None}
-
-    # Agrupa os tópicos a serem exibidos por diploma
-    diplomas_map = {}
-    for topic in all_display_topics:
-        diploma = topic.parent
-        if not diploma: continue
-        
-        if diploma.id not in diplomas_map:
-            diplomas_map[diploma.id] = {
-                "diploma_obj": diploma,
-                "display_children": []
-            }
-        
-        status = user_progress_map.get(topic.id)
-        diplomas_map[diploma.id]["display_children"].append({
+    return _LawFilter(catalog, progress_bits, display_mask, context_mask, favorite_mask)
+
+
+def _build_diploma_block(law_filter, diploma):
+    """Bloco de um diploma na resposta de filter_laws (tópicos exibidos + progresso no contexto)."""
+    catalog, progress_bits, display_mask, context_mask, favorite_mask = law_filter
+    diploma_mask = catalog.diploma_masks.get(diploma.id, 0)
+
+    display_children = []
+    for topic in catalog.topics_in_mask(display_mask & diploma_mask):
+        bit = catalog.topic_bits[topic.id]
+        display_children.append({
             "id": topic.id,
             "title": topic.title,
-            "is_completed": status == 'concluido',
-            "is_in_progress": status == 'em_andamento',
-            "is_favorite": topic.id in favorite_topic_ids
+            "is_completed": bool(progress_bits.completed & bit),
+            "is_in_progress": bool(progress_bits.in_progress & bit),
+            "is_favorite": bool(favorite_mask & bit)
         })
 
-    # OTIMIZAÇÃO LÓGICA: Calcula o progresso com base no contexto do filtro (ex: concurso)
-    all_diploma_ids = list(diplomas_map.keys())
-    
-    # Monta uma query base para buscar todos os tópicos relevantes para os diplomas filtrados
-    context_topics_query = db.session.query(Law.parent_id, Law.id).filter(Law.parent_id.in_(all_diploma_ids))
+    # OTIMIZAÇÃO LÓGICA: Calcula o progresso com base no contexto do filtro (ex: concurso).
+    # O total são os filhos visíveis do diploma (só os do concurso, se houver um selecionado).
+    relevant_mask = diploma_mask & context_mask
+    total_children_in_context = relevant_mask.bit_count()
+    completed_in_context = (progress_bits.completed & relevant_mask).bit_count()
+    progress_percentage = (completed_in_context / total_children_in_context * 100) if total_children_in_context > 0 else 0
 
-    # Se um concurso foi selecionado, o "total" para o cálculo de progresso são os tópicos daquele concurso
-    if selected_concurso_id:
-        context_topics_query = context_topics_query.join(Law.concursos).filter(Concurso.id == selected_concurso_id)
+    subject_name = catalog.subject_name(diploma.subject_id)
+    return {
+        "title": diploma.title,
+        "progress_percentage": progress_percentage,
+        "subject_name": subject_name,
+        "filtered_children": sorted(display_children, key=lambda x: x['title'])
+    }
 
-    if allowed_law_ids is not None:
-        context_topics_query = context_topics_query.filter(Law.id.in_(allowed_law_ids))
 
-    # Agrupa os tópicos de contexto por diploma em um dicionário para consulta rápida
-    context_topics_by_diploma = {}
-    for parent_id, topic_id in context_topics_query.all():
-        context_topics_by_diploma.setdefault(parent_id, set()).add(topic_id)
-        
-    # Itera sobre os diplomas filtrados para calcular a porcentagem correta
-    for diploma_id, data in diplomas_map.items():
-        # Se um contexto (como concurso) foi definido, usa os tópicos relevantes para ele.
-        # Senão, usa todos os tópicos do diploma como total.
-        if selected_concurso_id:
-            relevant_topic_ids = context_topics_by_diploma.get(diploma_id, set())
-        else:
-            # Se não há filtro de concurso, o total são todos os filhos do diploma
-            all_children_ids = {c.id for c in data["diploma_obj"].children}
-            if allowed_law_ids is not None:
-                relevant_topic_ids = all_children_ids.intersection(allowed_law_ids)
-            else:
-                relevant_topic_ids = all_children_ids
-        
-        total_children_in_context = len(relevant_topic_ids)
-        completed_in_context = sum(1 for child_id in relevant_topic_ids if user_progress_map.get(child_id) == 'concluido')
-        
-        progress_percentage = (completed_in_context / total_children_in_context * 100) if total_children_in_context > 0 else 0
-        data['progress_percentage'] = progress_percentage
+def _build_filtered_laws(user, args, permissions, progress_bits=None):
+    """
+    Monta o dicionário 'subjects_with_diplomas' usado por filter_laws e pelo
+    bootstrap do dashboard, a partir do snapshot do catálogo.
+    """
+    law_filter = _build_law_filter(user, args, permissions, progress_bits)
+    if law_filter is None:
+        return {}
+    catalog = law_filter.catalog
 
-    # Estrutura final para a resposta JSON
+    # Diplomas na ordem do primeiro tópico exibido de cada um
     subjects_with_diplomas = {}
-    for diploma_id, data in diplomas_map.items():
-        diploma = data["diploma_obj"]
-        subject_name = diploma.subject.name if diploma.subject else "Sem Matéria"
-        
-        subjects_with_diplomas.setdefault(subject_name, [])
-        
-        subjects_with_diplomas[subject_name].append({
-            "title": diploma.title,
-            "progress_percentage": data['progress_percentage'],
-            "subject_name": subject_name,
-            "filtered_children": sorted(data["display_children"], key=lambda x: x['title'])
-        })
-        
-    return jsonify(subjects_with_diplomas=subjects_with_diplomas)
+    seen_diploma_ids = set()
+    for topic in catalog.topics_in_mask(law_filter.display_mask):
+        if topic.parent_id in seen_diploma_ids:
+            continue
+        seen_diploma_ids.add(topic.parent_id)
+        diploma = catalog.laws.get(topic.parent_id)
+        if not diploma: continue
+
+        block = _build_diploma_block(law_filter, diploma)
+        subjects_with_diplomas.setdefault(block["subject_name"], []).append(block)
+
+    return subjects_with_diplomas
+
+
+def _iter_diploma_blocks(law_filter, after_key=None):
+    """
+    Gera (chave do cursor, bloco) para cada diploma com tópicos exibidos, na
+    ordem de listagem do catálogo (matéria, título, id), a partir de 'after_key'.
+    """
+    catalog = law_filter.catalog
+    display_mask = law_filter.display_mask
+    for diploma in catalog.diplomas_after(after_key):
+        if display_mask & catalog.diploma_masks.get(diploma.id, 0):
+            yield catalog.listing_key(diploma), _build_diploma_block(law_filter, diploma)
+
+
+def _encode_filter_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def _decode_filter_cursor(cursor):
+    """Chave (matéria, título, id) do cursor; ValueError se ele for inválido."""
+    try:
+        subject_name, title, diploma_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError(cursor)
+    if not isinstance(subject_name, str) or not isinstance(title, str) or not isinstance(diploma_id, int):
+        raise ValueError(cursor)
+    return (subject_name, title, diploma_id)
+
+
+FILTER_LAWS_PAGE_SIZE = 20
+FILTER_LAWS_MAX_PAGE_SIZE = 100
+
+
+@student_bp.route("/filter_laws")
+@login_required
+@conditional_etag('catalog', 'permissions', 'user')
+def filter_laws():
+    """
+    Sem 'limit', 'cursor' ou 'format' a resposta é o dicionário completo
+    'subjects_with_diplomas', como sempre foi.
+
+    Paginação: '?limit=N' (máx. 100) devolve só os próximos N diplomas, no
+    mesmo formato, mais 'next_cursor' (None na última página); a página
+    seguinte vem com '&cursor=<next_cursor>'. A ordem é matéria, título do
+    diploma e id.
+
+    Streaming: '?format=ndjson' devolve um diploma por linha assim que ele é
+    montado, na mesma ordem. Com 'limit', a última linha é {"next_cursor": ...}
+    quando houver mais diplomas.
+    """
+    response_format = request.args.get("format", "json")
+    if response_format not in ('json', 'ndjson'):
+        return jsonify(success=False, error="Formato inválido."), 400
+
+    cursor = request.args.get("cursor")
+    limit_str = request.args.get("limit")
+    if response_format == 'json' and cursor is None and limit_str is None:
+        subjects_with_diplomas = _build_filtered_laws(current_user, request.args, get_user_permissions())
+        return jsonify(subjects_with_diplomas=subjects_with_diplomas)
+
+    try:
+        after_key = _decode_filter_cursor(cursor) if cursor else None
+    except ValueError:
+        return jsonify(success=False, error="Cursor inválido."), 400
+    if limit_str is not None:
+        if not limit_str.isdigit() or int(limit_str) < 1:
+            return jsonify(success=False, error="'limit' deve ser um inteiro positivo."), 400
+        limit = min(int(limit_str), FILTER_LAWS_MAX_PAGE_SIZE)
+    else:
+        # No streaming, sem 'limit' vai tudo; na paginação JSON usa o tamanho padrão
+        limit = None if response_format == 'ndjson' else FILTER_LAWS_PAGE_SIZE
+
+    # Permissões, progresso e favoritos são lidos aqui; o gerador só percorre o snapshot
+    law_filter = _build_law_filter(current_user, request.args, get_user_permissions())
+    blocks = _iter_diploma_blocks(law_filter, after_key) if law_filter is not None else iter(())
+
+    if response_format == 'ndjson':
+        def generate():
+            emitted = 0
+            last_key = None
+            for key, block in blocks:
+                if limit is not None and emitted == limit:
+                    yield current_app.json.dumps({"next_cursor": _encode_filter_cursor(last_key)}) + "\n"
+                    return
+                yield current_app.json.dumps(block) + "\n"
+                emitted += 1
+                last_key = key
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                        headers={'X-Accel-Buffering': 'no'})
+
+    page = list(islice(blocks, limit + 1))
+    next_cursor = _encode_filter_cursor(page[limit - 1][0]) if len(page) > limit else None
+    subjects_with_diplomas = {}
+    for _, block in page[:limit]:
+        subjects_with_diplomas.setdefault(block["subject_name"], []).append(block)
+    return jsonify(subjects_with_diplomas=subjects_with_diplomas, next_cursor=next_cursor)
 
 
 @student_bp.route("/law/<int:law_id>")
@@ -594,28 +652,31 @@ def view_law(law_id):
         flash("Você não tem permissão para acessar este tópico.", "danger")
         return redirect(url_for('student.dashboard'))
 
-    law = Law.query.options(joinedload(Law.banner)).get_or_404(law_id)
+    # O texto da lei não vai na página: o view_law.html o busca em get_law_content_fragment
+    law = Law.query.options(joinedload(Law.banner), defer(Law.content)).get_or_404(law_id)
     if law.parent_id is None:
         flash("Selecione um tópico de estudo específico para visualizar.", "info")
         return redirect(url_for('student.dashboard'))
 
-    _record_study_activity(current_user)
     progress = UserProgress.query.filter_by(user_id=current_user.id, law_id=law_id).first()
 
-    # LÓGICA ALTERADA AQUI
-    user_markup = UserLawMarkup.query.filter_by(user_id=current_user.id, law_id=law_id).first()
-    markup_json = user_markup.content_json if user_markup and user_markup.content_json else []
-    display_content = law.content # Sempre começa com o conteúdo limpo da lei
+    # Textos grandes vão por faixas de artigos (get_law_articles), cada uma com as
+    # suas marcações; a lista completa só é buscada se o leitor carregar o texto todo
+    compiled = get_law_content(law.id, law.content_hash)
+    load_by_range = compiled is not None and len(compiled.html) >= LAW_RANGE_MIN_CHARS \
+        and len(compiled.sections) > LAW_ARTICLES_PAGE_SIZE
+    markup_json = [] if load_by_range else get_user_markups(current_user.id, law_id)
 
     is_favorited = law in current_user.favorite_laws
     now = datetime.datetime.utcnow()
-    if progress:
-        progress.last_accessed_at = now
-    else:
+    if not progress:
         progress = UserProgress(user_id=current_user.id, law_id=law_id, status='em_andamento', last_accessed_at=now)
         db.session.add(progress)
-
-    db.session.commit()
+        record_progress_status(current_user, law_id, 'em_andamento')
+        mark_user_state_changed(current_user)
+        db.session.commit()
+    # Horário do acesso e atividade do dia vão para o buffer, gravados em lote
+    access_buffer.record(current_user.id, law_id, now, _get_brazil_time_now().date())
 
     banner_to_show = None
     if law.banner:
@@ -629,26 +690,154 @@ def view_law(law_id):
 
     return render_template("student/view_law.html",
                            law=law, is_completed=(progress.status == 'concluido'),
-                           last_read_article=progress.last_read_article, current_status=progress.status,
+                           last_read_article=autosave.get_pending(current_user.id, law_id, LAST_READ, progress.last_read_article),
+                           current_status=progress.status,
                            is_favorited=is_favorited,
-                           display_content=display_content,
                            markup_json=markup_json, # Envia o JSON de marcações para o frontend
+                           load_by_range=load_by_range,
+                           articles_page_size=LAW_ARTICLES_PAGE_SIZE,
                            banner_to_show=banner_to_show
                            )
 
+@student_bp.route("/law/<int:law_id>/content")
+@login_required
+def get_law_content_fragment(law_id):
+    """
+    Só o HTML do conteúdo da lei, pré-comprimido (br/gzip) e com ETag; é daqui
+    que o view_law.html carrega o texto. Com a lei no snapshot do catálogo e o
+    conteúdo em cache, não consulta o banco.
+    """
+    _, allowed_law_ids, _ = get_user_permissions()
+    if allowed_law_ids is not None and law_id not in allowed_law_ids:
+        return jsonify(success=False, error="Acesso não permitido a este tópico."), 403
+
+    law = get_catalog().laws.get(law_id)
+    compiled = get_law_content(law_id, law.content_hash if law else None)
+    if compiled is None:
+        abort(404)
+    return content_response(compiled)
+
+
+LAW_ARTICLES_PAGE_SIZE = 10
+LAW_ARTICLES_MAX_PAGE_SIZE = 50
+# A partir deste tamanho (HTML sanitizado) o view_law carrega o texto por faixas
+LAW_RANGE_MIN_CHARS = 200_000
+_ARTICLE_NUMBER_RE = re.compile(r'\d+')
+
+
+def _section_for_article(sections, article):
+    """
+    Índice da seção do artigo 'article' (ex.: '5', 'Art. 5º'); senão, da primeira
+    depois dele. 0 sem número de artigo; None se o artigo vem depois da última seção.
+    """
+    match = _ARTICLE_NUMBER_RE.search(article or "")
+    if not match:
+        return 0
+    number = int(match.group())
+    for index, section in enumerate(sections):
+        if section.article is not None and int(section.article) >= number:
+            return index
+    return None
+
+
+@student_bp.route("/law/<int:law_id>/articles")
+@login_required
+def get_law_articles(law_id):
+    """
+    Entrega o conteúdo de tópicos grandes em faixas de artigos. Sem 'section' ou
+    'article', começa no último artigo lido (UserProgress.last_read_article).
+    Junto vão só as marcações e os comentários do usuário que caem nos
+    parágrafos da faixa, com os mesmos ids 'law-p-N' que a página gera.
+
+    O view_law.html usa esta rota para textos com LAW_RANGE_MIN_CHARS ou mais:
+    mostra primeiro a faixa do último artigo lido e busca as vizinhas conforme
+    a rolagem. O texto completo (get_law_content_fragment) só é carregado
+    quando todas as faixas chegaram ou quando o aluno usa uma ferramenta que
+    trabalha sobre o texto inteiro (marcações, busca, restauração, comunidade).
+    """
+    _, allowed_law_ids, _ = get_user_permissions()
+    if allowed_law_ids is not None and law_id not in allowed_law_ids:
+        return jsonify(success=False, error="Acesso não permitido a este tópico."), 403
+
+    law = get_catalog().laws.get(law_id)
+    compiled = get_law_content(law_id, law.content_hash if law else None)
+    if compiled is None:
+        return jsonify(success=False, error="Tópico não encontrado."), 404
+    sections = compiled.sections
+
+    try:
+        count = min(int(request.args.get('count', LAW_ARTICLES_PAGE_SIZE)), LAW_ARTICLES_MAX_PAGE_SIZE)
+        if count < 1:
+            raise ValueError
+        if 'section' in request.args:
+            first = int(request.args['section'])
+            if not 0 <= first < len(sections):
+                raise ValueError
+        else:
+            article = request.args.get('article') or autosave.get_pending(current_user.id, law_id, LAST_READ)
+            if article is None:
+                article = db.session.query(UserProgress.last_read_article).filter_by(
+                    user_id=current_user.id, law_id=law_id
+                ).scalar()
+            first = _section_for_article(sections, article)
+            if first is None:
+                if request.args.get('article'):
+                    return jsonify(success=False, error="Artigo não encontrado."), 404
+                # O último artigo lido pode não existir mais depois de uma edição da lei
+                first = 0
+    except ValueError:
+        return jsonify(success=False, error="Parâmetros inválidos."), 400
+
+    selected = sections[first:first + count]
+    # O <p> da descrição vem antes do conteúdo na página e também recebe um id 'law-p-N'
+    offset = 1 if law is not None and law.description else 0
+    anchors = compiled.anchors[selected[0].first_anchor:selected[-1].first_anchor + selected[-1].anchor_count]
+    paragraph_ids = [anchor.element_id or f"law-p-{anchor.position + offset}" for anchor in anchors]
+    paragraph_id_set = set(paragraph_ids)
+
+    markups = [
+        annotation for annotation in get_user_markups(current_user.id, law_id)
+        if isinstance(annotation, dict) and annotation.get('paragraphId') in paragraph_id_set
+    ]
+    comments = UserComment.query.filter(
+        UserComment.user_id == current_user.id,
+        UserComment.law_id == law_id,
+        UserComment.anchor_paragraph_id.in_(paragraph_id_set)
+    ).all() if paragraph_id_set else []
+
+    next_section = first + len(selected)
+    return jsonify(
+        success=True,
+        html=compiled.html[selected[0].start:selected[-1].end],
+        first_section=first,
+        next_section=next_section if next_section < len(sections) else None,
+        previous_section=max(first - count, 0) if first > 0 else None,
+        total_sections=len(sections),
+        articles=[section.article for section in selected if section.article is not None],
+        paragraph_ids=paragraph_ids,
+        markups=markups,
+        comments=[{"id": c.id, "content": c.content, "anchor_paragraph_id": c.anchor_paragraph_id} for c in comments],
+    )
+
+
 @student_bp.route("/law/toggle_favorite/<int:law_id>", methods=["POST"])
 @login_required
 def toggle_favorite(law_id):
-    law = Law.query.get_or_404(law_id)
+    if law_id not in get_catalog().laws:
+        abort(404)
     try:
-        if law in current_user.favorite_laws:
-            current_user.favorite_laws.remove(law)
-            db.session.commit()
-            return jsonify(success=True, favorited=False)
-        else:
-            current_user.favorite_laws.append(law)
-            db.session.commit()
-            return jsonify(success=True, favorited=True)
+        # Um DELETE; só se não havia favorito, um INSERT idempotente
+        removed = db.session.execute(delete(favorites_association).where(
+            favorites_association.c.user_id == current_user.id,
+            favorites_association.c.law_id == law_id
+        )).rowcount
+        if not removed:
+            db.session.execute(insert_ignore(
+                favorites_association, ['user_id', 'law_id'], values={'user_id': current_user.id, 'law_id': law_id}
+            ))
+        mark_user_state_changed(current_user)
+        db.session.commit()
+        return jsonify(success=True, favorited=not removed)
     except Exception as e:
         db.session.rollback()
         return jsonify(success=False, error=str(e)), 500
@@ -665,6 +854,8 @@ def mark_complete(law_id):
             progress = UserProgress(user_id=current_user.id, law_id=law_id)
             db.session.add(progress)
         progress.status = 'concluido'
+        record_progress_status(current_user, law_id, 'concluido')
+        mark_user_state_changed(current_user)
         if not progress.completed_at:
             progress.completed_at = datetime.datetime.utcnow()
         if should_award_points:
@@ -700,7 +891,10 @@ def review_law(law_id):
     progress = UserProgress.query.filter_by(user_id=current_user.id, law_id=law_id).first()
     if not progress:
         return jsonify(success=False, error="Progresso não encontrado."), 404
-    progress.status = 'em_andamento'
+    if progress.status != 'em_andamento':
+        progress.status = 'em_andamento'
+        record_progress_status(current_user, law_id, 'em_andamento')
+        mark_user_state_changed(current_user)
     try:
         db.session.commit()
         return jsonify(success=True, new_status='em_andamento')
@@ -714,35 +908,54 @@ def save_last_read(law_id):
     last_read_article = bleach.clean(request.form.get("last_read_article", "").strip(), tags=[], strip=True)
     if not last_read_article:
         return jsonify(success=False, error="Campo obrigatório"), 400
-    progress = UserProgress.query.filter_by(user_id=current_user.id, law_id=law_id).first()
-    if not progress:
-        progress = UserProgress(user_id=current_user.id, law_id=law_id, status='em_andamento')
-        db.session.add(progress)
-    progress.last_read_article = last_read_article
-    progress.last_accessed_at = datetime.datetime.utcnow()
-    if progress.status != 'concluido':
-        progress.status = 'em_andamento'
+    # Tópico já iniciado ou concluído (bitsets em cache, sem consulta): só o ponto
+    # de leitura muda, e ele vai para o autosave
+    bit = get_catalog().topic_bits.get(law_id)
+    progress_bits = get_progress_bits(current_user)
+    if bit is not None and (progress_bits.completed | progress_bits.in_progress) & bit:
+        autosave.save(current_user.id, law_id, LAST_READ, last_read_article)
+        return jsonify(success=True, message="Ponto de leitura salvo!")
+
+    autosave.discard(current_user.id, law_id, LAST_READ)
+    if law_id not in get_catalog().laws:
+        abort(404)
+    # O cache de bits pode estar atrasado: o status real decide se houve mudança
+    previous_status = db.session.query(UserProgress.status).filter_by(
+        user_id=current_user.id, law_id=law_id
+    ).with_for_update().scalar()
+    # Cria o progresso ou o coloca 'em_andamento' (se não estiver concluído) em um único upsert
+    db.session.execute(upsert(
+        UserProgress, ['user_id', 'law_id'], update=['last_read_article', 'last_accessed_at'],
+        set_=lambda current, new: {'status': case(
+            (current.status.in_(('concluido', 'em_andamento')), current.status), else_=new.status
+        )},
+        values={
+            'user_id': current_user.id, 'law_id': law_id, 'status': 'em_andamento',
+            'last_read_article': last_read_article, 'last_accessed_at': datetime.datetime.utcnow(),
+        }
+    ))
+    if previous_status not in ('concluido', 'em_andamento'):
+        record_progress_status(current_user, law_id, 'em_andamento')
+    mark_user_state_changed(current_user)
     db.session.commit()
     return jsonify(success=True, message="Ponto de leitura salvo!")
 
 @student_bp.route("/announcement/<int:announcement_id>/mark_seen", methods=["POST"])
 @login_required
 def mark_announcement_seen(announcement_id):
-    # A verificação inicial é mantida para otimizar e evitar trabalho desnecessário do banco.
-    existing = UserSeenAnnouncement.query.filter_by(user_id=current_user.id, announcement_id=announcement_id).first()
-    if not existing:
-        try:
-            # Tentamos criar e salvar o novo registro.
-            seen = UserSeenAnnouncement(user_id=current_user.id, announcement_id=announcement_id)
-            db.session.add(seen)
-            db.session.commit()
-        except IntegrityError:
-            # Se a 'IntegrityError' ocorrer, significa que a condição de corrida aconteceu.
-            # Outra requisição já inseriu o registro entre nossa checagem 'if not existing' e o 'commit'.
-            # Revertemos a transação atual que falhou para manter a sessão do banco limpa.
-            db.session.rollback()
-            # Não fazemos mais nada, pois o estado desejado (registro existe) foi alcançado.
-    
+    try:
+        # INSERT idempotente: rowcount 0 significa que o aviso já estava marcado como visto
+        inserted = db.session.execute(insert_ignore(
+            UserSeenAnnouncement, ['user_id', 'announcement_id'],
+            values={'user_id': current_user.id, 'announcement_id': announcement_id}
+        )).rowcount
+        if inserted:
+            mark_user_announcements_changed(current_user)
+        db.session.commit()
+    except IntegrityError:
+        # Aviso inexistente (chave estrangeira): não há o que marcar.
+        db.session.rollback()
+
     # Independentemente se fomos nós que inserimos ou se já existia, o resultado é um sucesso.
     return jsonify(success=True)
 
@@ -752,79 +965,85 @@ def mark_banner_seen(law_id):
     law = Law.query.options(joinedload(Law.banner)).get_or_404(law_id)
     if not law.banner:
         return jsonify(success=False, error="Banner não encontrado."), 404
-    banner_timestamp = law.banner.last_updated
-    existing_seen = UserSeenLawBanner.query.filter_by(
-        user_id=current_user.id,
-        law_id=law.id,
-        seen_at_timestamp=banner_timestamp
-    ).first()
-    if not existing_seen:
-        seen_record = UserSeenLawBanner(
-            user_id=current_user.id,
-            law_id=law.id,
-            seen_at_timestamp=banner_timestamp
-        )
-        db.session.add(seen_record)
-        try:
-            db.session.commit()
-        except Exception as e:
-            db.session.rollback()
-            logging.error(f"Erro ao salvar 'seen banner' para user {current_user.id} e law {law_id}: {e}")
-            return jsonify(success=False, error="Erro ao salvar no banco de dados."), 500
+    try:
+        db.session.execute(insert_ignore(
+            UserSeenLawBanner, ['user_id', 'law_id', 'seen_at_timestamp'],
+            values={'user_id': current_user.id, 'law_id': law.id, 'seen_at_timestamp': law.banner.last_updated}
+        ))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Erro ao salvar 'seen banner' para user {current_user.id} e law {law_id}: {e}")
+        return jsonify(success=False, error="Erro ao salvar no banco de dados."), 500
     return jsonify(success=True)
 
 @student_bp.route("/law/<int:law_id>/notes", methods=["GET", "POST"])
 @login_required
 def handle_user_notes(law_id):
     if request.method == "GET":
-        notes = UserNotes.query.filter_by(user_id=current_user.id, law_id=law_id).first()
-        return jsonify(success=True, content=notes.content if notes else "")
+        content = autosave.get_pending(current_user.id, law_id, NOTES)
+        if content is None:
+            notes = UserNotes.query.filter_by(user_id=current_user.id, law_id=law_id).first()
+            content = notes.content if notes else ""
+        return jsonify(success=True, content=content)
     if request.method == "POST":
         untrusted_content = request.json.get("content") or ""
         sanitized_content = bleach.clean(untrusted_content, tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES, css_sanitizer=css_sanitizer, strip=True)
-        notes = UserNotes.query.filter_by(user_id=current_user.id, law_id=law_id).first()
-        if notes:
-            notes.content = sanitized_content
-        else:
-            notes = UserNotes(user_id=current_user.id, law_id=law_id, content=sanitized_content)
-            db.session.add(notes)
-        db.session.commit()
+        autosave.save(current_user.id, law_id, NOTES, sanitized_content)
         return jsonify(success=True, message="Anotações salvas!")
 
 @student_bp.route("/law/<int:law_id>/save_markup", methods=['POST'])
 @login_required
 def save_law_markup(law_id):
-    Law.query.get_or_404(law_id)
+    if law_id not in get_catalog().laws:
+        abort(404)
 
     # A nova lógica espera uma lista de marcações em JSON
     markup_data = request.json.get("markups")
     if markup_data is None or not isinstance(markup_data, list):
         return jsonify({'success': False, 'error': 'Formato de dados de marcação inválido.'}), 400
 
+    # Gravada na hora, não no autosave: a lista substitui as operações anteriores
+    # e precisa ser serializada com a compactação pelo banco (src/services/markups.py)
     try:
-        user_markup = UserLawMarkup.query.filter_by(user_id=current_user.id, law_id=law_id).first()
+        replace_markups(current_user.id, law_id, markup_data)
+        db.session.commit()
+        return jsonify({'success': True, 'message': 'Marcações salvas com sucesso.'})
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Erro ao salvar as marcações da law_id {law_id} para o usuário {current_user.id}: {e}")
+        return jsonify(success=False, error='Um erro interno ocorreu ao salvar as marcações.'), 500
 
-        if user_markup:
-            # Atualiza a coluna JSON
-            user_markup.content_json = markup_data
-            # Por segurança, limpamos a coluna antiga para não usá-la mais para este usuário/lei
-            user_markup.content = "deprecated" 
-        else:
-            # Cria um novo registro já com a coluna JSON
-            new_markup = UserLawMarkup(
-                user_id=current_user.id,
-                law_id=law_id,
-                content_json=markup_data,
-                content="deprecated" # Marcamos a coluna antiga como não utilizada
-            )
-            db.session.add(new_markup)
+@student_bp.route("/law/<int:law_id>/markups", methods=['GET'])
+@login_required
+def get_law_markups(law_id):
+    """Lista completa de marcações (base + operações), para o leitor que carregou o texto por faixas."""
+    if law_id not in get_catalog().laws:
+        abort(404)
+    return jsonify(success=True, markups=get_user_markups(current_user.id, law_id))
 
+@student_bp.route("/law/<int:law_id>/markups", methods=['PATCH'])
+@login_required
+def patch_law_markups(law_id):
+    """
+    Aplica operações pontuais nas marcações (add/update/remove pelo 'id'),
+    sem reenviar nem regravar a lista inteira.
+    """
+    if law_id not in get_catalog().laws:
+        abort(404)
+    try:
+        ops = parse_markup_ops(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify(success=False, error=str(e)), 400
+
+    try:
+        compacted = append_markup_ops(current_user.id, law_id, ops)
         db.session.commit()
-        return jsonify({'success': True, 'message': 'Marcações salvas com sucesso.'})
+        return jsonify(success=True, message='Marcações salvas com sucesso.', applied=len(ops), compacted=compacted)
     except Exception as e:
         db.session.rollback()
-        logging.error(f"Erro ao salvar marcações JSON para law_id {law_id} para o usuário {current_user.id}: {e}")
-        return jsonify({'success': False, 'error': 'Um erro interno ocorreu ao salvar as marcações.'}), 500
+        logging.error(f"Erro ao aplicar operações de marcação para law_id {law_id} para o usuário {current_user.id}: {e}")
+        return jsonify(success=False, error='Um erro interno ocorreu ao salvar as marcações.'), 500
 
 @student_bp.route("/law/<int:law_id>/comments", methods=["GET", "POST"])
 @login_required
@@ -864,12 +1083,110 @@ def handle_single_comment(comment_id):
         db.session.commit()
         return jsonify(success=True, message="Anotação excluída!")
 
+COMMENT_BATCH_MAX_OPS = 500
+
+
+def _parse_comment_ops(payload):
+    """
+    Valida {"ops": [{"op": "create", "client_id": ..., "content": ..., "anchor_paragraph_id": ...},
+    {"op": "update", "id": ..., "content": ...}, {"op": "delete", "id": ...}]}.
+    Retorna (criações, {id: conteúdo}, ids a excluir) ou levanta ValueError.
+    """
+    raw_ops = payload.get("ops") if isinstance(payload, dict) else None
+    if not isinstance(raw_ops, list) or not raw_ops:
+        raise ValueError("Envie uma lista 'ops' com ao menos uma operação.")
+    if len(raw_ops) > COMMENT_BATCH_MAX_OPS:
+        raise ValueError(f"No máximo {COMMENT_BATCH_MAX_OPS} operações por requisição.")
+
+    creates, updates, deletes = [], {}, set()
+    for raw in raw_ops:
+        op = raw.get("op") if isinstance(raw, dict) else None
+        if op == "create":
+            content = bleach.clean(str(raw.get("content") or ""), tags=[], strip=True)
+            anchor_id = bleach.clean(str(raw.get("anchor_paragraph_id") or ""), tags=[], strip=True)
+            if not content or not anchor_id or len(anchor_id) > 50:
+                raise ValueError("Conteúdo e âncora são obrigatórios.")
+            creates.append((raw.get("client_id"), content, anchor_id))
+            continue
+        if op not in ("update", "delete") or not isinstance(raw.get("id"), int):
+            raise ValueError("Operação inválida.")
+        if op == "update":
+            updates[raw["id"]] = bleach.clean(str(raw.get("content") or ""), tags=[], strip=True)
+        else:
+            deletes.add(raw["id"])
+    # Um comentário excluído no mesmo lote não precisa ser atualizado antes
+    for comment_id in deletes:
+        updates.pop(comment_id, None)
+    return creates, updates, deletes
+
+@student_bp.route("/law/<int:law_id>/comments/batch", methods=["POST"])
+@login_required
+def batch_comments(law_id):
+    """
+    Aplica várias criações, edições e exclusões de anotações de parágrafo de uma
+    lei em uma única transação. Se algum id não for do usuário nesta lei, nada é
+    aplicado.
+    """
+    try:
+        creates, updates, deletes = _parse_comment_ops(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify(success=False, error=str(e)), 400
+
+    try:
+        target_ids = set(updates) | deletes
+        if target_ids:
+            owned_ids = set(db.session.scalars(select(UserComment.id).where(
+                UserComment.id.in_(target_ids),
+                UserComment.user_id == current_user.id,
+                UserComment.law_id == law_id
+            )))
+            if owned_ids != target_ids:
+                return jsonify(success=False, error="Anotação não encontrada.", missing_ids=sorted(target_ids - owned_ids)), 404
+
+        # Criações: o flush do ORM agrupa os INSERTs (insertmanyvalues com RETURNING no PostgreSQL)
+        new_comments = [
+            UserComment(content=content, anchor_paragraph_id=anchor_id, user_id=current_user.id, law_id=law_id)
+            for _, content, anchor_id in creates
+        ]
+        db.session.add_all(new_comments)
+        db.session.flush()
+
+        if updates:
+            db.session.connection().execute(
+                update(UserComment)
+                .where(UserComment.id == bindparam("b_id"))
+                .values(content=bindparam("b_content")),
+                [{"b_id": comment_id, "b_content": content} for comment_id, content in updates.items()]
+            )
+        if deletes:
+            db.session.execute(
+                delete(UserComment).where(UserComment.id.in_(deletes)),
+                execution_options={"synchronize_session": False}
+            )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Erro ao aplicar lote de anotações para law_id {law_id} para o usuário {current_user.id}: {e}")
+        return jsonify(success=False, error="Um erro interno ocorreu ao salvar as anotações."), 500
+
+    return jsonify(
+        success=True,
+        message="Anotações salvas!",
+        created=[
+            {"client_id": client_id, "id": comment.id, "content": comment.content, "anchor_paragraph_id": comment.anchor_paragraph_id}
+            for (client_id, _, _), comment in zip(creates, new_comments)
+        ],
+        updated=sorted(updates),
+        deleted=sorted(deletes)
+    )
+
 @student_bp.route("/law/<int:law_id>/restore", methods=['POST'])
 @login_required
 def restore_law_to_original(law_id):
     Law.query.get_or_404(law_id)
     try:
         UserLawMarkup.query.filter_by(user_id=current_user.id, law_id=law_id).delete()
+        UserLawMarkupOp.query.filter_by(user_id=current_user.id, law_id=law_id).delete()
         UserComment.query.filter_by(user_id=current_user.id, law_id=law_id).delete()
         db.session.commit()
         return jsonify({'success': True, 'message': 'Lei restaurada com sucesso.'})
@@ -914,15 +1231,17 @@ def _serialize_todo_item(item):
         **law_info
     }
 
+def _build_todo_items(user):
+    todo_items = user.todo_items.options(
+        joinedload(TodoItem.law).joinedload(Law.parent)
+    ).order_by(TodoItem.is_completed.asc(), TodoItem.created_at.desc()).all()
+    return [_serialize_todo_item(item) for item in todo_items]
+
 @student_bp.route("/api/todo_items", methods=["GET"])
 @login_required
+@conditional_etag('catalog', 'user')
 def get_todo_items():
-    todo_items = current_user.todo_items.options(
-        joinedload(TodoItem.law).joinedload(Law.parent)
-    ).order_by(TodoItem.is_completed.asc(), TodoItem.created_at.desc()).all()
-    
-    items_data = [_serialize_todo_item(item) for item in todo_items]
-    return jsonify(success=True, todo_items=items_data)
+    return jsonify(success=True, todo_items=_build_todo_items(current_user))
 
 @student_bp.route("/api/todo_items", methods=["POST"])
 @login_required
@@ -956,6 +1275,7 @@ def add_todo_item():
     )
     try:
         db.session.add(new_item)
+        mark_user_state_changed(current_user)
         db.session.commit()
         db.session.refresh(new_item)
         return jsonify(
@@ -980,6 +1300,7 @@ def toggle_todo_item(item_id):
     
     item.is_completed = not item.is_completed
     item.completed_at = datetime.datetime.utcnow() if item.is_completed else None
+    mark_user_state_changed(current_user)
     try:
         db.session.commit()
         message = "Item marcado como concluído!" if item.is_completed else "Item reaberto!"
@@ -1001,6 +1322,7 @@ def delete_todo_item(item_id):
         return jsonify(success=False, error="Tarefa não encontrada."), 404
     try:
         db.session.delete(item)
+        mark_user_state_changed(current_user)
         db.session.commit()
         return jsonify(success=True, message="Tarefa excluída!")
     except Exception as e:
@@ -1039,85 +1361,129 @@ def set_default_concurso():
 @student_bp.route("/api/study_sessions/record", methods=["POST"])
 @login_required
 def record_study_session():
-    data = request.get_json()
-    
-    law_id = data.get('law_id')
-    duration_seconds = data.get('duration_seconds')
-    entry_type = data.get('entry_type', 'auto')
-
-    if not law_id or duration_seconds is None:
-        return jsonify(success=False, error="law_id e duration_seconds são obrigatórios."), 400
-    
+    data = request.get_json(silent=True) or {}
     try:
-        law_id = int(law_id)
-        duration_seconds = int(duration_seconds)
-    except ValueError:
-        return jsonify(success=False, error="law_id e duration_seconds devem ser números inteiros."), 400
-    
-    if duration_seconds <= 0:
-        return jsonify(success=False, error="A duração da sessão deve ser maior que zero."), 400
-
-    law = Law.query.get(law_id)
-    if not law:
+        session_row = parse_study_session(data, get_catalog())
+    except UnknownLaw:
         return jsonify(success=False, error="Lei não encontrada."), 404
+    except ValueError as e:
+        return jsonify(success=False, error=str(e)), 400
 
-    subject_id = law.subject_id
-    if not subject_id:
-        return jsonify(success=False, error="A lei não está associada a uma matéria válida. Não é possível registrar o tempo de estudo."), 400
-    
-    start_time = None
-    end_time = None
-    if entry_type == 'auto':
-        start_time_str = data.get('start_time')
-        end_time_str = data.get('end_time')
-        try:
-            start_time = datetime.datetime.fromisoformat(start_time_str.replace('Z', '+00:00')) if start_time_str else None
-            end_time = datetime.datetime.fromisoformat(end_time_str.replace('Z', '+00:00')) if end_time_str else None
-        except ValueError:
-            return jsonify(success=False, error="Formato de data/hora inválido para start_time ou end_time."), 400
-        
-        if not start_time or not end_time:
-            return jsonify(success=False, error="start_time e end_time são obrigatórios para sessões automáticas."), 400
-        
-        calculated_duration = (end_time - start_time).total_seconds()
-        if abs(calculated_duration - duration_seconds) > 5:
-            logging.warning(f"Duração calculada ({calculated_duration}) difere da enviada ({duration_seconds}) para user {current_user.id}, law {law_id}.")
-            duration_seconds = int(calculated_duration)
-
+    row = dict(session_row, user_id=current_user.id)
     try:
-        new_session = StudySession(
-            user_id=current_user.id,
-            law_id=law_id,
-            subject_id=subject_id,
-            duration_seconds=duration_seconds,
-            entry_type=entry_type,
-            start_time=start_time,
-            end_time=end_time,
-            recorded_at=datetime.datetime.utcnow()
-        )
-        db.session.add(new_session)
-        
-        _record_study_activity(current_user)
-
+        if insert_study_sessions([row]):
+            mark_user_state_changed(current_user)
         db.session.commit()
         return jsonify(success=True, message="Sessão de estudo registrada com sucesso!")
 
+    except IntegrityError as e:
+        db.session.rollback()
+        # Só é reenvio se o mesmo client_session_id foi gravado por outra requisição nesse meio tempo
+        if row['client_session_id'] and existing_client_session_ids([row]):
+            return jsonify(success=True, message="Sessão de estudo registrada com sucesso!")
+        logging.error(f"Erro de integridade ao registrar sessão de estudo para user {current_user.id}, law {row['law_id']}: {e}")
+        return jsonify(success=False, error="Não foi possível registrar a sessão de estudo."), 400
     except Exception as e:
         db.session.rollback()
-        logging.error(f"Erro ao registrar sessão de estudo para user {current_user.id}, law {law_id}: {e}")
+        logging.error(f"Erro ao registrar sessão de estudo para user {current_user.id}, law {data.get('law_id')}: {e}")
         return jsonify(success=False, error="Erro interno ao registrar sessão de estudo."), 500
 
+
+@student_bp.route("/api/study_sessions/batch", methods=["POST"])
+@login_required
+def record_study_sessions_batch():
+    """
+    Recebe {"sessions": [{client_session_id, law_id, duration_seconds, entry_type,
+    start_time, end_time, recorded_at}, ...]} (a fila do timer depois de uma queda
+    de rede) e grava as válidas em uma transação. Reenviar o mesmo
+    client_session_id não duplica a sessão. Responde com os client_session_id
+    aceitos, os já gravados antes e os rejeitados (com o motivo).
+    """
+    data = request.get_json(silent=True) or {}
+    raw_sessions = data.get('sessions') if isinstance(data, dict) else None
+    if not isinstance(raw_sessions, list) or not raw_sessions:
+        return jsonify(success=False, error="Envie uma lista 'sessions' com ao menos uma sessão."), 400
+    if len(raw_sessions) > MAX_SESSIONS_PER_REQUEST:
+        return jsonify(success=False, error=f"No máximo {MAX_SESSIONS_PER_REQUEST} sessões por requisição."), 400
+
+    catalog = get_catalog()
+    now = datetime.datetime.utcnow()
+    rows, rejected = [], []
+    for index, raw in enumerate(raw_sessions):
+        client_id = raw.get('client_session_id') if isinstance(raw, dict) else None
+        try:
+            rows.append(dict(parse_study_session(raw, catalog, now, require_client_id=True), user_id=current_user.id))
+        except UnknownLaw:
+            rejected.append({'index': index, 'client_session_id': client_id, 'error': "Lei não encontrada."})
+        except ValueError as e:
+            rejected.append({'index': index, 'client_session_id': client_id, 'error': str(e)})
+
+    inserted = []
+    for attempt in range(2):
+        try:
+            inserted = insert_study_sessions(rows)
+            if inserted:
+                mark_user_state_changed(current_user)
+            db.session.commit()
+            break
+        except IntegrityError as e:
+            db.session.rollback()
+            # Outra requisição gravou alguma das chaves antes: tenta de novo, agora sem elas.
+            # Qualquer outra violação (chave estrangeira, NOT NULL) não é reenvio.
+            if attempt or not existing_client_session_ids(rows):
+                logging.error(f"Erro de integridade ao gravar sessões em lote para user {current_user.id}: {e}")
+                return jsonify(success=False, error="Não foi possível registrar as sessões de estudo."), 400
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Erro ao registrar sessões em lote para user {current_user.id}: {e}")
+            return jsonify(success=False, error="Erro interno ao registrar sessões de estudo."), 500
+
+    accepted = [row['client_session_id'] for row in inserted]
+    accepted_set = set(accepted)
+    duplicates = [row['client_session_id'] for row in rows if row['client_session_id'] not in accepted_set]
+    return jsonify(
+        success=True,
+        accepted=accepted,
+        duplicates=list(dict.fromkeys(duplicates)),
+        rejected=rejected,
+        message=f"{len(accepted)} sessão(ões) de estudo registrada(s)."
+    )
+
+@student_bp.route("/api/study_sessions/heartbeat", methods=["POST"])
+@login_required
+def study_heartbeat():
+    """
+    Heartbeat do timer do leitor: {"law_id", "elapsed_ms", "action": "beat" | "end" | "discard"},
+    com 'elapsed_ms' = tempo desde o último heartbeat confirmado (0 no primeiro).
+    Só atualiza a sessão aberta em memória (src/services/study_heartbeats.py);
+    a sessão vira uma linha de StudySession quando é fechada.
+    """
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify(success=False, error="Envie um objeto JSON."), 400
+    action = data.get('action', BEAT)
+    try:
+        law_id = int(data.get('law_id'))
+        elapsed_ms = int(data.get('elapsed_ms', 0))
+    except (TypeError, ValueError):
+        return jsonify(success=False, error="law_id e elapsed_ms devem ser números inteiros."), 400
+    if action not in HEARTBEAT_ACTIONS:
+        return jsonify(success=False, error="Ação de heartbeat inválida."), 400
+
+    law = get_catalog().laws.get(law_id)
+    if law is None:
+        return jsonify(success=False, error="Lei não encontrada."), 404
+    if not law.subject_id:
+        return jsonify(success=False, error="A lei não está associada a uma matéria válida. Não é possível registrar o tempo de estudo."), 400
+
+    seconds = study_heartbeats.beat(current_user.id, law_id, law.subject_id, elapsed_ms / 1000, action)
+    return jsonify(success=True, session_seconds=seconds)
+
 @student_bp.route("/api/study_stats", methods=["GET"])
 @login_required
+@conditional_etag('catalog', 'user')
 def get_study_stats():
-    study_data = db.session.query(
-        Subject.name,
-        func.sum(StudySession.duration_seconds).label('total_duration_seconds')
-    ).join(Subject, StudySession.subject_id == Subject.id)\
-     .filter(StudySession.user_id == current_user.id)\
-     .group_by(Subject.name)\
-     .order_by(Subject.name)\
-     .all()
+    study_data = sorted(get_study_time_by_subject(current_user.id), key=lambda row: row[0])
     
     stats_by_subject = []
     total_study_seconds = 0
@@ -1163,9 +1529,10 @@ def share_contribution(law_id):
     if existing_contribution:
         return jsonify(success=False, error="Você já tem uma contribuição pendente para esta lei."), 400
 
-    user_comments = UserComment.query.filter_by(user_id=current_user.id, law_id=law_id).all()
+    comments_filter = (UserComment.user_id == current_user.id, UserComment.law_id == law_id)
+    has_comments = db.session.query(UserComment.id).filter(*comments_filter).first() is not None
 
-    if not markup_data and not user_comments:
+    if not markup_data and not has_comments:
         return jsonify(success=False, error="Não há conteúdo para compartilhar (sem marcações ou anotações)."), 400
 
     try:
@@ -1179,14 +1546,14 @@ def share_contribution(law_id):
         db.session.add(new_contribution)
         db.session.flush() # Para obter o ID da nova contribuição antes do commit
 
-        # Adiciona os comentários de parágrafo à contribuição
-        for comment in user_comments:
-            new_community_comment = CommunityComment(
-                contribution_id=new_contribution.id,
-                content=comment.content,
-                anchor_paragraph_id=comment.anchor_paragraph_id
-            )
-            db.session.add(new_community_comment)
+        # Copia os comentários de parágrafo para a contribuição em um único INSERT ... SELECT
+        db.session.execute(insert(CommunityComment).from_select(
+            ["contribution_id", "content", "anchor_paragraph_id", "created_at"],
+            select(
+                literal(new_contribution.id), UserComment.content, UserComment.anchor_paragraph_id,
+                literal(datetime.datetime.utcnow(), DateTime)
+            ).where(*comments_filter).order_by(UserComment.id)
+        ))
 
         db.session.commit()
         return jsonify(success=True, message="Sua contribuição foi enviada para análise. Muito obrigado!")
@@ -1270,63 +1637,53 @@ def get_community_version(law_id):
         is_own_contribution=(current_user.id == approved_contribution.user_id)
     )
 
+def _build_stats_cards(user):
+    """Dados dos cards de estatísticas principais: Nível, Pontos e Sequência de Estudos."""
+    user_streak, longest_streak = _calculate_user_streak(user)
+    return {
+        "level_info": get_user_level_info(user.points),
+        "user_points": user.points,
+        "user_streak": user_streak,
+        "longest_streak": longest_streak
+    }
+
 @student_bp.route("/api/dashboard/stats-cards")
 @login_required
+@conditional_etag('user', 'day')
 def get_dashboard_stats_cards():
     """
     Uma rota de API dedicada a buscar os dados para os cards de
     estatísticas principais: Nível, Pontos e Sequência de Estudos.
     """
-    level_info = get_user_level_info(current_user.points)
-    user_streak = _calculate_user_streak(current_user)
-
-    return jsonify({
-        "success": True,
-        "level_info": level_info,
-        "user_points": current_user.points,
-        "user_streak": user_streak
-    })
+    return jsonify({"success": True, **_build_stats_cards(current_user)})
     
 # <<< NOVO CÓDIGO >>>
 @student_bp.route("/api/dashboard/secondary-stats")
 @login_required
+@conditional_etag('catalog', 'permissions', 'user', 'minute')
 def get_dashboard_secondary_stats():    
     """
     Nova rota de API para carregar dados de cards secundários de forma assíncrona.
     Isso inclui: Tempo de Estudo, Estatísticas por Matéria e Atividades Recentes.
     """
-    # 1. Lógica para Tempo de Estudo
-    one_week_ago = datetime.datetime.utcnow() - timedelta(days=7)
-    try:
-        brazil_tz = pytz.timezone('America/Sao_Paulo')
-        now_in_brazil = datetime.datetime.utcnow().astimezone(brazil_tz)
-        today_start_in_brazil = now_in_brazil.replace(hour=0, minute=0, second=0, microsecond=0)
-        today_start_utc = today_start_in_brazil.astimezone(pytz.utc)
-    except pytz.UnknownTimeZoneError:
-        logging.warning("Fuso horário 'America/Sao_Paulo' não encontrado. Usando UTC como padrão.")
-        today_start_utc = datetime.datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-    
-    study_time_stats = db.session.query(
-        func.sum(StudySession.duration_seconds).label('total'),
-        func.sum(case((StudySession.recorded_at >= one_week_ago, StudySession.duration_seconds), else_=0)).label('weekly'),
-        func.sum(case((StudySession.recorded_at >= today_start_utc, StudySession.duration_seconds), else_=0)).label('daily')
-    ).filter(StudySession.user_id == current_user.id).one()
+    return jsonify({"success": True, **_build_secondary_stats(current_user)})
+
+def _build_secondary_stats(user):
+    """Dados dos cards secundários: Tempo de Estudo, Matérias, Atividades Recentes e gráfico semanal."""
+    # Todos os números de tempo vêm da tabela de totais diários (user_study_rollup).
+    today_in_brazil = _get_brazil_time_now().date()
+
+    # 1. Lógica para Tempo de Estudo (semanal = últimos 7 dias, incluindo hoje)
+    study_time_stats = get_study_time_totals(user.id, today_in_brazil)
     
     study_time_data = {
-        "total": _format_duration(study_time_stats.total or 0),
-        "weekly": _format_duration(study_time_stats.weekly or 0),
-        "daily": _format_duration(study_time_stats.daily or 0)
+        "total": _format_duration(study_time_stats['total']),
+        "weekly": _format_duration(study_time_stats['weekly']),
+        "daily": _format_duration(study_time_stats['daily'])
     }
 
     # 2. Lógica para Estatísticas por Matéria (Gráfico)
-    study_by_subject_data = db.session.query(
-        Subject.name,
-        func.sum(StudySession.duration_seconds).label('total_duration_seconds')
-    ).join(StudySession, StudySession.subject_id == Subject.id)\
-     .filter(StudySession.user_id == current_user.id)\
-     .group_by(Subject.name)\
-     .order_by(func.sum(StudySession.duration_seconds).desc())\
-     .all()
+    study_by_subject_data = get_study_time_by_subject(user.id)
     
     most_studied_subject = None
     study_data_for_chart = []
@@ -1347,14 +1704,14 @@ def get_dashboard_secondary_stats():
     }
 
     # 3. Lógica para Atividades Recentes
-    _, allowed_law_ids, _ = get_user_permissions()
     recent_progresses_query = UserProgress.query.join(UserProgress.law).filter(
-        UserProgress.user_id == current_user.id,
+        UserProgress.user_id == user.id,
         UserProgress.last_accessed_at.isnot(None),
         Law.parent_id.isnot(None)
     )
-    if allowed_law_ids is not None:
-        recent_progresses_query = recent_progresses_query.filter(UserProgress.law_id.in_(allowed_law_ids))
+    recent_progresses_query = restrict_query(
+        recent_progresses_query, visible_law_clause(user, UserProgress.law_id)
+    )
 
     recent_progresses = recent_progresses_query.options(
         joinedload(UserProgress.law).joinedload(Law.parent)
@@ -1369,22 +1726,10 @@ def get_dashboard_secondary_stats():
         })
 
     # 4. Lógica para o Gráfico de Atividade Semanal (para o card de Sequência)
-    now_in_brazil = _get_brazil_time_now()
-    today_in_brazil = now_in_brazil.date()
     days_of_week_br = ["Seg", "Ter", "Qua", "Qui", "Sex", "Sáb", "Dom"]
 
     start_date_of_week = today_in_brazil - timedelta(days=6)
-    start_date_utc = datetime.datetime.combine(start_date_of_week, datetime.time.min).astimezone(pytz.timezone('America/Sao_Paulo')).astimezone(pytz.utc)
-
-    study_sessions_week = db.session.query(
-        func.cast(func.timezone('America/Sao_Paulo', func.timezone('UTC', StudySession.recorded_at)), Date).label('study_date'),
-        func.sum(StudySession.duration_seconds).label('total_seconds')
-    ).filter(
-        StudySession.user_id == current_user.id,
-        StudySession.recorded_at >= start_date_utc
-    ).group_by('study_date').all()
-    
-    study_by_date = {session.study_date: session.total_seconds for session in study_sessions_week}
+    study_by_date = get_daily_study_seconds(user.id, start_date_of_week, today_in_brazil)
     
     weekly_chart_data = []
     for i in range(7):
@@ -1398,10 +1743,47 @@ def get_dashboard_secondary_stats():
             "minutes": duration_minutes
         })
     
-    return jsonify({
-        "success": True,
+    return {
         "study_time": study_time_data,
         "subject_stats": subject_stats_data,
         "recent_activities": recent_activities_data,
         "weekly_chart_data": weekly_chart_data
-    })
+    }
+
+
+DASHBOARD_SECTIONS = ('stats_cards', 'secondary_stats', 'todo_items', 'laws')
+
+@student_bp.route("/api/dashboard/bootstrap")
+@login_required
+@conditional_etag('catalog', 'permissions', 'user', 'minute')
+def get_dashboard_bootstrap():
+    """
+    Reúne em uma única requisição os dados que o dashboard buscaria em
+    stats-cards, secondary-stats, todo_items e filter_laws, com uma só consulta
+    de permissões e um só bitset de progresso.
+
+    '?sections=stats_cards,todo_items' limita as seções calculadas (padrão: todas),
+    para que o frontend continue podendo carregar partes sob demanda. A seção
+    'laws' aceita os mesmos filtros de /filter_laws na própria query string.
+    """
+    sections_param = request.args.get('sections', '')
+    sections = [section.strip() for section in sections_param.split(',') if section.strip()] or list(DASHBOARD_SECTIONS)
+    unknown_sections = [section for section in sections if section not in DASHBOARD_SECTIONS]
+    if unknown_sections:
+        return jsonify(success=False, error=f"Seções inválidas: {', '.join(unknown_sections)}."), 400
+
+    permissions = get_user_permissions()
+    payload = {"success": True}
+    if 'stats_cards' in sections:
+        payload['stats_cards'] = _build_stats_cards(current_user)
+    if 'secondary_stats' in sections:
+        payload['secondary_stats'] = _build_secondary_stats(current_user)
+    if 'todo_items' in sections:
+        payload['todo_items'] = _build_todo_items(current_user)
+    if 'laws' in sections:
+        payload['laws'] = {
+            "subjects_with_diplomas": _build_filtered_laws(
+                current_user, request.args, permissions, get_progress_bits(current_user)
+            )
+        }
+    return jsonify(payload)
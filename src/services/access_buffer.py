@@ -0,0 +1,121 @@
+# src/services/access_buffer.py
+# -*- coding: utf-8 -*-
+"""
+Buffer write-behind dos acessos às leis (view_law).
+
+Abrir um tópico já estudado não muda nada além de UserProgress.last_accessed_at
+e, no primeiro acesso do dia, do registro em 'study_activity'. Em vez de duas
+transações por página lida, a rota chama access_buffer.record(...) e segue: os
+eventos ficam em memória, agrupados por (usuário, lei) e por (usuário, dia), e
+são gravados em lote pela thread de src/services/write_behind.py (configuração
+ACCESS_BUFFER_INTERVAL_MS, _BATCH_SIZE, _MAX_PENDING, _MAX_ATTEMPTS e _SYNC).
+
+Cada lote incrementa User.state_version dos usuários afetados, então as ETags
+das APIs do aluno (src/services/http_cache.py) mudam quando os dados mudam.
+"""
+from sqlalchemy import bindparam, func, or_, update
+
+from src.extensions import db
+from src.models.progress import UserProgress
+from src.models.user import User
+from src.services.cache import LRUCache
+from src.services.streaks import record_study_activity
+from src.services.write_behind import WriteBehindBuffer
+
+
+def bump_state_versions(user_ids):
+    """User.state_version + 1 direto no banco, para escritas feitas fora da requisição."""
+    if user_ids:
+        db.session.execute(
+            update(User).where(User.id.in_(user_ids))
+            .values(state_version=func.coalesce(User.state_version, 0) + 1),
+            execution_options={'synchronize_session': False}
+        )
+
+
+class AccessBuffer(WriteBehindBuffer):
+    config_prefix = 'ACCESS_BUFFER'
+
+    def __init__(self, app=None):
+        self._accesses = {}       # (user_id, law_id) -> último acesso (UTC)
+        self._study_days = set()  # (user_id, data em São Paulo)
+        self._known_days = LRUCache(maxsize=20000)  # user_id -> último dia já gravado
+        super().__init__(app)
+
+    def record(self, user_id, law_id, accessed_at, study_date):
+        """Registra um acesso. Não toca na sessão da requisição (exceto no modo síncrono)."""
+        with self._lock:
+            key = (user_id, law_id)
+            previous = self._accesses.get(key)
+            if previous is None or accessed_at > previous:
+                self._accesses[key] = accessed_at
+            if self._known_days.get(user_id) != study_date:
+                self._study_days.add((user_id, study_date))
+            pending = self._pending_count()
+        self._after_record(pending)
+
+    def _pending_count(self):
+        return len(self._accesses) + len(self._study_days)
+
+    def _take(self):
+        batch = (self._accesses, self._study_days)
+        self._accesses, self._study_days = {}, set()
+        return batch
+
+    def _batch_keys(self, batch):
+        # (user_id, law_id) dos acessos e (user_id, data) dos dias de estudo
+        accesses, study_days = batch
+        return [*accesses, *study_days]
+
+    def _subset(self, batch, keys):
+        accesses, study_days = batch
+        return {key: value for key, value in accesses.items() if key in keys}, study_days & keys
+
+    def _requeue(self, batch, dropped):
+        accesses, study_days = batch
+        for key, accessed_at in accesses.items():
+            if key in dropped:
+                continue
+            previous = self._accesses.get(key)
+            if previous is None or accessed_at > previous:
+                self._accesses[key] = accessed_at
+        self._study_days |= study_days - dropped
+
+    def _after_write(self, batch):
+        for user_id, study_date in batch[1]:
+            if (self._known_days.get(user_id) or study_date) <= study_date:
+                self._known_days.set(user_id, study_date)
+
+    def _write(self, batch):
+        accesses, study_days = batch
+        try:
+            if accesses:
+                # Um UPDATE executado em lote (executemany); nunca volta o horário para trás
+                db.session.connection().execute(
+                    update(UserProgress)
+                    .where(UserProgress.user_id == bindparam('b_user_id'))
+                    .where(UserProgress.law_id == bindparam('b_law_id'))
+                    .where(or_(
+                        UserProgress.last_accessed_at.is_(None),
+                        UserProgress.last_accessed_at < bindparam('b_accessed_at')
+                    ))
+                    .values(last_accessed_at=bindparam('b_accessed_at')),
+                    [
+                        {'b_user_id': user_id, 'b_law_id': law_id, 'b_accessed_at': accessed_at}
+                        for (user_id, law_id), accessed_at in accesses.items()
+                    ]
+                )
+            if study_days:
+                self._write_study_days(study_days)
+            bump_state_versions({user_id for user_id, _ in accesses} | {user_id for user_id, _ in study_days})
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def _write_study_days(self, study_days):
+        # Em ordem de data, para que a sequência avance dia a dia
+        for user_id, study_date in sorted(study_days, key=lambda item: (item[1], item[0])):
+            record_study_activity(user_id, study_date)
+
+access_buffer = AccessBuffer()
@@ -0,0 +1,82 @@
+# src/services/announcements.py
+# -*- coding: utf-8 -*-
+"""
+Cache em memória dos avisos ativos e dos avisos já vistos por cada aluno.
+
+Os avisos ativos mudam poucas vezes por mês: ficam em cache por processo,
+chaveados pela versão 'announcements', que as rotas do admin incrementam ao
+criar, editar, ativar/desativar ou excluir um aviso.
+
+Os avisos vistos ficam em um conjunto por usuário, restrito aos avisos não
+fixos ativos. A chave inclui 'User.seen_announcements_version', incrementada
+em mark_seen, então todos os workers enxergam a marcação sem consultar as
+tabelas de avisos a cada carregamento do dashboard.
+"""
+import datetime
+from typing import NamedTuple, Optional
+
+from src.extensions import db
+from src.models.user import Announcement, UserSeenAnnouncement
+from src.services.cache import LRUCache, bump_cache_version, get_cache_version
+
+ANNOUNCEMENTS_VERSION = 'announcements'
+
+
+class ActiveAnnouncement(NamedTuple):
+    id: int
+    title: str
+    content: str
+    is_fixed: bool
+    created_at: Optional[datetime.datetime]
+
+
+# Chave: versão 'announcements'. Valor: (fixos, não fixos), do mais novo ao mais antigo.
+_active_cache = LRUCache(maxsize=4)
+# Chave: (user_id, seen_announcements_version, versão 'announcements').
+_seen_cache = LRUCache(maxsize=8192, ttl=3600)
+
+
+def get_active_announcements():
+    """Retorna (avisos fixos, avisos não fixos) ativos, como tuplas imutáveis."""
+    version = get_cache_version(ANNOUNCEMENTS_VERSION)
+    cached = _active_cache.get(version)
+    if cached is None:
+        rows = db.session.query(
+            Announcement.id, Announcement.title, Announcement.content,
+            Announcement.is_fixed, Announcement.created_at
+        ).filter(Announcement.is_active == True).order_by(Announcement.created_at.desc()).all()
+        announcements = [ActiveAnnouncement(*row) for row in rows]
+        cached = (
+            tuple(a for a in announcements if a.is_fixed),
+            tuple(a for a in announcements if not a.is_fixed),
+        )
+        _active_cache.set(version, cached)
+    return cached
+
+
+def get_unseen_announcements(user):
+    """Avisos não fixos ativos que o usuário ainda não marcou como vistos."""
+    _, non_fixed = get_active_announcements()
+    if not non_fixed:
+        return ()
+
+    key = (user.id, user.seen_announcements_version or 0, get_cache_version(ANNOUNCEMENTS_VERSION))
+    seen_ids = _seen_cache.get(key)
+    if seen_ids is None:
+        rows = db.session.query(UserSeenAnnouncement.announcement_id).filter(
+            UserSeenAnnouncement.user_id == user.id,
+            UserSeenAnnouncement.announcement_id.in_([a.id for a in non_fixed])
+        ).all()
+        seen_ids = frozenset(row.announcement_id for row in rows)
+        _seen_cache.set(key, seen_ids)
+    return tuple(a for a in non_fixed if a.id not in seen_ids)
+
+
+def mark_user_announcements_changed(user):
+    """Chamar quando o usuário marcar um aviso como visto (sem commit)."""
+    user.increment_version('seen_announcements_version')
+
+
+def invalidate_announcements():
+    """Chamar em toda alteração de avisos feita pelo admin, antes do commit."""
+    bump_cache_version(ANNOUNCEMENTS_VERSION)
@@ -0,0 +1,170 @@
+# src/services/autosave.py
+# -*- coding: utf-8 -*-
+"""
+Autosave do leitor com coalescência por (usuário, lei, tipo).
+
+Enquanto o aluno rola a página, o leitor manda o ponto de leitura e as
+anotações a cada poucos segundos. Cada envio só substitui o valor pendente da
+mesma chave; a resposta sai na hora e o estado final é gravado em lote pela
+thread de src/services/write_behind.py: um UPDATE em lote para o ponto de
+leitura e um upsert em lote (src/models/upsert.py) para as anotações. As
+marcações não passam por aqui: são gravadas na hora (src/services/markups.py).
+
+Durabilidade (configuração):
+  - AUTOSAVE_SYNC (padrão: app.testing): tudo é gravado antes da resposta;
+  - AUTOSAVE_DURABILITY: {tipo: 'sync' | 'buffered'}; tipos 'sync' são gravados
+    antes da resposta mesmo com o buffer ativo. O padrão é 'buffered', em que um
+    crash do processo perde no máximo AUTOSAVE_INTERVAL_MS de edições (o
+    encerramento normal grava tudo via atexit).
+
+Leituras do mesmo processo veem o valor pendente (get_pending); outro worker
+pode ver o valor anterior durante a janela.
+"""
+import datetime
+
+from sqlalchemy import bindparam, select, update
+
+from src.extensions import db
+from src.models.law import Law
+from src.models.notes import UserNotes
+from src.models.progress import UserProgress
+from src.models.upsert import upsert
+from src.models.user import User
+from src.services.access_buffer import bump_state_versions
+from src.services.write_behind import WriteBehindBuffer
+
+LAST_READ = 'last_read'
+NOTES = 'notes'
+
+SYNC = 'sync'
+BUFFERED = 'buffered'
+
+
+def _upsert_user_law_rows(model, rows):
+    """
+    rows: {(user_id, law_id): {coluna: valor}}. Um único upsert em lote,
+    ignorando usuários/leis apagados nesse meio tempo (a chave estrangeira
+    derrubaria o lote inteiro).
+    """
+    user_ids = set(db.session.scalars(select(User.id).where(User.id.in_({key[0] for key in rows}))))
+    law_ids = set(db.session.scalars(select(Law.id).where(Law.id.in_({key[1] for key in rows}))))
+    values = [
+        dict(columns, user_id=user_id, law_id=law_id)
+        for (user_id, law_id), columns in rows.items()
+        if user_id in user_ids and law_id in law_ids
+    ]
+    if values:
+        columns = sorted(next(iter(rows.values())))
+        db.session.execute(upsert(model, ['user_id', 'law_id'], update=columns), values)
+
+
+class AutosaveBuffer(WriteBehindBuffer):
+    config_prefix = 'AUTOSAVE'
+    default_interval_ms = 1000
+
+    def __init__(self, app=None):
+        self._values = {}     # (user_id, law_id, tipo) -> (valor, salvo em UTC)
+        self._in_flight = {}  # lote sendo gravado, ainda visível para get_pending
+        super().__init__(app)
+
+    def init_app(self, app):
+        app.config.setdefault('AUTOSAVE_DURABILITY', {})
+        super().init_app(app)
+
+    def save(self, user_id, law_id, kind, value):
+        """Guarda o valor mais recente. Retorna True se ele já está gravado no banco."""
+        with self._lock:
+            self._values[(user_id, law_id, kind)] = (value, datetime.datetime.utcnow())
+            pending = self._pending_count()
+        if self.app.config['AUTOSAVE_DURABILITY'].get(kind, BUFFERED) == SYNC:
+            # Só a chave desta requisição; as dos outros usuários seguem no lote da thread
+            self.flush(keys=[(user_id, law_id, kind)])
+            return self.get_pending_entry(user_id, law_id, kind) is None
+        self._after_record(pending)
+        return self.is_sync
+
+    def get_pending_entry(self, user_id, law_id, kind):
+        """(valor, salvo em) ainda não gravado da chave, ou None."""
+        key = (user_id, law_id, kind)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._in_flight.get(key)
+        return entry
+
+    def get_pending(self, user_id, law_id, kind, default=None):
+        """Valor ainda não gravado da chave, ou 'default'."""
+        entry = self.get_pending_entry(user_id, law_id, kind)
+        return default if entry is None else entry[0]
+
+    def discard(self, user_id, law_id, kind):
+        """Descarta o valor pendente (ex.: a linha foi apagada ou gravada por outro caminho)."""
+        with self._lock:
+            self._values.pop((user_id, law_id, kind), None)
+            self._in_flight.pop((user_id, law_id, kind), None)
+
+    def _pending_count(self):
+        return len(self._values)
+
+    def _take(self):
+        batch, self._values = self._values, {}
+        self._in_flight.update(batch)
+        return batch
+
+    def _take_keys(self, keys):
+        batch = {key: self._values.pop(key) for key in keys if key in self._values}
+        self._in_flight.update(batch)
+        return batch
+
+    def _batch_keys(self, batch):
+        return list(batch)
+
+    def _subset(self, batch, keys):
+        return {key: entry for key, entry in batch.items() if key in keys}
+
+    def _release_in_flight(self, batch):
+        # Só as entradas deste lote: um flush de outras chaves pode estar em andamento
+        for key, entry in batch.items():
+            if self._in_flight.get(key) is entry:
+                del self._in_flight[key]
+
+    def _requeue(self, batch, dropped):
+        for key, entry in batch.items():
+            if key not in dropped:
+                self._values.setdefault(key, entry)
+        self._release_in_flight(batch)
+
+    def _after_write(self, batch):
+        with self._lock:
+            self._release_in_flight(batch)
+
+    def _write(self, batch):
+        last_read, notes = {}, {}
+        for (user_id, law_id, kind), (value, saved_at) in batch.items():
+            if kind == LAST_READ:
+                last_read[(user_id, law_id)] = (value, saved_at)
+            elif kind == NOTES:
+                notes[(user_id, law_id)] = {'content': value, 'updated_at': saved_at}
+        try:
+            if last_read:
+                # A rota só usa o buffer quando a linha de progresso já existe
+                db.session.connection().execute(
+                    update(UserProgress)
+                    .where(UserProgress.user_id == bindparam('b_user_id'))
+                    .where(UserProgress.law_id == bindparam('b_law_id'))
+                    .values(last_read_article=bindparam('b_article'), last_accessed_at=bindparam('b_saved_at')),
+                    [
+                        {'b_user_id': user_id, 'b_law_id': law_id, 'b_article': article, 'b_saved_at': saved_at}
+                        for (user_id, law_id), (article, saved_at) in last_read.items()
+                    ]
+                )
+                bump_state_versions({user_id for user_id, _ in last_read})
+            if notes:
+                _upsert_user_law_rows(UserNotes, notes)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+
+autosave = AutosaveBuffer()
@@ -0,0 +1,124 @@
+# src/services/cache.py
+# -*- coding: utf-8 -*-
+"""
+Utilitários de cache em memória compartilhados pelas rotas.
+
+- LRUCache: dicionário limitado (LRU), thread-safe, com TTL opcional e
+  contadores de acertos/erros para dimensionamento.
+- get_cache_version / bump_cache_version: versões persistidas na tabela
+  'cache_version', usadas como parte das chaves dos caches para que uma
+  alteração feita pelo admin invalide os dados em todos os processos.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event, update
+from sqlalchemy.orm import Session
+
+from src.extensions import db
+from src.models.cache import CacheVersion
+
+_MISSING = object()
+
+
+class LRUCache:
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+        return default if entry is _MISSING else entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
+
+
+# Intervalo (em segundos) em que cada processo reaproveita a última versão lida
+# do banco antes de consultá-la de novo. Alterações feitas no próprio processo
+# são vistas imediatamente após o commit.
+VERSION_CHECK_INTERVAL = 2.0
+
+_local_versions = {}
+
+
+def get_cache_version(name):
+    """Retorna a versão atual de um cache nomeado (0 se nunca foi incrementada)."""
+    now = time.monotonic()
+    cached = _local_versions.get(name)
+    if cached is not None and now - cached[1] < VERSION_CHECK_INTERVAL:
+        return cached[0]
+
+    version = db.session.query(CacheVersion.version).filter_by(name=name).scalar() or 0
+    _local_versions[name] = (version, now)
+    return version
+
+
+def bump_cache_version(*names):
+    """
+    Incrementa as versões informadas dentro da transação corrente.
+    Quem chama continua responsável pelo commit; o cache local de versões é
+    descartado assim que a transação é confirmada.
+    """
+    for name in names:
+        result = db.session.execute(
+            update(CacheVersion)
+            .where(CacheVersion.name == name)
+            .values(version=CacheVersion.version + 1)
+        )
+        if result.rowcount == 0:
+            db.session.add(CacheVersion(name=name, version=1))
+            db.session.flush()
+        db.session.info.setdefault('bumped_cache_versions', set()).add(name)
+
+
+@event.listens_for(Session, "after_commit")
+def _forget_bumped_versions(session):
+    for name in session.info.pop('bumped_cache_versions', ()):
+        _local_versions.pop(name, None)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_bumped_versions(session):
+    session.info.pop('bumped_cache_versions', None)
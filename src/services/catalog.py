@@ -0,0 +1,232 @@
+# src/services/catalog.py
+# -*- coding: utf-8 -*-
+"""
+Versão e snapshot em memória do catálogo de conteúdo (matérias, diplomas,
+tópicos e concursos).
+
+Toda rota do admin que altera o catálogo chama invalidate_catalog() antes do
+commit; os caches em memória construídos a partir do catálogo comparam a
+versão com que foram montados com get_catalog_version() e se atualizam quando
+ela muda.
+
+get_catalog() devolve um CatalogSnapshot imutável com a árvore completa, montado
+com quatro consultas de colunas (sem 'Law.content' e sem objetos ORM). Quando a
+versão muda, um snapshot novo é construído por inteiro e só então publicado, de
+modo que cada requisição enxerga sempre uma árvore consistente. As rotas de
+listagem respondem a partir dele, sem tocar nas tabelas do catálogo.
+
+O snapshot também numera os tópicos de forma densa (um bit por tópico, na
+ordem dos ids) e guarda máscaras de bits por diploma, matéria e concurso, usadas
+pelos bitsets de progresso de src/services/progress.py.
+
+'diplomas_for_listing' é a ordem de paginação de /student/filter_laws: nome da
+matéria, título do diploma e id. 'listing_keys' guarda essas chaves na mesma
+ordem, para retomar a partir de um cursor com busca binária.
+"""
+import threading
+from bisect import bisect_right
+from itertools import islice
+from operator import attrgetter
+
+from src.extensions import db
+from src.models.concurso import Concurso, concurso_law_association
+from src.models.law import Law, Subject
+from src.services.cache import bump_cache_version, get_cache_version
+
+CATALOG_VERSION = 'catalog'
+# Nome exibido para diplomas sem matéria
+NO_SUBJECT_NAME = "Sem Matéria"
+
+
+def get_catalog_version():
+    return get_cache_version(CATALOG_VERSION)
+
+
+def invalidate_catalog():
+    bump_cache_version(CATALOG_VERSION)
+
+
+class SubjectNode:
+    __slots__ = ('id', 'name')
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+    def __repr__(self):
+        return f"<SubjectNode {self.id} {self.name}>"
+
+
+class LawNode:
+    """
+    Diploma (parent_id None) ou tópico do catálogo. 'children' vem ordenado por id;
+    'content_hash' é a chave do conteúdo compilado (src/services/law_content.py).
+    """
+    __slots__ = ('id', 'title', 'description', 'parent_id', 'subject_id', 'content_hash', 'children')
+
+    def __init__(self, id, title, description, parent_id, subject_id, content_hash=None):
+        self.id = id
+        self.title = title
+        self.description = description
+        self.parent_id = parent_id
+        self.subject_id = subject_id
+        self.content_hash = content_hash
+        self.children = ()
+
+    def __repr__(self):
+        return f"<LawNode {self.id} {self.title}>"
+
+
+class ConcursoNode:
+    """Concurso com os ids das leis associadas diretamente a ele."""
+    __slots__ = ('id', 'name', 'edital_verticalizado_url', 'law_ids')
+
+    def __init__(self, id, name, edital_verticalizado_url, law_ids):
+        self.id = id
+        self.name = name
+        self.edital_verticalizado_url = edital_verticalizado_url
+        self.law_ids = law_ids
+
+    def __repr__(self):
+        return f"<ConcursoNode {self.id} {self.name}>"
+
+
+class CatalogSnapshot:
+    __slots__ = (
+        'version', 'subjects', 'laws', 'concursos',
+        'subjects_by_name', 'concursos_by_name', 'diplomas_by_title',
+        '_diplomas_by_subject', '_topics_by_subject', 'topics',
+        'topic_bits', 'all_topics_mask', 'diploma_masks', 'subject_masks', 'concurso_masks',
+        'diplomas_for_listing', 'listing_keys',
+    )
+
+    def __init__(self, version, subject_rows, law_rows, concurso_rows, association_rows):
+        self.version = version
+        self.subjects = {row.id: SubjectNode(row.id, row.name) for row in subject_rows}
+        self.laws = {
+            row.id: LawNode(row.id, row.title, row.description, row.parent_id, row.subject_id, row.content_hash)
+            for row in law_rows
+        }
+
+        law_ids_by_concurso = {}
+        for concurso_id, law_id in association_rows:
+            law_ids_by_concurso.setdefault(concurso_id, set()).add(law_id)
+        self.concursos = {
+            row.id: ConcursoNode(
+                row.id, row.name, row.edital_verticalizado_url,
+                frozenset(law_ids_by_concurso.get(row.id, ()))
+            )
+            for row in concurso_rows
+        }
+
+        children_by_parent = {}
+        diplomas_by_subject = {}
+        topics_by_subject = {}
+        for law in sorted(self.laws.values(), key=attrgetter('id')):
+            if law.parent_id is None:
+                diplomas_by_subject.setdefault(law.subject_id, []).append(law)
+            else:
+                children_by_parent.setdefault(law.parent_id, []).append(law)
+                topics_by_subject.setdefault(law.subject_id, []).append(law)
+        for parent_id, children in children_by_parent.items():
+            parent = self.laws.get(parent_id)
+            if parent is not None:
+                parent.children = tuple(children)
+
+        by_title = attrgetter('title')
+        self._diplomas_by_subject = {
+            subject_id: tuple(sorted(diplomas, key=by_title)) for subject_id, diplomas in diplomas_by_subject.items()
+        }
+        self._topics_by_subject = {
+            subject_id: tuple(topics) for subject_id, topics in topics_by_subject.items()
+        }
+        self.topics = tuple(law for law in sorted(self.laws.values(), key=attrgetter('id')) if law.parent_id is not None)
+        self.diplomas_by_title = tuple(sorted(
+            (law for law in self.laws.values() if law.parent_id is None), key=by_title
+        ))
+        self.subjects_by_name = tuple(sorted(self.subjects.values(), key=attrgetter('name')))
+        listing = sorted((self.listing_key(diploma), diploma) for diploma in self.diplomas_by_title)
+        self.listing_keys = tuple(key for key, _ in listing)
+        self.diplomas_for_listing = tuple(diploma for _, diploma in listing)
+        self.concursos_by_name = tuple(sorted(self.concursos.values(), key=attrgetter('name')))
+
+        # Índice denso: o tópico self.topics[i] corresponde ao bit 1 << i.
+        self.topic_bits = {topic.id: 1 << position for position, topic in enumerate(self.topics)}
+        self.all_topics_mask = (1 << len(self.topics)) - 1
+        self.diploma_masks = {
+            parent_id: self.mask_for_ids(child.id for child in children)
+            for parent_id, children in children_by_parent.items()
+        }
+        self.subject_masks = {
+            subject_id: self.mask_for_ids(topic.id for topic in topics)
+            for subject_id, topics in topics_by_subject.items()
+        }
+        self.concurso_masks = {
+            concurso.id: self.mask_for_ids(concurso.law_ids) for concurso in self.concursos.values()
+        }
+
+    def diplomas_for_subject(self, subject_id):
+        """Diplomas da matéria (None = sem matéria), ordenados por título."""
+        return self._diplomas_by_subject.get(subject_id, ())
+
+    def topics_for_subject(self, subject_id):
+        """Tópicos cuja própria matéria é 'subject_id', ordenados por id."""
+        return self._topics_by_subject.get(subject_id, ())
+
+    def subject_name(self, subject_id):
+        subject = self.subjects.get(subject_id)
+        return subject.name if subject else NO_SUBJECT_NAME
+
+    def listing_key(self, diploma):
+        """Chave de ordenação/cursor de um diploma: (matéria, título, id)."""
+        return (self.subject_name(diploma.subject_id), diploma.title, diploma.id)
+
+    def diplomas_after(self, key=None):
+        """Diplomas na ordem de listagem, começando depois da chave 'key' (None = do início)."""
+        start = bisect_right(self.listing_keys, key) if key is not None else 0
+        return islice(self.diplomas_for_listing, start, None)
+
+    def mask_for_ids(self, law_ids):
+        """Máscara com os bits dos tópicos informados (ids que não são tópicos são ignorados)."""
+        topic_bits = self.topic_bits
+        mask = 0
+        for law_id in law_ids:
+            mask |= topic_bits.get(law_id, 0)
+        return mask
+
+    def topics_in_mask(self, mask):
+        """Tópicos cujos bits estão ligados em 'mask', em ordem de id."""
+        topics = self.topics
+        while mask:
+            lowest = mask & -mask
+            yield topics[lowest.bit_length() - 1]
+            mask ^= lowest
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def _build_snapshot(version):
+    subject_rows = db.session.query(Subject.id, Subject.name).all()
+    law_rows = db.session.query(
+        Law.id, Law.title, Law.description, Law.parent_id, Law.subject_id, Law.content_hash
+    ).all()
+    concurso_rows = db.session.query(Concurso.id, Concurso.name, Concurso.edital_verticalizado_url).all()
+    association_rows = db.session.query(
+        concurso_law_association.c.concurso_id, concurso_law_association.c.law_id
+    ).all()
+    return CatalogSnapshot(version, subject_rows, law_rows, concurso_rows, association_rows)
+
+
+def get_catalog():
+    """Snapshot do catálogo na versão atual, reconstruído quando a versão muda."""
+    global _snapshot
+    version = get_catalog_version()
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+    with _snapshot_lock:
+        if _snapshot is None or _snapshot.version != version:
+            _snapshot = _build_snapshot(version)
+        return _snapshot
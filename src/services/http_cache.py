@@ -0,0 +1,83 @@
+# src/services/http_cache.py
+# -*- coding: utf-8 -*-
+"""
+ETags fortes e GET condicional para as APIs JSON do aluno.
+
+A ETag de uma resposta é um hash das versões de que ela depende, calculado
+antes de a view rodar:
+  - 'catalog':     versão do catálogo (get_catalog_version);
+  - 'permissions': impressão digital das permissões do usuário;
+  - 'user':        User.state_version, incrementada pelas escritas do aluno
+                   (progresso, favoritos, lembretes, sessões de estudo);
+  - 'day':         data de hoje em São Paulo (sequência de estudos, gráfico);
+  - 'minute':      minuto atual em UTC (textos do tipo "5 minutos atrás").
+Endpoint, argumentos da rota e query string também entram no hash. Se o
+cliente mandar a mesma ETag em If-None-Match, a resposta é 304 sem executar
+a view (nenhuma consulta além das versões, que já ficam em cache).
+"""
+import datetime
+import hashlib
+from functools import wraps
+
+from flask import make_response, request
+from flask_login import current_user
+
+from src.services.catalog import get_catalog_version
+from src.services.permissions import get_permissions_fingerprint
+from src.services.study_stats import local_study_date
+
+
+def mark_user_state_changed(user):
+    """
+    Chamar (antes do commit) em toda escrita que muda os dados das APIs do aluno.
+    O incremento é feito no banco, como em bump_state_versions, para que duas
+    requisições (ou uma requisição e um lote dos buffers) não gravem a mesma
+    versão para dados diferentes. Retorna a versão nova.
+    """
+    return user.increment_version('state_version')
+
+
+_SCOPES = {
+    'catalog': lambda: get_catalog_version(),
+    'permissions': lambda: get_permissions_fingerprint(current_user),
+    'user': lambda: (current_user.id, current_user.state_version or 0),
+    'day': lambda: local_study_date().isoformat(),
+    'minute': lambda: datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M'),
+}
+
+
+def _compute_etag(scopes):
+    parts = [
+        request.endpoint,
+        sorted((request.view_args or {}).items()),
+        sorted(request.args.items(multi=True)),
+    ]
+    parts.extend(_SCOPES[scope]() for scope in scopes)
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def conditional_etag(*scopes):
+    """
+    Decorator para rotas GET (abaixo de @login_required). 'scopes' lista as
+    versões de que a resposta depende (chaves de _SCOPES).
+    """
+    unknown = [scope for scope in scopes if scope not in _SCOPES]
+    if unknown:
+        raise ValueError(f"Escopos de ETag desconhecidos: {unknown}")
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = _compute_etag(scopes)
+            if etag in request.if_none_match:
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            # O navegador guarda a resposta, mas sempre revalida
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
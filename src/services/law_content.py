@@ -0,0 +1,297 @@
+# src/services/law_content.py
+# -*- coding: utf-8 -*-
+"""
+Cache do conteúdo compilado das leis, chaveado por (law_id, Law.content_hash).
+
+Cada entrada guarda:
+  - o HTML já sanitizado (mesma política do editor do admin);
+  - o índice de âncoras: os blocos <p>/<li>/<blockquote> na ordem do documento
+    (a mesma que o view_law.html usa para gerar os ids 'law-p-N'), com o id já
+    existente no HTML, o artigo a que pertencem e o dispositivo que abrem
+    (Art., §, inciso, alínea);
+  - as seções por artigo: offsets de cada artigo no HTML, para entregar o
+    conteúdo em fatias (/student/law/<id>/articles);
+  - os bytes pré-comprimidos em gzip e, se o pacote 'brotli' estiver instalado,
+    em brotli.
+
+O admin compila o conteúdo em add_law/edit_law; nos demais processos a entrada
+é montada na primeira leitura. Como o hash faz parte da chave, uma edição nunca
+serve conteúdo antigo: a entrada velha só deixa de ser usada e sai pelo LRU.
+"""
+import gzip
+import re
+from html.parser import HTMLParser
+from typing import NamedTuple, Optional, Tuple
+
+import bleach
+from bleach.css_sanitizer import CSSSanitizer
+from flask import Response, request
+from sqlalchemy import update
+
+from src.extensions import db
+from src.models.law import Law
+from src.services.cache import LRUCache
+from src.services.text import content_digest
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Política de sanitização do conteúdo das leis (usada também pelo admin ao salvar)
+ALLOWED_TAGS = [
+    'p', 'br', 'strong', 'b', 'em', 'i', 'u', 's', 'strike',
+    'ul', 'ol', 'li', 'a', 'blockquote',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    'span', 'div', 'table', 'thead', 'tbody', 'tr', 'th', 'td'
+]
+ALLOWED_ATTRIBUTES = {
+    '*': ['style', 'class'],
+    'a': ['href', 'title', 'target'],
+    'img': ['src', 'alt', 'height', 'width']
+}
+ALLOWED_STYLES = [
+    'color', 'background-color', 'font-weight', 'font-style', 'text-decoration',
+    'text-align', 'margin', 'margin-top', 'margin-right', 'margin-bottom', 'margin-left',
+    'padding', 'padding-top', 'padding-right', 'padding-bottom', 'padding-left',
+    'border', 'border-left'
+]
+css_sanitizer = CSSSanitizer(allowed_css_properties=ALLOWED_STYLES)
+
+_ANCHOR_TAGS = ('p', 'li', 'blockquote')
+_VOID_TAGS = frozenset(('br', 'hr', 'img', 'wbr', 'col', 'area', 'input', 'source'))
+# Mesmo padrão de indexArticles() em view_law.html
+_ARTICLE_RE = re.compile(r'^(Art(igo)?\.?\s*)(\d+)', re.IGNORECASE)
+_PARAGRAPH_RE = re.compile(r'^(?:§\s*(\d+)|Par[áa]grafo\s+([úu]nico))', re.IGNORECASE)
+_INCISO_RE = re.compile(r'^([IVXLCDM]+)\s*[-–—]')
+_ALINEA_RE = re.compile(r'^([a-z])\)')
+
+ARTIGO, PARAGRAFO, INCISO, ALINEA = 'artigo', 'paragrafo', 'inciso', 'alinea'
+
+
+class ContentAnchor(NamedTuple):
+    position: int               # ordem entre os blocos <p>/<li>/<blockquote> do conteúdo
+    element_id: Optional[str]   # id presente no próprio HTML, se houver
+    article: Optional[str]      # número do artigo a que o bloco pertence
+    kind: Optional[str]         # ARTIGO, PARAGRAFO, INCISO ou ALINEA quando o bloco abre um deles
+    label: Optional[str]        # '5' (Art. 5º / § 5º), 'único', 'IV', 'a'
+
+
+class ArticleSection(NamedTuple):
+    """Fatia do HTML que vai de um artigo (bloco de primeiro nível) até o próximo."""
+    article: Optional[str]      # None no preâmbulo antes do primeiro artigo
+    start: int                  # offsets no HTML sanitizado
+    end: int
+    first_anchor: int           # posição do primeiro bloco âncora da fatia
+    anchor_count: int
+
+
+class LawContent(NamedTuple):
+    content_hash: str
+    html: str
+    anchors: Tuple[ContentAnchor, ...]
+    sections: Tuple[ArticleSection, ...]
+    gzip_body: bytes
+    brotli_body: Optional[bytes]
+
+    def etag(self, encoding):
+        return f"{self.content_hash[:32]}-{encoding}"
+
+
+_content_cache = LRUCache(maxsize=256)
+
+
+def _classify(text):
+    """(kind, label) do dispositivo com que o texto do bloco começa."""
+    match = _ARTICLE_RE.match(text)
+    if match:
+        return ARTIGO, match.group(3)
+    match = _PARAGRAPH_RE.match(text)
+    if match:
+        return PARAGRAFO, match.group(1) or 'único'
+    match = _INCISO_RE.match(text)
+    if match:
+        return INCISO, match.group(1)
+    match = _ALINEA_RE.match(text)
+    if match:
+        return ALINEA, match.group(1)
+    return None, None
+
+
+class _ContentIndexer(HTMLParser):
+    """
+    Percorre o HTML sanitizado uma vez, montando as âncoras e os pontos de corte
+    dos artigos. Só blocos de primeiro nível viram cortes, para que cada fatia
+    seja HTML bem formado; um conteúdo todo dentro de um único <div> fica com
+    uma seção só.
+    """
+
+    def __init__(self, html):
+        super().__init__(convert_charrefs=True)
+        # getpos() conta linhas só por '\n' (splitlines também quebra em '\r', '\x0c', '\u2028'...)
+        self._line_offsets = [0]
+        for line in html.split('\n'):
+            self._line_offsets.append(self._line_offsets[-1] + len(line) + 1)
+        self.anchors = []
+        self.splits = []  # (offset, posição da primeira âncora, artigo)
+        self._open = []   # (tag, posição, id, textos, profundidade, offset) dos blocos abertos
+        self._depth = 0
+
+    def _offset(self):
+        line, column = self.getpos()
+        return self._line_offsets[line - 1] + column
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _VOID_TAGS:
+            return
+        if tag in _ANCHOR_TAGS:
+            if tag == 'p':
+                # Um <p> nunca fica dentro de outro: fecha o anterior, como o navegador
+                self._close_blocks('p')
+            position = len(self.anchors)
+            self.anchors.append(None)
+            self._open.append((tag, position, dict(attrs).get('id'), [], self._depth, self._offset()))
+        self._depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in _VOID_TAGS:
+            return
+        if tag in _ANCHOR_TAGS:
+            self._close_blocks(tag)
+        else:
+            self._depth = max(self._depth - 1, 0)
+
+    def handle_data(self, data):
+        for block in self._open:
+            block[3].append(data)
+
+    def _close_blocks(self, tag):
+        if not any(block[0] == tag for block in self._open):
+            return
+        while self._open:
+            open_tag, position, element_id, chunks, depth, offset = self._open.pop()
+            self._depth = depth
+            kind, label = _classify(''.join(chunks).strip())
+            self.anchors[position] = ContentAnchor(position, element_id, None, kind, label)
+            if kind == ARTIGO and depth == 0:
+                self.splits.append((offset, position, label))
+            if open_tag == tag:
+                return
+
+    def close(self):
+        super().close()
+        while self._open:
+            self._close_blocks(self._open[-1][0])
+
+
+def build_content_index(html):
+    """(âncoras, seções) do HTML sanitizado de uma lei."""
+    indexer = _ContentIndexer(html)
+    indexer.feed(html)
+    indexer.close()
+
+    # Cada bloco herda o número do último artigo aberto antes dele
+    anchors = []
+    current_article = None
+    for anchor in indexer.anchors:
+        if anchor.kind == ARTIGO:
+            current_article = anchor.label
+        anchors.append(anchor._replace(article=current_article))
+
+    sections = []
+    boundaries = sorted(indexer.splits)
+    if not boundaries or boundaries[0][0] > 0:
+        boundaries.insert(0, (0, 0, None))
+    for index, (offset, first_anchor, article) in enumerate(boundaries):
+        if index + 1 < len(boundaries):
+            end, next_anchor = boundaries[index + 1][0], boundaries[index + 1][1]
+        else:
+            end, next_anchor = len(html), len(anchors)
+        sections.append(ArticleSection(article, offset, end, first_anchor, next_anchor - first_anchor))
+    return tuple(anchors), tuple(sections)
+
+
+def sanitize_law_html(html):
+    return bleach.clean(html or "", tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES, css_sanitizer=css_sanitizer)
+
+
+def _compile(content, content_hash):
+    html = sanitize_law_html(content)
+    body = html.encode('utf-8')
+    anchors, sections = build_content_index(html)
+    return LawContent(
+        content_hash=content_hash,
+        html=html,
+        anchors=anchors,
+        sections=sections,
+        gzip_body=gzip.compress(body, compresslevel=9, mtime=0),
+        brotli_body=brotli.compress(body) if brotli is not None else None,
+    )
+
+
+def compile_law_content(law):
+    """Compila e guarda o conteúdo de uma lei recém-salva (admin, depois do flush)."""
+    content_hash = law.content_hash or content_digest(law.content)
+    compiled = _compile(law.content, content_hash)
+    _content_cache.set((law.id, content_hash), compiled)
+    return compiled
+
+
+def get_law_content(law_id, content_hash=None):
+    """
+    Conteúdo compilado da lei. Com o hash em mãos (snapshot do catálogo ou linha
+    carregada sem 'content'), um acerto no cache não consulta o banco.
+    Retorna None se a lei não existir.
+    """
+    if content_hash is not None:
+        compiled = _content_cache.get((law_id, content_hash))
+        if compiled is not None:
+            return compiled
+
+    row = db.session.query(Law.content, Law.content_hash).filter(Law.id == law_id).first()
+    if row is None:
+        return None
+    content_hash = row.content_hash or content_digest(row.content)
+    compiled = _content_cache.get((law_id, content_hash))
+    if compiled is None:
+        compiled = _compile(row.content, content_hash)
+        _content_cache.set((law_id, content_hash), compiled)
+    return compiled
+
+
+def content_response(compiled):
+    """
+    Resposta HTTP com o fragmento de HTML na melhor codificação aceita pelo
+    cliente (br > gzip > identity), com ETag por codificação e 304 quando o
+    cliente já tem a mesma versão.
+    """
+    accepted = request.accept_encodings
+    if compiled.brotli_body is not None and accepted['br']:
+        encoding, body = 'br', compiled.brotli_body
+    elif accepted['gzip']:
+        encoding, body = 'gzip', compiled.gzip_body
+    else:
+        encoding, body = 'identity', compiled.html.encode('utf-8')
+
+    etag = compiled.etag(encoding)
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='text/html')
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def ensure_content_hashes(batch_size=200):
+    """Preenche Law.content_hash das leis antigas (inicialização). Retorna quantas."""
+    law_ids = [law_id for law_id, in db.session.query(Law.id).filter(Law.content_hash.is_(None))]
+    for start in range(0, len(law_ids), batch_size):
+        rows = db.session.query(Law.id, Law.content).filter(Law.id.in_(law_ids[start:start + batch_size]))
+        db.session.execute(update(Law), [
+            {'id': law_id, 'content_hash': content_digest(content)} for law_id, content in rows
+        ])
+    return len(law_ids)
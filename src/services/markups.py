@@ -0,0 +1,166 @@
+# src/services/markups.py
+# -*- coding: utf-8 -*-
+"""
+Marcações do aluno como lista base + operações pontuais.
+
+A lista base é UserLawMarkup.content_json; cada alteração feita pelo leitor
+vira uma linha em 'user_law_markup_op' (add/update/remove de uma marcação pelo
+'id'), então o custo de salvar depende do tamanho da alteração e não do total
+de marcações. A lista que o view_law recebe é a base com as operações aplicadas
+em ordem.
+
+Quando um usuário acumula COMPACT_THRESHOLD operações em uma lei, elas são
+incorporadas à base e apagadas (compact_markups); 'flask compact-markups' faz o
+mesmo para todos os pares usuário/lei com operações pendentes.
+
+O save_markup antigo (lista completa) continua valendo: replace_markups grava a
+lista na hora e apaga as operações anteriores a ela. A lista e a compactação
+travam a linha base antes de ler as operações, então o banco as serializa
+entre os workers.
+"""
+import datetime
+
+from sqlalchemy import delete, func, insert, select
+
+from src.extensions import db
+from src.models.notes import UserLawMarkup, UserLawMarkupOp
+from src.models.upsert import insert_ignore
+
+ADD = 'add'
+UPDATE = 'update'
+REMOVE = 'remove'
+
+MAX_OPS_PER_REQUEST = 500
+COMPACT_THRESHOLD = 64
+
+
+def parse_markup_ops(payload):
+    """
+    Valida {"ops": [{"op": "add", "markup": {...}}, {"op": "update", "id": ..., "markup": {...}},
+    {"op": "remove", "id": ...}]}. Retorna [(op, markup_id, data)] ou levanta ValueError.
+    """
+    raw_ops = (payload or {}).get('ops') if isinstance(payload, dict) else None
+    if not isinstance(raw_ops, list) or not raw_ops:
+        raise ValueError("Envie uma lista 'ops' com ao menos uma operação.")
+    if len(raw_ops) > MAX_OPS_PER_REQUEST:
+        raise ValueError(f"No máximo {MAX_OPS_PER_REQUEST} operações por requisição.")
+
+    ops = []
+    for raw in raw_ops:
+        if not isinstance(raw, dict) or raw.get('op') not in (ADD, UPDATE, REMOVE):
+            raise ValueError("Operação inválida.")
+        markup = raw.get('markup')
+        markup_id = raw.get('id')
+        if markup_id is None and isinstance(markup, dict):
+            markup_id = markup.get('id')
+        if not isinstance(markup_id, (str, int)) or not str(markup_id) or len(str(markup_id)) > 64:
+            raise ValueError("Cada operação precisa do 'id' da marcação.")
+        markup_id = str(markup_id)
+        if raw['op'] == REMOVE:
+            ops.append((REMOVE, markup_id, None))
+            continue
+        if not isinstance(markup, dict):
+            raise ValueError("Operações 'add' e 'update' precisam de 'markup'.")
+        ops.append((raw['op'], markup_id, dict(markup, id=markup.get('id', markup_id))))
+    return ops
+
+
+def apply_markup_ops(markups, ops):
+    """Aplica [(op, markup_id, data)] a uma lista de marcações, mantendo a ordem de inserção."""
+    by_id = {}
+    for index, markup in enumerate(markups or []):
+        if isinstance(markup, dict):
+            by_id[str(markup.get('id', f'_{index}'))] = markup
+    for op, markup_id, data in ops:
+        if op == ADD:
+            by_id[markup_id] = data
+        elif op == UPDATE:
+            if markup_id in by_id:
+                by_id[markup_id] = dict(by_id[markup_id], **data)
+        elif op == REMOVE:
+            by_id.pop(markup_id, None)
+    return list(by_id.values())
+
+
+def _ops_query(user_id, law_id):
+    return select(UserLawMarkupOp.id, UserLawMarkupOp.op, UserLawMarkupOp.markup_id, UserLawMarkupOp.data)\
+        .where(UserLawMarkupOp.user_id == user_id, UserLawMarkupOp.law_id == law_id)\
+        .order_by(UserLawMarkupOp.id)
+
+
+def get_user_markups(user_id, law_id):
+    """Lista completa de marcações do usuário na lei (base + operações)."""
+    base = db.session.query(UserLawMarkup.content_json).filter_by(user_id=user_id, law_id=law_id).scalar()
+    ops = [(op, markup_id, data) for _, op, markup_id, data in db.session.execute(_ops_query(user_id, law_id))]
+    return apply_markup_ops(base or [], ops)
+
+
+def _lock_base(user_id, law_id):
+    """Cria a linha base se preciso e a trava até o fim da transação."""
+    db.session.execute(insert_ignore(UserLawMarkup, ['user_id', 'law_id'], values={
+        'user_id': user_id, 'law_id': law_id, 'content': 'deprecated', 'content_json': [],
+        'updated_at': datetime.datetime.utcnow(),
+    }))
+    return db.session.query(UserLawMarkup).filter_by(user_id=user_id, law_id=law_id)\
+        .populate_existing().with_for_update().one()
+
+
+def _delete_ops_through(user_id, law_id, last_op_id):
+    db.session.execute(delete(UserLawMarkupOp).where(
+        UserLawMarkupOp.user_id == user_id,
+        UserLawMarkupOp.law_id == law_id,
+        UserLawMarkupOp.id <= last_op_id
+    ))
+
+
+def replace_markups(user_id, law_id, markups):
+    """
+    Grava a lista completa (save_markup antigo) como nova base e apaga as
+    operações anteriores a ela (sem commit).
+    """
+    base = _lock_base(user_id, law_id)
+    last_op_id = db.session.query(func.max(UserLawMarkupOp.id)).filter_by(
+        user_id=user_id, law_id=law_id
+    ).with_for_update().scalar()
+    base.content_json = markups
+    base.content = 'deprecated'
+    base.updated_at = datetime.datetime.utcnow()
+    if last_op_id is not None:
+        _delete_ops_through(user_id, law_id, last_op_id)
+
+
+def append_markup_ops(user_id, law_id, ops):
+    """
+    Grava as operações em um INSERT em lote (sem commit) e compacta o par se ele
+    passou de COMPACT_THRESHOLD operações. Retorna True se compactou.
+    """
+    now = datetime.datetime.utcnow()
+    db.session.execute(insert(UserLawMarkupOp), [
+        {'user_id': user_id, 'law_id': law_id, 'op': op, 'markup_id': markup_id, 'data': data, 'created_at': now}
+        for op, markup_id, data in ops
+    ])
+    pending_ops = db.session.query(func.count(UserLawMarkupOp.id)).filter_by(user_id=user_id, law_id=law_id).scalar()
+    return pending_ops >= COMPACT_THRESHOLD and compact_markups(user_id, law_id)
+
+
+def compact_markups(user_id, law_id):
+    """Incorpora as operações pendentes à lista base e as apaga (sem commit)."""
+    # A base é travada antes de ler as operações: duas compactações (ou uma
+    # compactação e um replace_markups) do mesmo par não leem as mesmas operações.
+    base = _lock_base(user_id, law_id)
+    rows = db.session.execute(_ops_query(user_id, law_id).with_for_update()).all()
+    if not rows:
+        return False
+    base.content_json = apply_markup_ops(
+        base.content_json or [], [(op, markup_id, data) for _, op, markup_id, data in rows]
+    )
+    base.content = 'deprecated'
+    base.updated_at = datetime.datetime.utcnow()
+    _delete_ops_through(user_id, law_id, rows[-1].id)
+    return True
+
+
+def compact_all_markups():
+    """Compacta todos os pares usuário/lei com operações (comando 'flask compact-markups')."""
+    pairs = db.session.execute(select(UserLawMarkupOp.user_id, UserLawMarkupOp.law_id).distinct()).all()
+    return sum(1 for user_id, law_id in pairs if compact_markups(user_id, law_id))
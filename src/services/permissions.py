@@ -0,0 +1,219 @@
+# src/services/permissions.py
+# -*- coding: utf-8 -*-
+"""
+Permissões de conteúdo por usuário.
+
+A chave do cache combina o id do usuário, a versão de permissões do próprio
+usuário (incrementada quando o admin altera os concursos dele) e a versão
+global 'permissions' (incrementada quando o admin altera a composição dos
+concursos). Assim o cache só é invalidado quando as entradas realmente mudam.
+
+Os conjuntos são lidos da tabela 'concurso_law_closure', mantida aqui a cada
+alteração de conteúdo feita pelo admin. Para filtrar consultas, use as cláusulas
+visible_*_clause, que expressam a restrição como EXISTS no próprio SQL em vez de
+listas IN com milhares de ids.
+"""
+import hashlib
+from typing import FrozenSet, NamedTuple, Optional
+
+from sqlalchemy import delete, exists, insert, select, union
+from sqlalchemy.orm import aliased
+
+from src.extensions import db
+from src.models.law import Law, Subject
+from src.models.concurso import concurso_law_association, concurso_law_closure
+from src.models.user import user_concurso_association
+from src.services.cache import LRUCache, bump_cache_version, get_cache_version
+
+PERMISSIONS_VERSION = 'permissions'
+
+
+class UserPermissions(NamedTuple):
+    concurso_ids: Optional[FrozenSet[int]]
+    law_ids: Optional[FrozenSet[int]]
+    subject_ids: Optional[FrozenSet[int]]
+
+
+# 'None' em cada campo significa "pode ver tudo".
+UNRESTRICTED = UserPermissions(None, None, None)
+# Usuário restrito sem nenhum concurso: conjuntos com um id inexistente,
+# para que os filtros continuem funcionando sem retornar nada.
+NO_ACCESS = UserPermissions(frozenset({-1}), frozenset({-1}), frozenset({-1}))
+
+# Valores: (UserPermissions, impressão digital dos conjuntos)
+_permissions_cache = LRUCache(maxsize=4096)
+
+
+def _cached_permissions(user):
+    key = (user.id, user.permissions_version or 0, get_cache_version(PERMISSIONS_VERSION))
+    cached = _permissions_cache.get(key)
+    if cached is None:
+        permissions = _load_permissions(user)
+        cached = (permissions, _fingerprint(permissions))
+        _permissions_cache.set(key, cached)
+    return cached
+
+
+def get_permissions(user):
+    """
+    Retorna os ids de concursos, leis e matérias que o usuário pode ver,
+    como conjuntos imutáveis. Retorna UNRESTRICTED se ele puder ver tudo.
+    """
+    if not _is_restricted(user):
+        return UNRESTRICTED
+    return _cached_permissions(user)[0]
+
+
+def get_permissions_fingerprint(user):
+    """
+    Resumo estável dos conjuntos de permissão do usuário. Usuários com os mesmos
+    concursos compartilham a mesma impressão digital, o que permite compartilhar
+    respostas em cache entre eles.
+    """
+    if not _is_restricted(user):
+        return 'all'
+    return _cached_permissions(user)[1]
+
+
+def permissions_cache_stats():
+    return _permissions_cache.stats()
+
+
+def _fingerprint(permissions):
+    digest = hashlib.sha1()
+    for ids in permissions:
+        digest.update(','.join(map(str, sorted(ids))).encode())
+        digest.update(b'|')
+    return digest.hexdigest()
+
+
+def _load_permissions(user):
+    # Uma única consulta: concursos do usuário + fecho de conteúdo de cada um.
+    rows = db.session.query(
+        user_concurso_association.c.concurso_id,
+        concurso_law_closure.c.law_id,
+        concurso_law_closure.c.subject_id
+    ).outerjoin(
+        concurso_law_closure,
+        concurso_law_closure.c.concurso_id == user_concurso_association.c.concurso_id
+    ).filter(user_concurso_association.c.user_id == user.id).all()
+
+    allowed_concurso_ids = frozenset(row.concurso_id for row in rows)
+    if not allowed_concurso_ids:
+        return NO_ACCESS
+
+    allowed_law_ids = frozenset(row.law_id for row in rows if row.law_id)
+    allowed_subject_ids = frozenset(row.subject_id for row in rows if row.subject_id)
+    return UserPermissions(allowed_concurso_ids, allowed_law_ids, allowed_subject_ids)
+
+
+def _is_restricted(user):
+    return user.is_authenticated and not user.can_see_all_concursos
+
+
+def visible_law_clause(user, law_id_column=Law.id):
+    """
+    Cláusula EXISTS que limita 'law_id_column' às leis visíveis para o usuário.
+    Retorna None se o usuário puder ver tudo. O tamanho do SQL não depende de
+    quantas leis o usuário pode ver.
+    """
+    if not _is_restricted(user):
+        return None
+    return exists().where(
+        concurso_law_closure.c.law_id == law_id_column,
+        concurso_law_closure.c.concurso_id == user_concurso_association.c.concurso_id,
+        user_concurso_association.c.user_id == user.id
+    )
+
+
+def visible_subject_clause(user, subject_id_column=Subject.id):
+    """Equivalente a visible_law_clause para ids de matéria."""
+    if not _is_restricted(user):
+        return None
+    return exists().where(
+        concurso_law_closure.c.subject_id == subject_id_column,
+        concurso_law_closure.c.concurso_id == user_concurso_association.c.concurso_id,
+        user_concurso_association.c.user_id == user.id
+    )
+
+
+def visible_concurso_clause(user, concurso_id_column):
+    """Equivalente a visible_law_clause para ids de concurso."""
+    if not _is_restricted(user):
+        return None
+    return exists().where(
+        user_concurso_association.c.concurso_id == concurso_id_column,
+        user_concurso_association.c.user_id == user.id
+    )
+
+
+def restrict_query(query, clause):
+    """Aplica uma das cláusulas acima a uma query, ignorando-a quando for None."""
+    return query if clause is None else query.filter(clause)
+
+
+def concurso_ids_for_laws(law_ids):
+    """Ids dos concursos que contêm diretamente alguma das leis informadas."""
+    if not law_ids:
+        return set()
+    rows = db.session.query(concurso_law_association.c.concurso_id)\
+        .filter(concurso_law_association.c.law_id.in_(law_ids)).distinct().all()
+    return {row.concurso_id for row in rows}
+
+
+def refresh_concurso_closure(concurso_ids=None):
+    """
+    Recalcula o fecho dos concursos informados (ou de todos, se None) dentro da
+    transação corrente e invalida o cache de permissões. Quem chama faz o commit.
+    """
+    if concurso_ids is not None:
+        concurso_ids = {int(cid) for cid in concurso_ids}
+        if not concurso_ids:
+            return
+
+    db.session.flush()
+
+    topic = aliased(Law)
+    parent = aliased(Law)
+    direct_laws = select(
+        concurso_law_association.c.concurso_id, topic.id, topic.subject_id
+    ).join(topic, topic.id == concurso_law_association.c.law_id)
+    implied_parents = select(
+        concurso_law_association.c.concurso_id, parent.id, parent.subject_id
+    ).join(topic, topic.id == concurso_law_association.c.law_id)\
+     .join(parent, parent.id == topic.parent_id)
+
+    delete_stmt = delete(concurso_law_closure)
+    if concurso_ids is not None:
+        direct_laws = direct_laws.where(concurso_law_association.c.concurso_id.in_(concurso_ids))
+        implied_parents = implied_parents.where(concurso_law_association.c.concurso_id.in_(concurso_ids))
+        delete_stmt = delete_stmt.where(concurso_law_closure.c.concurso_id.in_(concurso_ids))
+
+    db.session.execute(delete_stmt)
+    db.session.execute(
+        insert(concurso_law_closure).from_select(
+            ['concurso_id', 'law_id', 'subject_id'],
+            union(direct_laws, implied_parents)
+        )
+    )
+    invalidate_all_permissions()
+
+
+def ensure_concurso_closure():
+    """Preenche o fecho na inicialização caso a tabela tenha acabado de ser criada."""
+    closure_is_empty = db.session.query(concurso_law_closure.c.law_id).first() is None
+    has_associations = db.session.query(concurso_law_association.c.law_id).first() is not None
+    if closure_is_empty and has_associations:
+        refresh_concurso_closure()
+        return True
+    return False
+
+
+def invalidate_user_permissions(user):
+    """Chamar quando os concursos (ou o acesso total) de um usuário mudarem."""
+    user.increment_version('permissions_version')
+
+
+def invalidate_all_permissions():
+    """Chamar quando a composição de algum concurso mudar (leis, hierarquia ou exclusões)."""
+    bump_cache_version(PERMISSIONS_VERSION)
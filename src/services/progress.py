@@ -0,0 +1,119 @@
+# src/services/progress.py
+# -*- coding: utf-8 -*-
+"""
+Progresso do aluno como bitsets sobre o índice denso de tópicos do catálogo.
+
+Cada usuário tem três inteiros (bit i = tópico catalog.topics[i]):
+  - completed:   status 'concluido';
+  - in_progress: status 'em_andamento';
+  - touched:     existe algum registro em UserProgress (qualquer status).
+O progresso de um diploma, matéria ou concurso é um AND com a máscara
+correspondente do snapshot seguido de bit_count(), sem iterar registros.
+
+Os bitsets ficam em cache por (usuário, User.progress_version, versão do
+catálogo). As rotas que mudam o status de um tópico chamam
+record_progress_status antes do commit: a versão do usuário é incrementada
+(invalidando o cache nos outros workers) e, após o commit, o bitset deste
+processo é atualizado com operações de bit em vez de ser recarregado.
+"""
+from typing import NamedTuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from src.extensions import db
+from src.models.progress import UserProgress
+from src.services.cache import LRUCache
+from src.services.catalog import get_catalog
+
+COMPLETED = 'concluido'
+IN_PROGRESS = 'em_andamento'
+
+
+class ProgressBits(NamedTuple):
+    completed: int
+    in_progress: int
+    touched: int
+
+    def with_status(self, bit, status):
+        """Cópia com o tópico 'bit' no status informado."""
+        return ProgressBits(
+            self.completed | bit if status == COMPLETED else self.completed & ~bit,
+            self.in_progress | bit if status == IN_PROGRESS else self.in_progress & ~bit,
+            self.touched | bit,
+        )
+
+
+_progress_cache = LRUCache(maxsize=8192, ttl=3600)
+# Chave: (versão do catálogo, frozenset de leis permitidas). Poucos conjuntos distintos.
+_visible_mask_cache = LRUCache(maxsize=256, ttl=3600)
+
+
+def _load_progress_bits(user_id, catalog):
+    topic_bits = catalog.topic_bits
+    completed = in_progress = touched = 0
+    rows = db.session.query(UserProgress.law_id, UserProgress.status).filter(UserProgress.user_id == user_id)
+    for law_id, status in rows:
+        bit = topic_bits.get(law_id)
+        if bit is None:
+            continue
+        touched |= bit
+        if status == COMPLETED:
+            completed |= bit
+        elif status == IN_PROGRESS:
+            in_progress |= bit
+    return ProgressBits(completed, in_progress, touched)
+
+
+def get_progress_bits(user, catalog=None):
+    """Bitsets de progresso do usuário no snapshot informado (ou no atual)."""
+    catalog = catalog or get_catalog()
+    key = (user.id, user.progress_version or 0, catalog.version)
+    bits = _progress_cache.get(key)
+    if bits is None:
+        bits = _load_progress_bits(user.id, catalog)
+        _progress_cache.set(key, bits)
+    return bits
+
+
+def record_progress_status(user, law_id, status):
+    """
+    Chamar (antes do commit) sempre que um registro de UserProgress for criado
+    ou tiver o status alterado.
+    """
+    catalog = get_catalog()
+    # O UPDATE trava a linha do usuário: a versão anterior à nossa é new_version - 1,
+    # mesmo que outra requisição tenha incrementado depois da leitura de 'user'
+    new_version = user.increment_version('progress_version')
+    bit = catalog.topic_bits.get(law_id)
+    if bit is not None:
+        db.session.info.setdefault('progress_changes', []).append(
+            (user.id, new_version - 1, new_version, catalog.version, bit, status)
+        )
+
+
+def visible_topic_mask(catalog, permissions):
+    """Máscara dos tópicos que o usuário pode ver (permissions.law_ids; None = todos)."""
+    allowed_law_ids = permissions.law_ids
+    if allowed_law_ids is None:
+        return catalog.all_topics_mask
+    # frozenset guarda o próprio hash, então a chave é barata de comparar
+    key = (catalog.version, allowed_law_ids)
+    mask = _visible_mask_cache.get(key)
+    if mask is None:
+        mask = catalog.mask_for_ids(allowed_law_ids)
+        _visible_mask_cache.set(key, mask)
+    return mask
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_progress_changes(session):
+    for user_id, old_version, new_version, catalog_version, bit, status in session.info.pop('progress_changes', ()):
+        bits = _progress_cache.get((user_id, old_version, catalog_version))
+        if bits is not None:
+            _progress_cache.set((user_id, new_version, catalog_version), bits.with_status(bit, status))
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_progress_changes(session):
+    session.info.pop('progress_changes', None)
@@ -0,0 +1,202 @@
+# src/services/search.py
+# -*- coding: utf-8 -*-
+"""
+Busca textual (full-text) sobre títulos e conteúdo das leis.
+
+O texto pesquisável de cada lei (título + conteúdo sem HTML) fica na tabela
+'law_search_document', atualizada pelo admin em add_law/edit_law, junto com a
+versão normalizada (sem acentos/ordinais) de ambos. Os termos da busca passam
+pela mesma normalização, então "codigo" encontra "Código". O índice depende do
+banco:
+  - PostgreSQL: índice GIN sobre o tsvector em português do texto normalizado;
+  - SQLite (desenvolvimento/testes): tabela virtual FTS5 'law_search_fts',
+    sincronizada por triggers, com tokenizer que já ignora acentos;
+  - outros bancos: LIKE sobre o texto normalizado.
+Os resultados vêm ordenados por relevância e com um trecho destacado (<mark>).
+
+'autocomplete_cache' guarda as respostas completas do autocomplete, chaveadas
+pela busca normalizada, pelo tipo, pela impressão digital das permissões do
+aluno e pela versão do catálogo.
+"""
+import html
+import re
+
+import bleach
+from markupsafe import escape
+from sqlalchemy import and_, column, func, literal_column, select, table, update
+from sqlalchemy.orm import aliased
+
+from src.extensions import db
+from src.models.law import Law, LawSearchDocument, Subject
+from src.models.user import User
+from src.services.cache import LRUCache
+from src.services.text import normalize_search_text
+
+TS_CONFIG = 'portuguese'
+
+# Marcadores neutros usados pelo banco para destacar os termos; são trocados
+# por <mark> depois que o trecho é escapado.
+_HIGHLIGHT_START = '\x02'
+_HIGHLIGHT_END = '\x03'
+
+autocomplete_cache = LRUCache(maxsize=2048, ttl=600)
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def html_to_text(content):
+    """Remove as tags HTML e normaliza os espaços do conteúdo de uma lei."""
+    if not content:
+        return ""
+    plain = bleach.clean(content.replace('>', '> '), tags=[], strip=True)
+    return _WHITESPACE_RE.sub(' ', html.unescape(plain)).strip()
+
+
+def index_law(law):
+    """Cria ou atualiza o documento de busca de uma lei (sem commit)."""
+    document = db.session.get(LawSearchDocument, law.id)
+    if document is None:
+        document = LawSearchDocument(law_id=law.id)
+        db.session.add(document)
+    document.title = law.title
+    document.body = html_to_text(law.content)
+    return document
+
+
+def rebuild_search_index(batch_size=200):
+    """Reconstrói todos os documentos de busca a partir da tabela 'law'."""
+    LawSearchDocument.query.delete(synchronize_session=False)
+    rows = db.session.execute(
+        select(Law.id, Law.title, Law.content).order_by(Law.id).execution_options(yield_per=batch_size)
+    )
+    count = 0
+    for law_id, title, content in rows:
+        db.session.add(LawSearchDocument(law_id=law_id, title=title, body=html_to_text(content)))
+        count += 1
+        if count % batch_size == 0:
+            db.session.flush()
+    db.session.flush()
+    return count
+
+
+def ensure_search_index():
+    """Preenche o índice na inicialização caso a tabela tenha acabado de ser criada."""
+    if db.session.query(LawSearchDocument.law_id).first() is None and db.session.query(Law.id).first() is not None:
+        return rebuild_search_index()
+    return 0
+
+
+def backfill_normalized_columns(batch_size=500, only_missing=False):
+    """
+    Preenche as colunas normalizadas de leis, matérias e usuários (sem commit).
+    Novas gravações já são normalizadas pelos próprios modelos; isto cobre as
+    linhas antigas. Com 'only_missing', só as linhas cuja coluna normalizada
+    ainda está vazia. Os documentos de busca são refeitos por rebuild_search_index.
+    """
+    counts = {}
+    for model, source, target in (
+        (Law, Law.title, 'title_normalized'),
+        (Subject, Subject.name, 'name_normalized'),
+        (User, User.full_name, 'full_name_normalized'),
+    ):
+        query = select(model.id, source).order_by(model.id)
+        if only_missing:
+            query = query.where(source.isnot(None), getattr(model, target).is_(None))
+        rows = db.session.execute(query).all()
+        for start in range(0, len(rows), batch_size):
+            db.session.execute(update(model), [
+                {'id': row_id, target: normalize_search_text(value)}
+                for row_id, value in rows[start:start + batch_size]
+            ])
+        counts[model.__tablename__] = len(rows)
+    return counts
+
+
+def ensure_normalized_columns():
+    """
+    Na inicialização, preenche as colunas normalizadas que ainda estão vazias
+    (ex.: linhas anteriores à coluna). Retorna o número de linhas preenchidas.
+    """
+    return sum(backfill_normalized_columns(only_missing=True).values())
+
+
+def _query_terms(query_text):
+    return normalize_search_text(query_text).split()
+
+
+def _format_snippet(raw_snippet):
+    if not raw_snippet:
+        return None
+    safe = str(escape(raw_snippet))
+    return safe.replace(_HIGHLIGHT_START, '<mark>').replace(_HIGHLIGHT_END, '</mark>')
+
+
+def search_topics(query_text, filters=(), limit=7):
+    """
+    Busca tópicos (leis com 'parent_id') cujo título ou conteúdo contenham os
+    termos digitados. Cada termo é tratado como prefixo, pois a busca é usada
+    no autocomplete enquanto o aluno digita.
+
+    'filters' são cláusulas extras aplicadas sobre Law (ex.: permissões).
+    Retorna dicionários com: id, title, parent_title, snippet (HTML seguro).
+    """
+    terms = _query_terms(query_text)
+    if not terms:
+        return []
+
+    parent = aliased(Law)
+    dialect = db.engine.dialect.name
+
+    if dialect == 'postgresql':
+        ts_query = func.to_tsquery(TS_CONFIG, ' & '.join(f"{term}:*" for term in terms))
+        vector = func.to_tsvector(
+            TS_CONFIG, LawSearchDocument.title_normalized + ' ' + LawSearchDocument.body_normalized
+        )
+        rank = func.ts_rank(vector, ts_query).desc()
+        # O trecho sai do texto original (com acentos); palavras acentuadas podem
+        # aparecer sem destaque, mas o trecho continua legível.
+        snippet = func.ts_headline(
+            TS_CONFIG, LawSearchDocument.body, ts_query,
+            f"StartSel={_HIGHLIGHT_START}, StopSel={_HIGHLIGHT_END}, MaxWords=20, MinWords=8, MaxFragments=1"
+        )
+        match = vector.op('@@')(ts_query)
+        source = LawSearchDocument.__table__
+        law_id_column = LawSearchDocument.law_id
+    elif dialect == 'sqlite':
+        fts_table = table('law_search_fts', column('rowid'))
+        fts = literal_column('law_search_fts')
+        match_expr = ' '.join(f'"{term}"*' for term in terms)
+        rank = func.bm25(fts)
+        snippet = func.snippet(fts, 1, _HIGHLIGHT_START, _HIGHLIGHT_END, '…', 16)
+        match = fts.op('MATCH')(match_expr)
+        source = fts_table
+        law_id_column = fts_table.c.rowid
+    else:
+        like_filters = [
+            (LawSearchDocument.title_normalized + ' ' + LawSearchDocument.body_normalized).like(f"%{term}%")
+            for term in terms
+        ]
+        rank = Law.title
+        snippet = literal_column("NULL")
+        match = and_(*like_filters)
+        source = LawSearchDocument.__table__
+        law_id_column = LawSearchDocument.law_id
+
+    stmt = select(
+        Law.id, Law.title, parent.title.label('parent_title'), snippet.label('snippet')
+    ).select_from(source)\
+     .join(Law, Law.id == law_id_column)\
+     .outerjoin(parent, parent.id == Law.parent_id)\
+     .where(match, Law.parent_id.isnot(None), *filters)\
+     .order_by(rank)\
+     .limit(limit)
+
+    results = []
+    for row in db.session.execute(stmt):
+        results.append({
+            "id": row.id,
+            "title": row.title,
+            "parent_title": row.parent_title,
+            "snippet": _format_snippet(row.snippet),
+        })
+    return results
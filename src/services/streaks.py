@@ -0,0 +1,109 @@
+# src/services/streaks.py
+# -*- coding: utf-8 -*-
+"""
+Sequência de dias de estudo (streak) guardada em 'user_study_streak'.
+
+record_study_activity grava o dia em 'study_activity' (INSERT idempotente) e,
+se o dia é novo, chama record_study_day, que ajusta a linha em O(1): mantém a
+sequência se o último dia foi ontem, reinicia caso contrário. Um dia anterior
+ao último registrado (sessão offline sincronizada depois) faz recalcular só a
+linha daquele usuário. get_streak só lê a linha. rebuild_streaks recalcula tudo
+a partir de 'study_activity' (comando 'flask rebuild-study-streaks').
+"""
+from datetime import timedelta
+
+from sqlalchemy import insert, select
+
+from src.extensions import db
+from src.models.upsert import insert_ignore
+from src.models.user import StudyActivity, UserStudyStreak
+
+
+def record_study_activity(user_id, study_date):
+    """Registra o dia de estudo (sem commit). Retorna True se o dia era novo."""
+    inserted = db.session.execute(insert_ignore(
+        StudyActivity, ['user_id', 'study_date'], values={'user_id': user_id, 'study_date': study_date}
+    )).rowcount
+    if inserted:
+        record_study_day(user_id, study_date)
+    return bool(inserted)
+
+
+def record_study_day(user_id, study_date):
+    """Registra um dia de estudo na sequência do usuário (sem commit)."""
+    inserted = db.session.execute(insert_ignore(UserStudyStreak, ['user_id'], values={
+        'user_id': user_id, 'current_streak': 1, 'longest_streak': 1, 'last_study_date': study_date,
+    })).rowcount
+    if inserted:
+        return
+
+    streak = db.session.query(UserStudyStreak).filter_by(user_id=user_id)\
+        .populate_existing().with_for_update().one()
+    last_date = streak.last_study_date
+    if last_date is not None and study_date == last_date:
+        return
+    if last_date is not None and study_date < last_date:
+        # Dia anterior ao último registrado (sessão offline sincronizada depois):
+        # a sequência pode ter mudado no meio, então recalcula a linha do usuário.
+        rebuild_streaks([user_id])
+        db.session.expire(streak)
+        return
+    if last_date == study_date - timedelta(days=1):
+        streak.current_streak += 1
+    else:
+        streak.current_streak = 1
+    streak.last_study_date = study_date
+    streak.longest_streak = max(streak.longest_streak, streak.current_streak)
+
+
+def get_streak(user_id, today):
+    """
+    Retorna (sequência atual, maior sequência). A sequência atual só conta se o
+    último dia de estudo foi hoje ou ontem.
+    """
+    streak = db.session.get(UserStudyStreak, user_id)
+    if streak is None:
+        return 0, 0
+    is_alive = streak.last_study_date is not None and streak.last_study_date >= today - timedelta(days=1)
+    return (streak.current_streak if is_alive else 0), streak.longest_streak
+
+
+def rebuild_streaks(user_ids=None, batch_size=1000):
+    """
+    Recalcula as sequências a partir de 'study_activity' (de todos os usuários ou
+    só dos informados), dentro da transação corrente. Retorna o número de usuários.
+    """
+    delete_query = db.session.query(UserStudyStreak)
+    activities_query = select(StudyActivity.user_id, StudyActivity.study_date)\
+        .distinct()\
+        .order_by(StudyActivity.user_id, StudyActivity.study_date)
+    if user_ids is not None:
+        delete_query = delete_query.filter(UserStudyStreak.user_id.in_(user_ids))
+        activities_query = activities_query.where(StudyActivity.user_id.in_(user_ids))
+    delete_query.delete(synchronize_session=False)
+
+    streaks = {}
+    for user_id, study_date in db.session.execute(activities_query.execution_options(yield_per=batch_size)):
+        state = streaks.get(user_id)
+        if state is None:
+            streaks[user_id] = {'user_id': user_id, 'current_streak': 1, 'longest_streak': 1, 'last_study_date': study_date}
+            continue
+        if state['last_study_date'] == study_date - timedelta(days=1):
+            state['current_streak'] += 1
+        else:
+            state['current_streak'] = 1
+        state['last_study_date'] = study_date
+        state['longest_streak'] = max(state['longest_streak'], state['current_streak'])
+
+    values = list(streaks.values())
+    for start in range(0, len(values), batch_size):
+        db.session.execute(insert(UserStudyStreak.__table__), values[start:start + batch_size])
+    return len(values)
+
+
+def ensure_streaks():
+    """Preenche a tabela na inicialização caso ela tenha acabado de ser criada."""
+    if db.session.query(UserStudyStreak.user_id).first() is None \
+            and db.session.query(StudyActivity.id).first() is not None:
+        return rebuild_streaks()
+    return 0
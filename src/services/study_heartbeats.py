@@ -0,0 +1,245 @@
+# src/services/study_heartbeats.py
+# -*- coding: utf-8 -*-
+"""
+Tempo de estudo medido no servidor a partir de heartbeats do leitor.
+
+Enquanto o timer do leitor roda, o navegador manda um heartbeat (lei, tempo
+desde o último heartbeat confirmado) a cada poucos segundos. A rota só chama
+study_heartbeats.beat(...): o heartbeat cobre o intervalo [agora - tempo, agora],
+medido no relógio do servidor e limitado a STUDY_HEARTBEAT_IDLE_TIMEOUT_S, e
+estende a sessão aberta em memória do usuário, sem tocar no banco. A sessão é
+fechada quando:
+  - chega um heartbeat de outra lei, ou um que não encosta no fim dela;
+  - o leitor manda action='end' (pausa, salvar, aba escondida);
+  - passa STUDY_HEARTBEAT_IDLE_TIMEOUT_S sem heartbeat (termina no último).
+
+As sessões fechadas viram linhas de StudySession (entry_type 'heartbeat') e
+são gravadas em lote pela thread de src/services/write_behind.py, com o mesmo
+insert_study_sessions do endpoint em lote (rollup e atividade do dia incluídos).
+
+Cada worker tem o seu agregador, e o balanceador espalha os heartbeats de um
+mesmo timer entre eles: cada worker só vê pedaços da sessão. Por isso a
+gravação faz a união dos intervalos: os pedaços do lote que se sobrepõem ou se
+encostam (com folga de MERGE_GAP) às sessões 'heartbeat' já gravadas da mesma
+lei estendem essas linhas em vez de virar linhas novas, e o rollup recebe só a
+diferença. As linhas do usuário são travadas durante a gravação, então flushes
+de workers diferentes não se atropelam. Sessões ainda abertas no encerramento
+normal do processo são fechadas e gravadas (atexit).
+"""
+import datetime
+
+from sqlalchemy import delete, select, update
+
+from src.extensions import db
+from src.models.study import StudySession
+from src.models.user import User
+from src.services.access_buffer import bump_state_versions
+from src.services.streaks import record_study_activity
+from src.services.study_sessions import HEARTBEAT, insert_study_sessions
+from src.services.study_stats import add_study_time, local_study_date
+from src.services.write_behind import WriteBehindBuffer
+
+BEAT = 'beat'
+END = 'end'
+DISCARD = 'discard'
+HEARTBEAT_ACTIONS = (BEAT, END, DISCARD)
+
+# Buracos menores que isto entre dois intervalos (atraso de rede entre workers)
+# não separam sessões.
+MERGE_GAP = datetime.timedelta(seconds=5)
+
+
+class _OpenSession:
+    __slots__ = ('law_id', 'subject_id', 'started_at', 'last_at')
+
+    def __init__(self, law_id, subject_id, started_at, last_at):
+        self.law_id = law_id
+        self.subject_id = subject_id
+        self.started_at = started_at
+        self.last_at = last_at
+
+    @property
+    def seconds(self):
+        return int((self.last_at - self.started_at).total_seconds())
+
+
+def _seconds(start, end):
+    return int((end - start).total_seconds())
+
+
+class StudyHeartbeatAggregator(WriteBehindBuffer):
+    config_prefix = 'STUDY_HEARTBEAT'
+    default_interval_ms = 5000
+
+    def __init__(self, app=None):
+        self._open = {}       # user_id -> _OpenSession
+        self._completed = []  # linhas de StudySession prontas para gravar
+        super().__init__(app)
+
+    def init_app(self, app):
+        app.config.setdefault('STUDY_HEARTBEAT_IDLE_TIMEOUT_S', 90)
+        super().init_app(app)
+
+    @property
+    def _idle_timeout(self):
+        return datetime.timedelta(seconds=self._config('IDLE_TIMEOUT_S'))
+
+    def beat(self, user_id, law_id, subject_id, elapsed_seconds=0, action=BEAT, now=None):
+        """
+        Registra um heartbeat que cobre os últimos 'elapsed_seconds' (limitados ao
+        tempo de ociosidade). Retorna os segundos da sessão aberta neste worker
+        (0 se ela foi fechada ou descartada). Não toca na sessão do banco (exceto
+        no modo síncrono, ao gravar sessões fechadas).
+        """
+        now = now or datetime.datetime.utcnow()
+        covered = min(datetime.timedelta(seconds=max(elapsed_seconds, 0)), self._idle_timeout)
+        start = now - covered
+        with self._lock:
+            session = self._open.get(user_id)
+            if session is not None and (session.law_id != law_id or start > session.last_at + MERGE_GAP):
+                self._close(user_id)
+                session = None
+
+            if action == DISCARD:
+                self._open.pop(user_id, None)
+            elif session is None:
+                self._open[user_id] = _OpenSession(law_id, subject_id, start, now)
+            else:
+                # Reenvios e heartbeats fora de ordem só podem estender a sessão
+                session.started_at = min(session.started_at, start)
+                session.last_at = max(session.last_at, now)
+
+            if action == END:
+                self._close(user_id)
+            session = self._open.get(user_id)
+            seconds = session.seconds if session is not None else 0
+            pending = self._pending_count()
+        self._after_record(pending)
+        return seconds
+
+    def close_all(self):
+        """Fecha todas as sessões abertas (encerramento do processo)."""
+        with self._lock:
+            for user_id in list(self._open):
+                self._close(user_id)
+
+    def shutdown(self):
+        self.close_all()
+        super().shutdown()
+
+    def _close(self, user_id):
+        # Chamar com self._lock; intervalos sem duração (só o primeiro heartbeat) não contam
+        session = self._open.pop(user_id)
+        if session.seconds > 0:
+            self._completed.append({
+                'user_id': user_id,
+                'law_id': session.law_id,
+                'subject_id': session.subject_id,
+                'start_time': session.started_at,
+                'end_time': session.last_at,
+                'duration_seconds': session.seconds,
+                'entry_type': HEARTBEAT,
+                'recorded_at': session.last_at,
+                'client_session_id': f"hb-{session.law_id}-{session.started_at.strftime('%Y%m%d%H%M%S%f')}",
+            })
+
+    def _close_idle(self):
+        deadline = datetime.datetime.utcnow() - self._idle_timeout
+        for user_id in [user_id for user_id, session in self._open.items() if session.last_at < deadline]:
+            self._close(user_id)
+
+    def _pending_count(self):
+        # A thread de flush passa por aqui a cada intervalo: é onde as sessões ociosas são fechadas
+        self._close_idle()
+        return len(self._completed)
+
+    def _take(self):
+        batch, self._completed = self._completed, []
+        return batch
+
+    def _batch_keys(self, batch):
+        return [(row['user_id'], row['client_session_id']) for row in batch]
+
+    def _subset(self, batch, keys):
+        return [row for row in batch if (row['user_id'], row['client_session_id']) in keys]
+
+    def _requeue(self, batch, dropped):
+        self._completed[:0] = [row for row in batch if (row['user_id'], row['client_session_id']) not in dropped]
+
+    def _write(self, batch):
+        try:
+            user_ids = self._merge_sessions(batch)
+            if user_ids:
+                bump_state_versions(user_ids)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def _merge_sessions(self, batch):
+        """
+        Grava o lote como união com as sessões 'heartbeat' já gravadas (sem
+        commit). Retorna os usuários cujas sessões mudaram.
+        """
+        user_ids = sorted({row['user_id'] for row in batch})
+        # Flushes de outros workers para os mesmos usuários esperam este terminar
+        db.session.execute(select(User.id).where(User.id.in_(user_ids)).order_by(User.id).with_for_update())
+        stored = db.session.execute(
+            select(StudySession.id, StudySession.user_id, StudySession.law_id, StudySession.subject_id,
+                   StudySession.start_time, StudySession.end_time, StudySession.duration_seconds,
+                   StudySession.recorded_at)
+            .where(StudySession.user_id.in_(user_ids))
+            .where(StudySession.entry_type == HEARTBEAT)
+            .where(StudySession.end_time >= min(row['start_time'] for row in batch) - MERGE_GAP)
+            .where(StudySession.start_time <= max(row['end_time'] for row in batch) + MERGE_GAP)
+        ).all()
+
+        # Pedaços novos e linhas gravadas, por usuário e lei, em ordem de início
+        items = [(row['user_id'], row['law_id'], row['start_time'], row['end_time'], 'new', row) for row in batch]
+        items += [(row.user_id, row.law_id, row.start_time, row.end_time, 'stored', row) for row in stored]
+        items.sort(key=lambda item: item[:3])
+
+        groups = []
+        for user_id, law_id, start, end, kind, row in items:
+            group = groups[-1] if groups else None
+            if group and group['key'] == (user_id, law_id) and start <= group['end'] + MERGE_GAP:
+                group['end'] = max(group['end'], end)
+            else:
+                group = {'key': (user_id, law_id), 'start': start, 'end': end, 'new': [], 'stored': []}
+                groups.append(group)
+            group[kind].append(row)
+
+        to_insert = []
+        changed_users = set()
+        for group in groups:
+            if not group['new']:
+                continue
+            start, end = group['start'], group['end']
+            if not group['stored']:
+                first = group['new'][0]
+                to_insert.append(dict(
+                    first, start_time=start, end_time=end, duration_seconds=_seconds(start, end), recorded_at=end
+                ))
+                continue
+            # Estende a linha mais antiga do grupo e apaga as outras que ela passa a cobrir
+            keep, *absorbed = sorted(group['stored'], key=lambda row: row.id)
+            user_id = keep.user_id
+            for row in group['stored']:
+                add_study_time(user_id, row.subject_id, local_study_date(row.recorded_at),
+                               -(row.duration_seconds or 0), sessions=-1)
+            if absorbed:
+                db.session.execute(delete(StudySession).where(StudySession.id.in_([row.id for row in absorbed])))
+            duration = _seconds(start, end)
+            db.session.execute(update(StudySession).where(StudySession.id == keep.id).values(
+                start_time=start, end_time=end, duration_seconds=duration, recorded_at=end
+            ))
+            add_study_time(user_id, keep.subject_id, local_study_date(end), duration, sessions=1)
+            record_study_activity(user_id, local_study_date(end))
+            changed_users.add(user_id)
+
+        if to_insert:
+            changed_users.update(row['user_id'] for row in insert_study_sessions(to_insert))
+        return changed_users
+
+
+study_heartbeats = StudyHeartbeatAggregator()
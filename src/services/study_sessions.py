@@ -0,0 +1,171 @@
+# src/services/study_sessions.py
+# -*- coding: utf-8 -*-
+"""
+Gravação de sessões de estudo em lote.
+
+O timer do leitor manda cada sessão com um 'client_session_id' gerado no
+navegador; a chave única (user_id, client_session_id) torna o reenvio
+idempotente, então o PWA pode reenviar a fila inteira depois de uma queda de
+rede sem duplicar tempo. parse_study_session valida um item usando o catálogo
+em memória (lei -> matéria) e insert_study_sessions grava o lote com um INSERT
+em lote, um upsert no rollup por (dia, matéria) e um registro de atividade por
+dia distinto.
+"""
+import datetime
+import logging
+
+from sqlalchemy import insert, select, tuple_
+
+from src.extensions import db
+from src.models.study import StudySession
+from src.services.streaks import record_study_activity
+from src.services.study_stats import add_study_time, local_study_date
+
+AUTO = 'auto'
+MANUAL = 'manual'
+HEARTBEAT = 'heartbeat'  # medida no servidor (src/services/study_heartbeats.py)
+
+MAX_SESSIONS_PER_REQUEST = 200
+MAX_SESSION_AGE_DAYS = 30
+DURATION_TOLERANCE_SECONDS = 5
+
+
+class UnknownLaw(LookupError):
+    pass
+
+
+def _parse_datetime(value):
+    """ISO 8601 (com 'Z' ou fuso) -> datetime UTC sem fuso; None se vazio."""
+    if not value:
+        return None
+    moment = datetime.datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def parse_study_session(data, catalog, now=None, require_client_id=False):
+    """
+    Valida uma sessão enviada pelo cliente e devolve o dicionário de colunas de
+    StudySession (sem user_id). Levanta UnknownLaw se a lei não existe e
+    ValueError com a mensagem para o usuário nos demais casos.
+    """
+    now = now or datetime.datetime.utcnow()
+    if not isinstance(data, dict):
+        raise ValueError("Sessão inválida.")
+
+    client_session_id = data.get('client_session_id')
+    if client_session_id is not None:
+        client_session_id = str(client_session_id)
+        if not client_session_id or len(client_session_id) > 64:
+            raise ValueError("client_session_id deve ter entre 1 e 64 caracteres.")
+    elif require_client_id:
+        raise ValueError("client_session_id é obrigatório.")
+
+    law_id = data.get('law_id')
+    duration_seconds = data.get('duration_seconds')
+    entry_type = data.get('entry_type', AUTO)
+    if not law_id or duration_seconds is None:
+        raise ValueError("law_id e duration_seconds são obrigatórios.")
+    try:
+        law_id = int(law_id)
+        duration_seconds = int(duration_seconds)
+    except (TypeError, ValueError):
+        raise ValueError("law_id e duration_seconds devem ser números inteiros.")
+    if duration_seconds <= 0:
+        raise ValueError("A duração da sessão deve ser maior que zero.")
+    if entry_type not in (AUTO, MANUAL):
+        raise ValueError("entry_type deve ser 'auto' ou 'manual'.")
+
+    law = catalog.laws.get(law_id)
+    if law is None:
+        raise UnknownLaw(law_id)
+    if not law.subject_id:
+        raise ValueError("A lei não está associada a uma matéria válida. Não é possível registrar o tempo de estudo.")
+
+    start_time = end_time = None
+    try:
+        if entry_type == AUTO:
+            start_time = _parse_datetime(data.get('start_time'))
+            end_time = _parse_datetime(data.get('end_time'))
+        recorded_at = _parse_datetime(data.get('recorded_at'))
+    except ValueError:
+        raise ValueError("Formato de data/hora inválido para start_time, end_time ou recorded_at.")
+
+    if entry_type == AUTO:
+        if not start_time or not end_time:
+            raise ValueError("start_time e end_time são obrigatórios para sessões automáticas.")
+        calculated_duration = (end_time - start_time).total_seconds()
+        if abs(calculated_duration - duration_seconds) > DURATION_TOLERANCE_SECONDS:
+            logging.warning(f"Duração calculada ({calculated_duration}) difere da enviada ({duration_seconds}) para law {law_id}.")
+            duration_seconds = int(calculated_duration)
+            if duration_seconds <= 0:
+                raise ValueError("end_time deve ser posterior a start_time.")
+
+    # Sessões reenviadas depois de uma queda contam no dia em que aconteceram
+    if recorded_at is None or recorded_at > now:
+        recorded_at = now
+    if recorded_at < now - datetime.timedelta(days=MAX_SESSION_AGE_DAYS):
+        raise ValueError(f"Sessões com mais de {MAX_SESSION_AGE_DAYS} dias não são aceitas.")
+
+    return {
+        'law_id': law_id,
+        'subject_id': law.subject_id,
+        'start_time': start_time,
+        'end_time': end_time,
+        'duration_seconds': duration_seconds,
+        'entry_type': entry_type,
+        'recorded_at': recorded_at,
+        'client_session_id': client_session_id,
+    }
+
+
+def existing_client_session_ids(rows):
+    """{(user_id, client_session_id)} das linhas cuja chave já está gravada."""
+    keys = {(row['user_id'], row['client_session_id']) for row in rows if row.get('client_session_id')}
+    if not keys:
+        return set()
+    found = set()
+    keys = list(keys)
+    for start in range(0, len(keys), 500):
+        found.update(db.session.execute(
+            select(StudySession.user_id, StudySession.client_session_id)
+            .where(tuple_(StudySession.user_id, StudySession.client_session_id).in_(keys[start:start + 500]))
+        ).all())
+    return found
+
+
+def insert_study_sessions(rows):
+    """
+    Grava as sessões (dicionários de parse_study_session com user_id), sem commit.
+    Sessões cujo (user_id, client_session_id) já existe, no banco ou antes no
+    próprio lote, são ignoradas. Retorna a lista das sessões inseridas.
+    """
+    seen = existing_client_session_ids(rows)
+    new_rows = []
+    for row in rows:
+        key = (row['user_id'], row.get('client_session_id'))
+        if key[1]:
+            if key in seen:
+                continue
+            seen.add(key)
+        new_rows.append(row)
+    if not new_rows:
+        return []
+
+    db.session.execute(insert(StudySession), new_rows)
+
+    totals = {}
+    study_days = set()
+    for row in new_rows:
+        study_date = local_study_date(row['recorded_at'])
+        key = (row['user_id'], study_date, row['subject_id'])
+        seconds, count = totals.get(key, (0, 0))
+        totals[key] = (seconds + row['duration_seconds'], count + 1)
+        study_days.add((row['user_id'], study_date))
+    for (user_id, study_date, subject_id), (seconds, count) in totals.items():
+        add_study_time(user_id, subject_id, study_date, seconds, sessions=count)
+    # Em ordem de data, para que a sequência avance dia a dia
+    for user_id, study_date in sorted(study_days, key=lambda item: (item[1], item[0])):
+        record_study_activity(user_id, study_date)
+    return new_rows
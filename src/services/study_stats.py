@@ -0,0 +1,113 @@
+# src/services/study_stats.py
+# -*- coding: utf-8 -*-
+"""
+Estatísticas de tempo de estudo a partir da tabela 'user_study_rollup'.
+
+record_study_session soma cada sessão ao total do dia (data de São Paulo) e
+da matéria; as consultas do dashboard leem apenas essas linhas, então o custo
+depende do número de dias estudados e não do número de sessões.
+rebuild_study_rollup refaz a tabela a partir de 'study_sessions'.
+"""
+import datetime
+from datetime import timedelta
+
+import pytz
+from sqlalchemy import case, func, insert, select
+
+from src.extensions import db
+from src.models.law import Subject
+from src.models.study import StudySession, UserStudyRollup
+from src.models.upsert import upsert
+
+SAO_PAULO_TZ = pytz.timezone('America/Sao_Paulo')
+
+_rollup = UserStudyRollup.__table__
+
+
+def local_study_date(recorded_at_utc=None):
+    """Data de São Paulo correspondente a um datetime UTC sem fuso (padrão: agora)."""
+    moment = recorded_at_utc or datetime.datetime.utcnow()
+    return pytz.utc.localize(moment).astimezone(SAO_PAULO_TZ).date()
+
+
+def add_study_time(user_id, subject_id, study_date, seconds, sessions=1):
+    """Soma uma sessão ao total diário do usuário na matéria (sem commit)."""
+    db.session.execute(upsert(
+        _rollup, ['user_id', 'study_date', 'subject_id'], increment=['total_seconds', 'session_count'],
+        values={
+            'user_id': user_id, 'study_date': study_date, 'subject_id': subject_id,
+            'total_seconds': seconds, 'session_count': sessions,
+        }
+    ))
+
+
+def rebuild_study_rollup(user_ids=None, batch_size=1000):
+    """
+    Recalcula a tabela a partir de 'study_sessions' (de todos os usuários ou só
+    dos informados), dentro da transação corrente. Retorna o número de linhas.
+    """
+    delete_query = db.session.query(UserStudyRollup)
+    sessions_query = select(
+        StudySession.user_id, StudySession.subject_id, StudySession.recorded_at, StudySession.duration_seconds
+    ).order_by(StudySession.id)
+    if user_ids is not None:
+        delete_query = delete_query.filter(UserStudyRollup.user_id.in_(user_ids))
+        sessions_query = sessions_query.where(StudySession.user_id.in_(user_ids))
+    delete_query.delete(synchronize_session=False)
+
+    totals = {}
+    rows = db.session.execute(sessions_query.execution_options(yield_per=batch_size))
+    for user_id, subject_id, recorded_at, duration_seconds in rows:
+        key = (user_id, local_study_date(recorded_at), subject_id)
+        seconds, count = totals.get(key, (0, 0))
+        totals[key] = (seconds + (duration_seconds or 0), count + 1)
+
+    values = [
+        {'user_id': user_id, 'study_date': study_date, 'subject_id': subject_id,
+         'total_seconds': seconds, 'session_count': count}
+        for (user_id, study_date, subject_id), (seconds, count) in totals.items()
+    ]
+    for start in range(0, len(values), batch_size):
+        db.session.execute(insert(_rollup), values[start:start + batch_size])
+    return len(values)
+
+
+def ensure_study_rollup():
+    """Preenche a tabela na inicialização caso ela tenha acabado de ser criada."""
+    if db.session.query(UserStudyRollup.user_id).first() is None \
+            and db.session.query(StudySession.id).first() is not None:
+        return rebuild_study_rollup()
+    return 0
+
+
+def get_study_time_totals(user_id, today):
+    """Segundos estudados no total, nos últimos 7 dias (incluindo hoje) e hoje."""
+    week_start = today - timedelta(days=6)
+    totals = db.session.query(
+        func.sum(UserStudyRollup.total_seconds).label('total'),
+        func.sum(case((UserStudyRollup.study_date >= week_start, UserStudyRollup.total_seconds), else_=0)).label('weekly'),
+        func.sum(case((UserStudyRollup.study_date == today, UserStudyRollup.total_seconds), else_=0)).label('daily'),
+    ).filter(UserStudyRollup.user_id == user_id).one()
+    return {'total': totals.total or 0, 'weekly': totals.weekly or 0, 'daily': totals.daily or 0}
+
+
+def get_study_time_by_subject(user_id):
+    """Lista (nome da matéria, segundos) do usuário, da mais estudada para a menos."""
+    total = func.sum(UserStudyRollup.total_seconds)
+    return db.session.query(Subject.name, total.label('total_duration_seconds'))\
+        .join(UserStudyRollup, UserStudyRollup.subject_id == Subject.id)\
+        .filter(UserStudyRollup.user_id == user_id)\
+        .group_by(Subject.name)\
+        .order_by(total.desc())\
+        .all()
+
+
+def get_daily_study_seconds(user_id, start_date, end_date):
+    """Mapa {data: segundos} do usuário entre as duas datas (inclusive)."""
+    rows = db.session.query(UserStudyRollup.study_date, func.sum(UserStudyRollup.total_seconds))\
+        .filter(
+            UserStudyRollup.user_id == user_id,
+            UserStudyRollup.study_date >= start_date,
+            UserStudyRollup.study_date <= end_date,
+        ).group_by(UserStudyRollup.study_date).all()
+    return {study_date: seconds for study_date, seconds in rows}
@@ -0,0 +1,32 @@
+# src/services/text.py
+# -*- coding: utf-8 -*-
+"""
+Normalização de texto para busca em português.
+
+normalize_search_text("Código Penal - Art. 5º") -> "codigo penal art 5"
+- remove acentos e passa para minúsculas;
+- unifica os indicadores ordinais (5º, 5°, 5o -> 5; 1ª, 1a -> 1);
+- troca pontuação por espaço e colapsa espaços repetidos.
+
+content_digest(html) é o sha256 do conteúdo de uma lei (Law.content_hash).
+"""
+import hashlib
+import re
+import unicodedata
+
+_ORDINAL_RE = re.compile(r'(\d)(?:[oa]|\s*°)(?![a-z0-9])')
+_NON_WORD_RE = re.compile(r'[^a-z0-9]+')
+
+
+def normalize_search_text(value):
+    if not value:
+        return ""
+    # NFKD também decompõe 'º' em 'o' e 'ª' em 'a'.
+    decomposed = unicodedata.normalize('NFKD', value)
+    folded = ''.join(ch for ch in decomposed if not unicodedata.combining(ch)).lower()
+    folded = _ORDINAL_RE.sub(r'\1', folded)
+    return _NON_WORD_RE.sub(' ', folded).strip()
+
+
+def content_digest(value):
+    return hashlib.sha256((value or "").encode('utf-8')).hexdigest()
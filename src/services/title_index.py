@@ -0,0 +1,169 @@
+# src/services/title_index.py
+# -*- coding: utf-8 -*-
+"""
+Índice em memória dos títulos do catálogo para o autocomplete.
+
+Indexa títulos de tópicos, títulos de diplomas e nomes de matérias, já
+normalizados (sem acento, minúsculos, ordinais unificados), em uma tabela de
+trigramas. Uma busca intersecta as listas dos trigramas de cada termo e
+confirma o resultado verificando se cada termo é início de alguma palavra do
+título, sem ir ao banco.
+
+O índice é montado na inicialização e, quando a versão do catálogo muda, é
+atualizado de forma incremental: só as entradas alteradas têm seus trigramas
+removidos/adicionados. Cada atualização publica novas estruturas (cópia na
+escrita), então leituras concorrentes nunca veem um estado parcial.
+"""
+import threading
+from typing import NamedTuple, Optional
+
+from src.extensions import db
+from src.models.law import Law, Subject
+from src.services.catalog import get_catalog_version
+from src.services.text import normalize_search_text
+
+TOPIC = 'topic'
+DIPLOMA = 'diploma'
+SUBJECT = 'subject'
+
+
+class TitleEntry(NamedTuple):
+    kind: str
+    id: int
+    title: str
+    normalized: str
+    parent_id: Optional[int]
+    parent_title: Optional[str]
+    subject_id: Optional[int]
+
+
+def _trigrams(normalized):
+    padded = f" {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _term_trigrams(term):
+    # Termos da busca não recebem espaço à direita, para casar como prefixo de palavra.
+    # Termos de um caractere não geram trigramas e são verificados só na confirmação.
+    padded = f" {term}"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TitleIndex:
+    def __init__(self):
+        self.version = None
+        self._entries = {}
+        self._postings = {}
+        self._lock = threading.Lock()
+
+    def _load_entries(self):
+        entries = {}
+        # As colunas normalizadas só ficam vazias em linhas antigas ainda não
+        # preenchidas pelo 'flask backfill-normalized-columns'.
+        law_rows = db.session.query(
+            Law.id, Law.title, Law.title_normalized, Law.parent_id, Law.subject_id
+        ).all()
+        titles_by_id = {row.id: row.title for row in law_rows}
+        for row in law_rows:
+            kind = TOPIC if row.parent_id else DIPLOMA
+            entries[(kind, row.id)] = TitleEntry(
+                kind, row.id, row.title, row.title_normalized or normalize_search_text(row.title),
+                row.parent_id, titles_by_id.get(row.parent_id), row.subject_id
+            )
+        for subject_id, name, name_normalized in db.session.query(
+            Subject.id, Subject.name, Subject.name_normalized
+        ).all():
+            entries[(SUBJECT, subject_id)] = TitleEntry(
+                SUBJECT, subject_id, name, name_normalized or normalize_search_text(name),
+                None, None, subject_id
+            )
+        return entries
+
+    def refresh(self, version=None):
+        """Sincroniza o índice com o banco, alterando apenas as entradas que mudaram."""
+        with self._lock:
+            version = get_catalog_version() if version is None else version
+            if version == self.version:
+                return
+            new_entries = self._load_entries()
+            old_entries = self._entries
+            postings = dict(self._postings)
+            touched = {}
+
+            def posting_for(gram):
+                if gram not in touched:
+                    touched[gram] = set(postings.get(gram, ()))
+                return touched[gram]
+
+            for key, entry in old_entries.items():
+                new_entry = new_entries.get(key)
+                if new_entry is None or new_entry.normalized != entry.normalized:
+                    for gram in _trigrams(entry.normalized):
+                        posting_for(gram).discard(key)
+            for key, entry in new_entries.items():
+                old_entry = old_entries.get(key)
+                if old_entry is None or old_entry.normalized != entry.normalized:
+                    for gram in _trigrams(entry.normalized):
+                        posting_for(gram).add(key)
+
+            for gram, keys in touched.items():
+                if keys:
+                    postings[gram] = frozenset(keys)
+                else:
+                    postings.pop(gram, None)
+
+            self._entries = new_entries
+            self._postings = postings
+            self.version = version
+
+    def ensure_current(self):
+        version = get_catalog_version()
+        if version != self.version:
+            self.refresh(version)
+
+    def search(self, query, kinds, allowed_law_ids=None, allowed_subject_ids=None, limit=10):
+        """
+        Retorna as entradas dos tipos pedidos em que cada termo da busca é o início
+        de alguma palavra do título. Títulos que começam com a busca vêm primeiro,
+        depois os mais curtos.
+        """
+        terms = normalize_search_text(query).split()
+        if not terms:
+            return []
+
+        entries = self._entries
+        postings = self._postings
+        candidates = None
+        for term in terms:
+            for gram in _term_trigrams(term):
+                keys = postings.get(gram)
+                if not keys:
+                    return []
+                candidates = set(keys) if candidates is None else candidates & keys
+                if not candidates:
+                    return []
+        if candidates is None:
+            candidates = entries.keys()
+
+        normalized_query = ' '.join(terms)
+        matches = []
+        for key in candidates:
+            entry = entries.get(key)
+            if entry is None or entry.kind not in kinds:
+                continue
+            words = entry.normalized.split()
+            if not all(any(word.startswith(term) for word in words) for term in terms):
+                continue
+            if entry.kind == SUBJECT:
+                if allowed_subject_ids is not None and entry.id not in allowed_subject_ids:
+                    continue
+            elif allowed_law_ids is not None and entry.id not in allowed_law_ids:
+                continue
+            is_prefix = entry.normalized.startswith(normalized_query)
+            matches.append((not is_prefix, len(entry.normalized), entry.normalized, entry))
+
+        matches.sort(key=lambda item: item[:3])
+        return [item[3] for item in matches[:limit]]
+
+
+title_index = TitleIndex()
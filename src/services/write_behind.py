@@ -0,0 +1,186 @@
+# src/services/write_behind.py
+# -*- coding: utf-8 -*-
+"""
+Base dos buffers write-behind do processo (acessos, autosave).
+
+Uma subclasse guarda eventos em memória sob self._lock e implementa:
+  - _pending_count(): quantas chaves estão pendentes;
+  - _take(): tira tudo o que está pendente (um lote);
+  - _write(batch): grava o lote na sessão atual e faz o commit;
+  - _batch_keys(batch): as chaves do lote;
+  - _requeue(batch, dropped): devolve um lote que falhou, menos as chaves em
+    'dropped', sem sobrescrever valores mais novos;
+  - _subset(batch, keys): o lote só com as chaves informadas;
+  - _take_keys(keys) (opcional): tira só as chaves informadas, para flush(keys).
+
+A base cuida da thread de flush (a cada <PREFIXO>_INTERVAL_MS, ou antes quando
+<PREFIXO>_BATCH_SIZE chaves se acumulam), do limite da fila (com
+<PREFIXO>_MAX_PENDING chaves a própria requisição grava o lote), do flush no
+encerramento do processo (atexit) e do modo síncrono (<PREFIXO>_SYNC, padrão:
+app.testing), em que cada evento é gravado na hora com a sessão da requisição.
+
+Quando uma chave chega a <PREFIXO>_MAX_ATTEMPTS lotes com falha seguidos, ela
+é gravada sozinha uma última vez; se ainda falhar, é descartada e registrada no
+log (logging.error). Assim um valor inválido não é reenviado para sempre nem
+leva junto as chaves que estavam no mesmo lote.
+"""
+import atexit
+import logging
+import os
+import threading
+
+
+class WriteBehindBuffer:
+    config_prefix = None
+    default_interval_ms = 2000
+    default_batch_size = 500
+    default_max_pending = 10000
+    default_max_attempts = 5
+
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+        self._attempts = {}  # chave -> falhas seguidas
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        prefix = self.config_prefix
+        app.config.setdefault(f'{prefix}_INTERVAL_MS', self.default_interval_ms)
+        app.config.setdefault(f'{prefix}_BATCH_SIZE', self.default_batch_size)
+        app.config.setdefault(f'{prefix}_MAX_PENDING', self.default_max_pending)
+        app.config.setdefault(f'{prefix}_MAX_ATTEMPTS', self.default_max_attempts)
+        app.config.setdefault(f'{prefix}_SYNC', app.testing)
+        app.extensions[prefix.lower()] = self
+        self.app = app
+        atexit.register(self.shutdown)
+
+    def _config(self, name):
+        return self.app.config[f'{self.config_prefix}_{name}']
+
+    @property
+    def is_sync(self):
+        return bool(self._config('SYNC'))
+
+    @property
+    def pending(self):
+        with self._lock:
+            return self._pending_count()
+
+    def _after_record(self, pending):
+        """Chamar depois de enfileirar um evento, fora de self._lock."""
+        if self.is_sync or pending >= self._config('MAX_PENDING'):
+            self.flush()
+            return
+        self._ensure_thread()
+        if pending >= self._config('BATCH_SIZE'):
+            self._wakeup.set()
+
+    def flush(self, keys=None):
+        """
+        Grava os eventos pendentes (ou só os de 'keys') em uma transação.
+        Retorna quantas chaves foram gravadas.
+        """
+        with self._flush_lock:
+            with self._lock:
+                if keys is None:
+                    count = self._pending_count()
+                    batch = self._take() if count else None
+                else:
+                    batch = self._take_keys(keys)
+                    count = len(self._batch_keys(batch))
+            if not count:
+                return 0
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                logging.error(f"Erro ao gravar o lote de {self.config_prefix} ({count} chaves): {e}")
+                return self._handle_failure(batch)
+            self._written(batch)
+            return count
+
+    def _write_batch(self, batch):
+        if self.is_sync:
+            # Na requisição: usa a sessão dela, como o código síncrono fazia
+            self._write(batch)
+        else:
+            with self.app.app_context():
+                self._write(batch)
+
+    def _written(self, batch):
+        if self._attempts:
+            with self._lock:
+                for key in self._batch_keys(batch):
+                    self._attempts.pop(key, None)
+        self._after_write(batch)
+
+    def _handle_failure(self, batch):
+        """Conta a falha por chave e devolve o lote à fila. Retorna quantas chaves foram gravadas."""
+        max_attempts = self._config('MAX_ATTEMPTS')
+        exhausted = []
+        with self._lock:
+            for key in self._batch_keys(batch):
+                attempts = self._attempts.get(key, 0) + 1
+                self._attempts[key] = attempts
+                if attempts >= max_attempts:
+                    exhausted.append(key)
+
+        # Última tentativa de cada chave esgotada, sozinha: separa o valor inválido dos vizinhos
+        written, dropped = set(), set()
+        for key in exhausted:
+            single = self._subset(batch, {key})
+            try:
+                self._write_batch(single)
+            except Exception as e:
+                logging.error(f"{self.config_prefix}: chave {key!r} descartada após {max_attempts} tentativas: {e}")
+                dropped.add(key)
+                continue
+            written.add(key)
+            self._written(single)
+
+        with self._lock:
+            for key in dropped:
+                self._attempts.pop(key, None)
+            self._requeue(batch, frozenset(written | dropped))
+        return len(written)
+
+    def _take_keys(self, keys):
+        raise NotImplementedError
+
+    def _after_write(self, batch):
+        pass
+
+    def _ensure_thread(self):
+        # Depois de um fork (gunicorn), a thread do processo pai não existe no filho
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name=self.config_prefix.lower().replace('_', '-'), daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        interval = self._config('INTERVAL_MS') / 1000.0
+        while not self._stopping:
+            self._wakeup.wait(interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def shutdown(self):
+        """Para a thread e grava o que estiver pendente (registrado em atexit)."""
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout=5)
+        if self.app is not None:
+            self.flush()
+        self._stopping = False